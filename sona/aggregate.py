@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import heapq
+import logging
+from collections import defaultdict
+
+from astroid.nodes import Class
+
+from sona.symbols import Symbol
+from sona.locators import find_immediate_name, get_all_parents
+
+log = logging.getLogger(__name__)
+
+
+def group_by_file(result):
+    if isinstance(result, Symbol):
+        return os.path.relpath(result.filename)
+    return os.path.relpath(result.root().file)
+
+
+def group_by_name(result):
+    if isinstance(result, Symbol):
+        return result.name
+    return find_immediate_name(result)
+
+
+def group_by_class(result):
+    """Groups by the class result is, or is in. Results outside any
+    class are grouped under the empty string."""
+    if isinstance(result, Symbol):
+        if result.kind == 'cls':
+            return result.name
+        return result.cls or ''
+    if isinstance(result, Class):
+        return result.name
+    for parent in get_all_parents(result):
+        if isinstance(parent, Class):
+            return parent.name
+    return ''
+
+
+GROUP_KEYS = {
+    'file': group_by_file,
+    'name': group_by_name,
+    'class': group_by_class,
+    }
+
+
+class Aggregator(object):
+    """Counts search results, optionally grouped by one of the keys in
+    GROUP_KEYS, without ever formatting or keeping hold of them.
+
+    Only the counts are kept in memory, so it is safe to use on the
+    results of a whole-repository search. If there is no grouping,
+    every query in queries is counted even if it finds nothing."""
+
+    def __init__(self, group_by=None, top=None, queries=()):
+        self.key_fn = GROUP_KEYS[group_by] if group_by is not None else None
+        self.top = top
+        self._counts = defaultdict(int)
+        if self.key_fn is None:
+            for query in queries:
+                self._counts[(query, None)] = 0
+
+    def add(self, query, result):
+        key = self.key_fn(result) if self.key_fn is not None else None
+        self._counts[(query, key)] += 1
+
+    def counts(self):
+        """Returns a list of (query, key, count) tuples, largest
+        counts first. Ties are broken by query and key so the order
+        is stable."""
+        items = [(query, key, count) for (query, key), count in self._counts.iteritems()]
+        sort_key = lambda item: (-item[2], item[0], item[1])
+        if self.top is not None:
+            return heapq.nsmallest(self.top, items, key=sort_key)
+        return sorted(items, key=sort_key)
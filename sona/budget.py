@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import signal
+import logging
+import contextlib
+
+from sona.exceptions import FileTooLargeError, ParseTimeoutError
+
+log = logging.getLogger(__name__)
+
+
+class Budget(object):
+    """Per-file limits on how much a search may spend on any one
+    file, so that a single pathological module -- generated protobuf
+    output, vendored minified code -- cannot stall a search.
+
+    max_size is the largest file, in bytes, that will be parsed, and
+    max_time the number of seconds parsing and searching a file may
+    take. Either may be None for no limit.
+
+    If fallback is True, files that go over budget are searched with
+    the cheaper fallback extractor (see sona.symbols) instead of
+    being skipped."""
+
+    def __init__(self, max_size=None, max_time=None, fallback=False):
+        self.max_size = max_size
+        self.max_time = max_time
+        self.fallback = fallback
+
+    def check_size(self, filename, size=None):
+        """Raises FileTooLargeError if filename is over max_size.
+        size, if given, is taken as its size instead of the size of
+        the file on disk."""
+        if not self.max_size:
+            return
+        if size is None:
+            size = os.path.getsize(filename)
+        if size > self.max_size:
+            raise FileTooLargeError(filename, size, self.max_size)
+
+    @contextlib.contextmanager
+    def time_limit(self, filename):
+        """Context manager that raises ParseTimeoutError inside its
+        body if it runs for longer than max_time.
+
+        The limit is enforced with SIGALRM, which can only interrupt
+        the main thread; elsewhere no limit is enforced. Worker
+        processes run their jobs in their main thread, so a stuck
+        parse is cancelled there too rather than blocking the pool."""
+        if not self.max_time:
+            yield
+            return
+
+        def timeout(signum, frame):
+            raise ParseTimeoutError(filename, self.max_time)
+
+        try:
+            old_handler = signal.signal(signal.SIGALRM, timeout)
+        except ValueError:
+            log.debug('Not in the main thread; cannot limit the time spent on %s',
+                      filename)
+            yield
+            return
+        signal.setitimer(signal.ITIMER_REAL, self.max_time)
+        try:
+            yield
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, old_handler)
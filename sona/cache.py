@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import logging
+import cPickle as pickle
+from collections import OrderedDict
+
+from sona.index import save_pickle
+
+log = logging.getLogger(__name__)
+
+# Name of the result cache file, kept next to the index.
+RESULT_CACHE_FILENAME = 'results.pickle'
+
+# Bumped whenever the format of the cache changes, or what the
+# Symbols in it are extracted as.
+RESULT_CACHE_VERSION = 2
+
+# Number of queries whose results are kept; the least recently used
+# ones are dropped first.
+MAX_CACHED_QUERIES = 64
+
+
+def normalize_query(tree):
+    """Returns the key a parsed query tree is cached under. Queries
+    that only differ in whitespace or quoting share a key."""
+    return json.dumps(tree, separators=(',', ':'))
+
+
+def file_set_generation(digests):
+    """Returns the generation of a set of files, given a dict of their
+    content digests: a digest of the whole set that changes whenever
+    a file is added, removed or changed."""
+    generation = hashlib.sha1()
+    for filename in sorted(digests):
+        generation.update('{0}\0{1}\0'.format(filename, digests[filename]))
+    return generation.hexdigest()
+
+
+class ResultCache(object):
+    """Caches the results of queries, as Symbols, per file.
+
+    Each query's entry holds the generation of the set of files it was
+    last run against and, for every file, the content digest its
+    results were found in. A query run against the same generation is
+    answered straight from the cache; otherwise only the files whose
+    digest changed have to be searched again.
+
+    The cache lives in memory and, if it has a path, is saved there
+    after each search."""
+
+    def __init__(self, path=None, max_queries=MAX_CACHED_QUERIES):
+        self.path = path
+        self.max_queries = max_queries
+        self.entries = OrderedDict()
+        self.dirty = False
+
+    @classmethod
+    def open(cls, directory):
+        """Returns the cache saved in directory, or an empty one that
+        will be saved there if there is none (or it is unreadable)."""
+        cache = cls(os.path.join(directory, RESULT_CACHE_FILENAME))
+        try:
+            with open(cache.path, 'rb') as f:
+                version, entries = pickle.load(f)
+        except IOError:
+            return cache
+        except Exception, err:
+            log.warning('Ignoring unreadable result cache %s: %s', cache.path, err)
+            return cache
+        if version == RESULT_CACHE_VERSION:
+            cache.entries = entries
+        return cache
+
+    def save(self):
+        """Saves the cache to path if it changed since it was
+        opened."""
+        if self.path is None or not self.dirty:
+            return
+        save_pickle(self.path, (RESULT_CACHE_VERSION, self.entries))
+        self.dirty = False
+
+    def _entry(self, key):
+        """Returns the entry for key, marking it as the most recently
+        used, or None."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.entries[key] = entry
+        return entry
+
+    def is_current(self, key, generation):
+        """Returns True if the results of key are those of the file set
+        generation."""
+        entry = self._entry(key)
+        return entry is not None and entry['generation'] == generation
+
+    def get(self, key, filename, digest):
+        """Returns the list of Symbols key found in filename when its
+        content digest was digest, or None if they are not known."""
+        entry = self._entry(key)
+        if entry is None:
+            return None
+        cached = entry['files'].get(filename)
+        if cached is None or cached[0] != digest:
+            return None
+        return cached[1]
+
+    def put(self, key, filename, digest, symbols):
+        """Records symbols as what key found in filename when its
+        content digest was digest."""
+        entry = self._entry(key)
+        if entry is None:
+            entry = self.entries[key] = {'generation': None, 'files': {}}
+            while len(self.entries) > self.max_queries:
+                self.entries.popitem(last=False)
+        entry['files'][filename] = (digest, symbols)
+        self.dirty = True
+
+    def set_generation(self, key, generation, filenames):
+        """Records that the results of key are those of the file set
+        generation, made up of filenames. Files that are no longer in
+        the set are forgotten."""
+        entry = self._entry(key)
+        if entry is None or entry['generation'] == generation:
+            return
+        filenames = set(filenames)
+        for filename in [filename for filename in entry['files']
+                         if filename not in filenames]:
+            del entry['files'][filename]
+        entry['generation'] = generation
+        self.dirty = True
@@ -2,13 +2,26 @@
 #  -*- coding: utf-8 -*-
 
 import os
+import sys
 import subprocess
 import logging
 import argparse
 import astroid
 import fnmatch
 from sona.search import SemanticSearcher, GrepOutputFormatter, JSONOutputFormatter
-from pyparsing import ParseException
+from sona.history import HistorySearcher, GitObjectError
+from sona.walker import DirectoryWalker, DEFAULT_EXCLUDES
+from sona.budget import Budget
+from sona.index import SymbolIndex, INDEX_DIRNAME, INDEX_FILENAME
+from sona.cache import ResultCache
+from sona.gitindex import GitIndex
+from sona.schedule import CostModel
+from sona.explain import QueryPlan
+from sona.packages import mount_packages, default_cache_dir
+from sona import memory
+from sona.aggregate import GROUP_KEYS
+from sona.fuzzy import FUZZY_TOP_K
+from sona.exceptions import QuerySyntaxError
 
 log = logging.getLogger('sona')
 
@@ -30,12 +43,28 @@ LOG_LEVELS = {
 # Command to call git with. NOTE: Output must be null-terminated!
 GIT_LS_FILES_COMMAND = ('git', 'ls-tree', '-r', '-z', '--full-tree', '--name-only', 'HEAD')
 
+# Command to list the files that changed between two revisions, or
+# between a revision and the working tree if only one is given.
+# NOTE: Output must be null-terminated!
+GIT_DIFF_FILES_COMMAND = ('git', 'diff', '--name-only', '-z', '--diff-filter=ACMR')
+
+# Command to find the commit two revisions last had in common, that a
+# change made on a branch is diffed against.
+GIT_MERGE_BASE_COMMAND = ('git', 'merge-base')
+
+# Command to list untracked files that are not ignored. NOTE: Output
+# must be null-terminated!
+GIT_UNTRACKED_FILES_COMMAND = ('git', 'ls-files', '-z', '--others', '--exclude-standard')
+
 # Command to get the git root directory.
 GIT_GET_ROOT = ('git', 'rev-parse', '--show-cdup')
 
 class NotGitRepoError(Exception):
     pass
 
+class GitCommandError(Exception):
+    pass
+
 def get_git_root():
     """Attempts to get the Git root directory from os.curdir via Git
     commandline.
@@ -83,14 +112,81 @@ def create_argparser():
 
 usage: sona search EXPRESSION FILES
 usage (with git): sona search EXPRESSION
+usage (batch): sona --query-file FILE
+usage (position): sona at FILE:LINE[:COL] [callers|siblings]
 
 This directory is {0}git controlled.
 
 """.format('' if is_in_git_repo() else 'not ')
     parser = argparse.ArgumentParser(description=desc, formatter_class=argparse.RawDescriptionHelpFormatter,
                                      usage=argparse.SUPPRESS)
-    parser.add_argument('search', nargs='+', help='search for something (default)', metavar='search')
+    parser.add_argument('search', nargs='*', help='search for something (default)', metavar='search')
+    parser.add_argument('--query-file', type=argparse.FileType('r'), metavar='FILE',
+                        help='read queries, one per line, from FILE ("-" for stdin) and '
+                        'evaluate them all in a single pass')
     parser.add_argument('--no-git', action='store_true', help='do not use git to find files [default: %(default)s]')
+    parser.add_argument('-p', '--path', action='append', default=[], metavar='PATH',
+                        help='search PATH, a file, directory or glob pattern, instead of the '
+                        'git repository; may be given more than once')
+    parser.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                        help='do not walk directories whose name matches GLOB; may be given '
+                        'more than once')
+    parser.add_argument('--no-default-excludes', action='store_true',
+                        help='walk directories normally skipped, like virtualenvs and {0} '
+                        '[default: %(default)s]'.format(', '.join(DEFAULT_EXCLUDES[:4])))
+    parser.add_argument('--since', metavar='REV',
+                        help='only search files changed since HEAD forked from REV (REV...HEAD)')
+    parser.add_argument('--changed', action='store_true',
+                        help='only search files with uncommitted changes, including untracked '
+                        'files; with --since, also files changed since REV [default: %(default)s]')
+    parser.add_argument('--revs', metavar='A..B',
+                        help='search every commit in the revision range A..B instead of the working tree')
+    parser.add_argument('-A', '--after-context', type=int, default=0, metavar='NUM',
+                        help='print NUM lines of source after each result')
+    parser.add_argument('-B', '--before-context', type=int, default=0, metavar='NUM',
+                        help='print NUM lines of source before each result')
+    parser.add_argument('-C', '--context', type=int, metavar='NUM',
+                        help='print NUM lines of source before and after each result')
+    parser.add_argument('-c', '--count', action='store_true',
+                        help='only print the number of results [default: %(default)s]')
+    parser.add_argument('--group-by', choices=sorted(GROUP_KEYS),
+                        help='count the results grouped by file, name or class (implies --count)')
+    parser.add_argument('--top', type=int, metavar='K',
+                        help='only print the K largest counts (implies --count)')
+    parser.add_argument('--fuzzy-top', type=int, default=FUZZY_TOP_K, metavar='K',
+                        help='keep the results of the K names closest to the value of a '
+                        'query that ends with a ~ assertion [default: %(default)s]')
+    parser.add_argument('--index', action='store_true',
+                        help='keep a persistent symbol index in {0}/ at the root of the search '
+                        'and answer the queries it can answer from it [default: %(default)s]'
+                        .format(INDEX_DIRNAME))
+    parser.add_argument('--cache', action='store_true',
+                        help='cache the results of every query in {0}/ at the root of the '
+                        'search, and only search the files that changed when a query is '
+                        'repeated [default: %(default)s]'.format(INDEX_DIRNAME))
+    parser.add_argument('--packages', action='append', metavar='DIR', type=os.path.abspath,
+                        help='also search the distributions installed in DIR, a '
+                        'site-packages directory, from indexes of them shared in {0}; '
+                        'may be given more than once'.format(default_cache_dir()))
+    parser.add_argument('--explain', action='store_true',
+                        help='once the search is done, print how every assertion was '
+                        'answered, how many results it had at each step and how long it '
+                        'took, to stderr; searches with a single process [default: %(default)s]')
+    parser.add_argument('--memory-report', action='store_true',
+                        help='once the search is done, print how much memory listing, '
+                        'parsing, walking, filtering and formatting took, the files that '
+                        'allocated the most and the peak RSS of every process, to stderr '
+                        '[default: %(default)s]')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='search with N worker processes [default: %(default)s]')
+    parser.add_argument('--max-file-size', type=int, metavar='BYTES',
+                        help='do not parse files larger than BYTES')
+    parser.add_argument('--max-parse-time', type=float, metavar='SECONDS',
+                        help='give up on files that take longer than SECONDS to parse and search')
+    parser.add_argument('--over-budget', choices=['skip', 'fallback'], default='skip',
+                        help='what to do with files over --max-file-size or --max-parse-time: '
+                        'skip them, or search them with a cheaper, less precise, '
+                        'extractor [default: %(default)s]')
     parser.add_argument('--log-level', choices=['debug', 'info', 'warning', 'error', 'critical', 'none'],
                         help='show only logs from this level and above', default='error')
     parser.add_argument('-o', '--output-format', choices=['emacs', 'json', 'grep'], default='grep',
@@ -98,6 +194,37 @@ This directory is {0}git controlled.
     return parser
 
 
+# What `sona at` can list besides the symbols enclosing a position.
+POSITION_RELATIONS = ('callers', 'siblings')
+
+
+def parse_position(spec):
+    """Returns (filename, lineno, col_offset) from a FILE:LINE[:COL]
+    spec, with col_offset None if it is not given. Columns count from
+    1, like editors do, and col_offset from 0. Raises ValueError if
+    spec is not one."""
+    parts = spec.rsplit(':', 2)
+    if len(parts) == 3 and parts[1].isdigit() and parts[2].isdigit():
+        return parts[0], int(parts[1]), max(int(parts[2]) - 1, 0)
+    parts = spec.rsplit(':', 1)
+    if len(parts) == 2 and parts[0] and parts[1].isdigit():
+        return parts[0], int(parts[1]), None
+    raise ValueError('{0!r} is not FILE:LINE[:COL]'.format(spec))
+
+
+def read_query_file(fileobj):
+    """Returns a list of the queries in fileobj, one per line.
+
+    Blank lines and lines starting with a '#' are ignored, so a
+    query file can be commented."""
+    queries = []
+    for line in fileobj:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            queries.append(line)
+    return queries
+
+
 class Sona(object):
     """User-Interface Class for the commandline
 
@@ -129,20 +256,273 @@ class Sona(object):
         finally:
             os.chdir(old_cwd)
 
+    @staticmethod
+    def iter_git_changed_files(since=None, uncommitted=False, pattern='*.py'):
+        """Yields every file matching pattern that has changed.
+
+        If since is given, that is every file changed on HEAD's side
+        since it forked from the revision since -- since...HEAD, as a
+        pull request would show it -- leaving out whatever changed on
+        since's side alone. If uncommitted is True, staged, unstaged
+        and untracked (but not ignored) files are included as well.
+        Deleted files are never yielded.
+
+        Like iter_git_files, this raises an exception if it is invoked
+        from outside a git-controlled directory."""
+        log.debug('Reading changed files from git repository...')
+        old_cwd = os.curdir
+        try:
+            root_dir = get_git_root()
+            os.chdir(root_dir)
+
+            if uncommitted:
+                base = 'HEAD'
+                if since:
+                    command = GIT_MERGE_BASE_COMMAND + (since, 'HEAD')
+                    log.debug('Calling Git command: "%s"', ','.join(command))
+                    proc = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE)
+                    output, err_output = proc.communicate()
+                    if proc.returncode != 0:
+                        raise GitCommandError(err_output.strip() or
+                                              'No common ancestor of {0} and HEAD'.format(since))
+                    base = output.strip()
+                # Diffing against a single revision compares it with
+                # the working tree, which picks up staged and unstaged
+                # changes in one go.
+                commands = [GIT_DIFF_FILES_COMMAND + (base, '--'),
+                            GIT_UNTRACKED_FILES_COMMAND]
+            else:
+                commands = [GIT_DIFF_FILES_COMMAND + (since + '...HEAD', '--')]
+
+            seen = set()
+            for command in commands:
+                log.debug('Calling Git command: "%s"', ','.join(command))
+                proc = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+                output, err_output = proc.communicate()
+                if proc.returncode != 0:
+                    raise GitCommandError(err_output.strip())
+                files = [filename for filename in output.split('\0') if filename]
+                log.debug('\tFound %d changed files', len(files))
+                for filename in files:
+                    if filename in seen:
+                        continue
+                    seen.add(filename)
+                    absfn = os.path.abspath(filename)
+                    # A file can be changed since a revision and still
+                    # be missing from the working tree.
+                    if fnmatch.fnmatch(absfn, pattern) and os.path.isfile(absfn):
+                        yield filename
+        finally:
+            os.chdir(old_cwd)
+
+    def iter_files(self):
+        """Yields the files to search based on the commandline
+        arguments."""
+        if self.args.since or self.args.changed:
+            return self.iter_git_changed_files(self.args.since, self.args.changed)
+        return self.iter_git_files()
+
+    def iter_walked_files(self, paths):
+        """Yields every file under paths by walking the filesystem,
+        without git."""
+        excludes = list(self.args.exclude)
+        if not self.args.no_default_excludes:
+            excludes.extend(DEFAULT_EXCLUDES)
+        walker = DirectoryWalker(excludes=excludes,
+                                 skip_virtualenvs=not self.args.no_default_excludes)
+        return walker.iter_files(paths)
+
+    def make_searcher(self):
+        """Returns a SemanticSearcher with all the files to search
+        added to it, or None if there is nothing to search."""
+        if self.args.memory_report:
+            memory.start()
+        budget = None
+        if self.args.max_file_size or self.args.max_parse_time:
+            budget = Budget(max_size=self.args.max_file_size,
+                            max_time=self.args.max_parse_time,
+                            fallback=self.args.over_budget == 'fallback')
+        ss = SemanticSearcher(budget=budget, jobs=self.args.jobs,
+                              fuzzy_top=self.args.fuzzy_top)
+        if self.args.path:
+            if self.args.since or self.args.changed:
+                log.error('--since and --changed need git; they cannot be used with -p/--path.')
+                return None
+            ss.add_file_source(self.iter_walked_files(self.args.path))
+        elif self.args.no_git:
+            if self.args.since or self.args.changed:
+                log.error('--since and --changed need git; they cannot be used with --no-git.')
+                return None
+            ss.add_file_source(self.iter_walked_files([os.curdir]))
+        else:
+            try:
+                ss.add_files(memory.iter_phase('list', self.iter_files()))
+            except NotGitRepoError:
+                if self.args.since or self.args.changed:
+                    log.error('Not in a git repository. --since and --changed need git.')
+                    return None
+                log.info('Not in a git repository. Searching the current directory instead.')
+                ss.add_file_source(self.iter_walked_files([os.curdir]))
+            except GitCommandError, err:
+                log.error('Git could not list the changed files: %s', err)
+                return None
+        # Listing the git files has moved us to the root of the
+        # repository, if there is one.
+        changed_only = bool(self.args.since or self.args.changed)
+        if changed_only:
+            # Queries that relate files to one another, such as
+            # mod:dependents, are still answered from an index of
+            # every file, the saved one if there is one: files git
+            # knows to be unchanged are not read again.
+            ss.index_files = list(self.iter_git_files())
+        if self.args.index or (changed_only and os.path.isfile(
+                os.path.join(INDEX_DIRNAME, INDEX_FILENAME))):
+            ss.index = SymbolIndex.open(os.path.abspath(INDEX_DIRNAME))
+        if self.args.cache:
+            ss.result_cache = ResultCache.open(os.path.abspath(INDEX_DIRNAME))
+        if (self.args.index or self.args.cache or changed_only) and not self.args.no_git:
+            ss.git_index = GitIndex.read(os.curdir)
+        for site_dir in self.args.packages or ():
+            if not os.path.isdir(site_dir):
+                log.error('%s is not a directory.', site_dir)
+                return None
+            ss.packages.extend(mount_packages(site_dir))
+        if self.args.explain:
+            ss.plan = QueryPlan()
+        if self.args.jobs > 1 and (self.args.index or self.args.cache):
+            ss.cost_model = CostModel.open(os.path.abspath(INDEX_DIRNAME))
+        return ss
+
+    @property
+    def aggregating(self):
+        return bool(self.args.count or self.args.group_by or self.args.top)
+
     def make_search_query(self, query):
-        ss = SemanticSearcher()
-        # for fn in fnmatch.filter(os.listdir('.'), '*.py'):
-        #     ss.add_file(fn)
+        ss = self.make_searcher()
+        if ss is None:
+            return
+        if self.aggregating:
+            counts = ss.aggregate([query], self.args.group_by, self.args.top)
+            self.formatter.print_all_counts(counts)
+        else:
+            results = ss.search(query)
+            self.formatter.print_all_results(results)
+        self.report_over_budget(ss)
+        self.report_plan(ss)
+        self.report_memory()
+
+    def make_batch_query(self, queries):
+        """Evaluates every query in queries in one pass over the
+        files. Each result is tagged with the query that found it."""
+        ss = self.make_searcher()
+        if ss is None:
+            return
+        if self.aggregating:
+            counts = ss.aggregate(queries, self.args.group_by, self.args.top)
+            self.formatter.print_all_counts(counts, tagged=True)
+        else:
+            results = ss.search_many(queries)
+            self.formatter.print_all_tagged_results(results)
+        self.report_over_budget(ss)
+        self.report_plan(ss)
+        self.report_memory()
+
+    def report_over_budget(self, ss):
+        """Lists the files that went over budget on stderr, once all
+        the results have been printed."""
+        if not ss.over_budget:
+            return
+        action = 'searched with the fallback extractor' if ss.budget.fallback else 'skipped'
+        sys.stderr.write('{0} file(s) went over budget and were {1}:\n'.format(
+            len(ss.over_budget), action))
+        for filename, reason in ss.over_budget:
+            sys.stderr.write('  {0}\n'.format(reason))
+
+    def report_plan(self, ss):
+        """Prints the query plan on stderr, once all the results have
+        been printed, if there is one."""
+        if ss.plan is None:
+            return
+        for line in ss.plan.format():
+            sys.stderr.write(line + '\n')
+
+    @staticmethod
+    def report_memory():
+        """Prints the memory report on stderr, once all the results
+        have been printed, if one was being recorded."""
+        report = memory.stop()
+        if report is None:
+            return
+        for line in report.format():
+            sys.stderr.write(line + '\n')
+
+    def make_history_query(self, query):
+        """Searches for query in every commit in the revision range
+        given by --revs. Each result is tagged with the commits it
+        was found in."""
+        try:
+            os.chdir(get_git_root())
+        except NotGitRepoError:
+            log.error('Not in a git repository. --revs needs git.')
+            return
+        hs = HistorySearcher(self.args.revs)
+        try:
+            self.formatter.print_all_tagged_results(hs.search(query), tag='commits')
+        except GitObjectError, err:
+            log.error('Git could not read the history: %s', err)
+
+    def make_position_query(self, words):
+        """Prints the functions, classes and module that enclose the
+        position FILE:LINE[:COL] in words, outermost first, or the
+        callers or siblings of the innermost one.
+
+        With --index they are answered from the index, which only
+        re-reads the file if it changed since it was indexed."""
+        if not 1 <= len(words) <= 2 or (len(words) == 2 and
+                                        words[1] not in POSITION_RELATIONS):
+            log.error('usage: sona at FILE:LINE[:COL] [callers|siblings]')
+            return
+        try:
+            filename, lineno, col_offset = parse_position(words[0])
+        except ValueError, err:
+            log.error('%s', err)
+            return
+        filename = os.path.abspath(filename)
         if not self.args.no_git:
             try:
-                ss.add_files(self.iter_git_files())
+                os.chdir(get_git_root())
             except NotGitRepoError:
-                # Just do nothing. We need a fall through - such as
-                # using the current directory?
-                log.error('Not in a git repository. Specify file pattern instead.')
-                return
-        results = ss.search(query)
-        self.formatter.print_all_results(results)
+                pass
+        if self.args.index:
+            index = SymbolIndex.open(os.path.abspath(INDEX_DIRNAME))
+        else:
+            index = SymbolIndex(root=os.getcwd())
+        git_index = None
+        if self.args.index and not self.args.no_git:
+            git_index = GitIndex.read(os.curdir)
+        digest = git_index.digest(filename) if git_index is not None else None
+        try:
+            index.update(filename, digest=digest)
+        except IOError, err:
+            log.error('Cannot read %s: %s', filename, err)
+            return
+        index.save()
+        results = index.enclosing(filename, lineno, col_offset)
+        if results and len(words) == 2:
+            related = getattr(index, words[1])(results[-1])
+            results = sorted(related, key=lambda symbol: (
+                symbol.filename, symbol.lineno, symbol.col_offset))
+        if results:
+            self.formatter.print_all_results(results)
+
+    @staticmethod
+    def report_parse_error(err):
+        log.critical('Parsing failed because...')
+        log.critical(err.line)
+        log.critical(" "*(err.column-1) + "^")
+        log.critical(str(err))
 
     def go(self):
         """Figures out from the given CLI args what it needs to
@@ -150,24 +530,39 @@ class Sona(object):
         logging.basicConfig(level=LOG_LEVELS[self.args.log_level],
                             format='%(levelname)s - %(message)s')
         log.debug('Starting up')
+        if self.args.query_file:
+            queries = read_query_file(self.args.query_file)
+            log.debug('Read %d queries from %s', len(queries), self.args.query_file.name)
+            try:
+                self.make_batch_query(queries)
+            except QuerySyntaxError, err:
+                self.report_parse_error(err)
+            return
         if not self.args.search:
             print 'usage: sona EXPRESSION'
         if self.args.search:
+            if self.args.search[0] == 'at':
+                self.make_position_query(self.args.search[1:])
+                return
             if self.args.search[0] == 'search':
                 query = self.args.search[1:]
             else:
                 query = self.args.search
             try:
-                self.make_search_query(' '.join(query))
-            except ParseException, err:
-                log.critical('Parsing failed because...')
-                log.critical(err.line)
-                log.critical(" "*(err.column-1) + "^")
-                log.critical(str(err))
+                if self.args.revs:
+                    self.make_history_query(' '.join(query))
+                else:
+                    self.make_search_query(' '.join(query))
+            except QuerySyntaxError, err:
+                self.report_parse_error(err)
 
     def __init__(self, args):
         self.args = args
-        self.formatter = FORMATTER_MAP[args.output_format]()
+        before_context, after_context = args.before_context, args.after_context
+        if args.context is not None:
+            before_context = after_context = args.context
+        self.formatter = FORMATTER_MAP[args.output_format](
+            before_context=before_context, after_context=after_context)
 
 def main():
     parser = create_argparser()
@@ -27,3 +27,46 @@ class InvalidAssertionError(SemanticSearcherError):
 class FormatterError(SonaError):
     pass
 
+
+class BudgetExceededError(SemanticSearcherError):
+    pass
+
+class FileTooLargeError(BudgetExceededError):
+    def __init__(self, filename, size, max_size):
+        msg = '{0} is {1} bytes, over the limit of {2} bytes'\
+            .format(filename, size, max_size)
+        self.filename = filename
+        self.size = size
+        self.max_size = max_size
+        super(FileTooLargeError, self).__init__(msg)
+
+class ParseTimeoutError(BudgetExceededError):
+    def __init__(self, filename, max_time):
+        msg = '{0} took longer than {1} seconds to search'\
+            .format(filename, max_time)
+        self.filename = filename
+        self.max_time = max_time
+        super(ParseTimeoutError, self).__init__(msg)
+
+
+class QuerySyntaxError(SonaError):
+    """Raised for a malformed query. Like pyparsing's exceptions it
+    carries the line the error is on and its 1-based column so the
+    error can be pointed at."""
+    def __init__(self, msg, query, loc):
+        self.msg = msg
+        self.query = query
+        self.loc = loc
+        self.lineno = query.count('\n', 0, loc) + 1
+        line_start = query.rfind('\n', 0, loc) + 1
+        line_end = query.find('\n', loc)
+        if line_end == -1:
+            line_end = len(query)
+        self.line = query[line_start:line_end]
+        self.column = loc - line_start + 1
+        super(QuerySyntaxError, self).__init__(
+            '{0} (at char {1}), (line:{2}, col:{3})'.format(msg, loc, self.lineno,
+                                                            self.column))
+
+class InvalidIndexError(SonaError):
+    pass
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def format_value(value):
+    if isinstance(value, list):
+        return '{' + ', '.join(format_value(item) for item in value) + '}'
+    if isinstance(value, basestring):
+        return '"{0}"'.format(value)
+    return str(value)
+
+
+def format_assertion(assertion):
+    """Returns an assertion from a parsed query tree as it would be
+    written in a query."""
+    if not isinstance(assertion, list):
+        return format_value(assertion)
+    text = '{0}:{1}'.format(*assertion[:2])
+    if len(assertion) == 4:
+        text += ' {0} {1}'.format(assertion[2], format_value(assertion[3]))
+    return text
+
+
+class PlanStep(object):
+    """One assertion of a query plan, with its counts and timings
+    summed over every time it was evaluated.
+
+    candidates is the number of results the step started with, which
+    is what it was estimated it could at most return, or None if that
+    is not known without walking the file; rows is the number it
+    actually returned."""
+
+    def __init__(self, assertion, locator, access):
+        self.assertion = assertion
+        self.locator = locator
+        self.access = access
+        self.evaluations = 0
+        self.candidates = 0
+        self.unknown_candidates = False
+        self.rows = 0
+        self.seconds = 0.0
+
+    def add(self, candidates, rows, seconds):
+        self.evaluations += 1
+        if candidates is None:
+            self.unknown_candidates = True
+        else:
+            self.candidates += candidates
+        self.rows += rows
+        self.seconds += seconds
+
+
+class QueryPlan(object):
+    """Records how each assertion of each query was answered, across
+    every file (or the index) it was evaluated against, for --explain.
+
+    Steps are kept per (query, expression, assertion) position; an
+    assertion that was never reached, because an earlier one matched
+    nothing, has no step."""
+
+    def __init__(self):
+        self.queries = []
+        self.steps = {}
+
+    def record(self, query, expression, position, assertion, locator, access,
+               candidates, rows, seconds):
+        """Records one evaluation of the assertion at position in the
+        expression numbered expression of query. access is how it was
+        answered: 'scan' for a walk of a file's syntax tree, 'symbols'
+        for a check of every symbol of a file, or 'index' followed by
+        how the index looked it up."""
+        if query not in self.queries:
+            self.queries.append(query)
+        key = (query, expression, position)
+        step = self.steps.get(key)
+        if step is None:
+            step = self.steps[key] = PlanStep(format_assertion(assertion), locator, access)
+        elif access not in step.access.split(', '):
+            step.access += ', ' + access
+        step.add(candidates, rows, seconds)
+
+    def format(self):
+        """Returns the plan as a list of lines."""
+        lines = []
+        for query in self.queries:
+            lines.append('Query: {0}'.format(query))
+            keys = sorted(key for key in self.steps if key[0] == query)
+            for _, expression, position in keys:
+                step = self.steps[(query, expression, position)]
+                estimate = '?' if step.unknown_candidates else step.candidates
+                lines.append('  {0}.{1} {2}'.format(expression + 1, position + 1,
+                                                     step.assertion))
+                lines.append('      {0} ({1}) x{2}: est {3} -> {4} rows, {5:.1f}ms'.format(
+                    step.locator, step.access, step.evaluations, estimate,
+                    step.rows, step.seconds * 1000))
+        return lines
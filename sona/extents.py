@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import logging
+
+log = logging.getLogger(__name__)
+
+# The kinds of Symbols that span lines of their own, and so can
+# enclose a position.
+EXTENT_KINDS = ('mod', 'cls', 'fn')
+
+# Stands in for the parent of the outermost extent.
+NO_PARENT = 0xffffffff
+
+
+def nest_extents(symbols):
+    """Returns the extents of the functions, classes and modules among
+    symbols, as a list of (symbol, parent) pairs sorted by where they
+    start. parent is the position in the list of the closest extent
+    that encloses the symbol, or NO_PARENT.
+
+    Scopes in Python nest properly -- two extents are either one
+    inside the other or apart -- so every extent is enclosed by the
+    ones still open when it starts."""
+    extents = sorted((symbol for symbol in symbols
+                      if symbol.kind in EXTENT_KINDS and symbol.end_lineno is not None),
+                     key=lambda symbol: (symbol.lineno, symbol.col_offset, -symbol.end_lineno))
+    nested = []
+    open_extents = []
+    for symbol in extents:
+        while open_extents and extents[open_extents[-1]].end_lineno < symbol.lineno:
+            open_extents.pop()
+        nested.append((symbol, open_extents[-1] if open_extents else NO_PARENT))
+        open_extents.append(len(nested) - 1)
+    return nested
+
+
+def find_enclosing(count, extent, lineno, col_offset=None):
+    """Returns the positions of the extents that enclose lineno, and
+    col_offset if it is given, the outermost first.
+
+    The extents are numbered 0 up to count, sorted like nest_extents
+    sorts them; extent(number) returns the (lineno, col_offset,
+    end_lineno, parent) of one. Finding the last extent that starts
+    before the position takes a binary search, and its enclosing
+    extents are then its parents: it is an interval tree, made
+    simpler by the extents nesting."""
+    position = (lineno, col_offset if col_offset is not None else float('inf'))
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if extent(middle)[:2] <= position:
+            low = middle + 1
+        else:
+            high = middle
+    number = low - 1 if low else NO_PARENT
+    chain = []
+    while number != NO_PARENT:
+        _, _, end_lineno, parent = extent(number)
+        if end_lineno >= lineno:
+            chain.append(number)
+        number = parent
+    chain.reverse()
+    return chain
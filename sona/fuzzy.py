@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import logging
+
+log = logging.getLogger(__name__)
+
+# Conditional that matches the names within a few edits of a value.
+FUZZY_CONDITIONAL = '~'
+
+# How many of the closest distinct names a fuzzy search returns the
+# results of, by default.
+FUZZY_TOP_K = 10
+
+
+def edit_distance(a, b, limit=None):
+    """Returns the Levenshtein distance between the strings a and b:
+    the number of characters that have to be inserted, deleted or
+    replaced to turn one into the other.
+
+    If limit is given, gives up as soon as the distance is known to be
+    larger than it and returns limit + 1 instead."""
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = range(len(b) + 1)
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def max_distance(value):
+    """Returns how many edits away from value a name may be and still
+    match it: about one for every three characters."""
+    return max(1, len(value) // 3)
+
+
+def is_close(name, value):
+    """Returns True if name is within max_distance(value) of value."""
+    if not isinstance(name, basestring):
+        return False
+    limit = max_distance(value)
+    return edit_distance(name, value, limit) <= limit
+
+
+class BKTree(object):
+    """A Burkhard-Keller tree of strings, for finding those within some
+    edit distance of a string without measuring the distance to all
+    of them.
+
+    Every child of a node hangs off the edge of its distance to the
+    node; as edit distance is a metric, the strings within radius of
+    a query can only be under the edges within radius of the query's
+    own distance to the node."""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            distance = edit_distance(word, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (word, {})
+                return
+            node = child
+
+    def flatten(self):
+        """Returns (nodes, edges): the tree as a list of (word, first
+        edge, edge count) nodes, the root first, and a list of
+        (distance, node number) edges, the edges of every node next to
+        each other and sorted by distance."""
+        if self.root is None:
+            return [], []
+        nodes = []
+        edges = []
+        queue = [self.root]
+        numbered = 1
+        for word, children in queue:
+            nodes.append((word, len(edges), len(children)))
+            for distance in sorted(children):
+                edges.append((distance, numbered))
+                queue.append(children[distance])
+                numbered += 1
+        return nodes, edges
+
+
+def search_flat(word, radius, node, distance_of, edges_of):
+    """Yields (distance, node) for every node of a flattened BKTree
+    within radius of word, starting from node. distance_of(node)
+    returns the distance of word to the node's word, and
+    edges_of(node) the node's list of (distance, child) edges."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        distance = distance_of(node)
+        if distance <= radius:
+            yield distance, node
+        for edge, child in edges_of(node):
+            if distance - radius <= edge <= distance + radius:
+                stack.append(child)
+
+
+def fuzzy_value(tree):
+    """Returns the value of the fuzzy name assertion whose results are
+    ranked, if tree is a single expression that ends with one, or
+    None. Fuzzy assertions anywhere else only filter."""
+    if len(tree) != 1 or not tree[0] or not isinstance(tree[0][-1], list):
+        return None
+    assertion = tree[0][-1]
+    if len(assertion) == 4 and assertion[1] == 'name' and \
+            assertion[2] == FUZZY_CONDITIONAL:
+        return assertion[3]
+    return None
+
+
+def rank(results, value, top=FUZZY_TOP_K):
+    """Returns the (query, result) pairs in results whose result is
+    named one of the top closest distinct names to value, the closest
+    first; results with the same name keep their order."""
+    distances = {}
+    for _, result in results:
+        name = result.name
+        if name not in distances:
+            distances[name] = edit_distance(name, value)
+    kept = set(sorted(distances, key=lambda name: (distances[name], name))[:top])
+    ranked = [(query, result) for query, result in results if result.name in kept]
+    ranked.sort(key=lambda pair: (distances[pair[1].name], pair[1].name))
+    return ranked
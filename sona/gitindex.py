@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import struct
+import logging
+import binascii
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+# The header of git's index file: signature, version, entry count.
+HEADER = struct.Struct('>4sII')
+
+# The fixed-width start of every entry: ctime and mtime (seconds and
+# nanoseconds), dev, ino, mode, uid, gid, size, blob SHA-1, flags.
+ENTRY = struct.Struct('>10I20sH')
+
+# Entry flags.
+ASSUME_VALID = 0x8000
+EXTENDED = 0x4000
+STAGE_MASK = 0x3000
+NAME_MASK = 0x0fff
+
+# Extended entry flags, in versions 3 and up.
+SKIP_WORKTREE = 0x4000
+INTENT_TO_ADD = 0x2000
+
+SUPPORTED_VERSIONS = (2, 3, 4)
+
+
+class StatEntry(namedtuple('StatEntry', 'mtime size ino sha')):
+    """The stat data git last saw a file with, and the SHA-1 of its
+    blob. ino is truncated to 32 bits, like git does."""
+    __slots__ = ()
+
+
+def _read_varint(data, pos):
+    """Reads one of the offset encoded integers of index version 4,
+    returning it and the position after it."""
+    byte = ord(data[pos])
+    pos += 1
+    value = byte & 0x7f
+    while byte & 0x80:
+        byte = ord(data[pos])
+        pos += 1
+        value = ((value + 1) << 7) | (byte & 0x7f)
+    return value, pos
+
+
+def parse_index(data):
+    """Returns a dict mapping the path of every file in the git index
+    data, relative to the root of the work tree, to its StatEntry.
+
+    Unmerged, intent-to-add and skip-worktree entries are left out:
+    their blob is not what is in the work tree. Raises ValueError if
+    data is not an index of a supported version."""
+    signature, version, count = HEADER.unpack_from(data, 0)
+    if signature != 'DIRC':
+        raise ValueError('not a git index')
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError('unsupported git index version {0}'.format(version))
+    entries = {}
+    pos = HEADER.size
+    path = ''
+    for _ in xrange(count):
+        start = pos
+        fields = ENTRY.unpack_from(data, pos)
+        mtime, ino, size, sha, flags = fields[2], fields[5], fields[9], fields[10], fields[11]
+        pos += ENTRY.size
+        extended = 0
+        if flags & EXTENDED:
+            extended = struct.unpack_from('>H', data, pos)[0]
+            pos += 2
+        if version == 4:
+            strip, pos = _read_varint(data, pos)
+            end = data.index('\0', pos)
+            path = path[:len(path) - strip] + data[pos:end]
+            pos = end + 1
+        else:
+            end = data.index('\0', pos)
+            path = data[pos:end]
+            # Entries are padded with 1 to 8 NULs to a multiple of 8.
+            pos = start + ((end - start) // 8 + 1) * 8
+        if flags & STAGE_MASK or extended & (SKIP_WORKTREE | INTENT_TO_ADD):
+            continue
+        entries[path] = StatEntry(mtime, size, ino, binascii.hexlify(sha))
+    return entries
+
+
+def find_git_dir(directory):
+    """Returns the git directory of the work tree directory is in,
+    and the root of that work tree, or (None, None)."""
+    directory = os.path.abspath(directory)
+    while True:
+        dot_git = os.path.join(directory, '.git')
+        if os.path.isdir(dot_git):
+            return dot_git, directory
+        if os.path.isfile(dot_git):
+            # Worktrees and submodules point to their git directory.
+            with open(dot_git) as f:
+                line = f.readline().strip()
+            if line.startswith('gitdir:'):
+                return os.path.join(directory, line[len('gitdir:'):].strip()), directory
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None, None
+        directory = parent
+
+
+class GitIndex(object):
+    """The stat data and blob SHA-1s git keeps for the tracked files
+    of a work tree, read straight from its index file.
+
+    A file whose size, mtime and inode are still those git recorded
+    has the contents of its blob, so its digest is known without
+    reading it. Files git could not tell apart from a change made in
+    the same second as the index was written (racily clean ones) are
+    never trusted."""
+
+    def __init__(self, root, entries, mtime):
+        self.root = root
+        self.entries = entries
+        self.mtime = mtime
+
+    @classmethod
+    def read(cls, directory):
+        """Returns the GitIndex of the work tree directory is in, or
+        None if it is not in one or its index cannot be read."""
+        git_dir, root = find_git_dir(directory)
+        if git_dir is None:
+            return None
+        path = os.path.join(git_dir, 'index')
+        try:
+            with open(path, 'rb') as f:
+                mtime = os.fstat(f.fileno()).st_mtime
+                entries = parse_index(f.read())
+        except IOError:
+            return None
+        except (ValueError, struct.error), err:
+            log.warning('Ignoring unreadable git index %s: %s', path, err)
+            return None
+        log.debug('Read %d entries from git index %s', len(entries), path)
+        return cls(root, entries, int(mtime))
+
+    def digest(self, filename):
+        """Returns the blob SHA-1 of filename, an absolute path, if it
+        is tracked and unchanged since git last saw it; None if it has
+        to be read to tell."""
+        entry = self.entries.get(os.path.relpath(filename, self.root))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        mtime = int(stat.st_mtime)
+        if (mtime != entry.mtime or stat.st_size != entry.size
+                or stat.st_ino & 0xffffffff != entry.ino or mtime >= self.mtime):
+            return None
+        return entry.sha
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import logging
+import fnmatch
+import subprocess
+from collections import namedtuple
+
+from sona.parser import AssertionParser
+from sona.indexer import Indexer
+from sona.search import SemanticSearcher
+from sona.exceptions import SonaError
+
+log = logging.getLogger(__name__)
+
+# Command to list the commits in a revision range, oldest first.
+GIT_REV_LIST_COMMAND = ('git', 'rev-list', '--reverse', '--topo-order')
+
+# Command to read objects from the object store. Every object is
+# read through one long-running process.
+GIT_CAT_FILE_COMMAND = ('git', 'cat-file', '--batch')
+
+# Tree entry mode of a subdirectory. Everything else is either a
+# blob, a symlink or a submodule.
+TREE_MODE = '40000'
+
+# Tree entry mode of a submodule (a commit in another repository.)
+SUBMODULE_MODE = '160000'
+
+
+class GitObjectError(SonaError):
+    pass
+
+
+class CommitSpan(namedtuple('CommitSpan', 'path commits')):
+    """An unbroken run of commits in which path had the same blob."""
+
+    def __str__(self):
+        first, last = self.commits[0][:7], self.commits[-1][:7]
+        if first == last:
+            return first
+        return '{0}..{1}'.format(first, last)
+
+
+class GitObjectReader(object):
+    """Reads commits, trees and blobs straight from git's object
+    store, without checking anything out.
+
+    Trees are cached by their SHA, as most of them are shared between
+    neighbouring commits."""
+
+    def __init__(self):
+        self._proc = subprocess.Popen(GIT_CAT_FILE_COMMAND, stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE)
+        self._trees = {}
+
+    def read(self, sha):
+        """Returns the type and the raw contents of the object sha."""
+        self._proc.stdin.write(sha + '\n')
+        self._proc.stdin.flush()
+        header = self._proc.stdout.readline().split()
+        if len(header) != 3:
+            raise GitObjectError('Cannot read object {0!r}'.format(sha))
+        _, kind, size = header
+        data = self._proc.stdout.read(int(size))
+        # Every object is followed by a newline.
+        self._proc.stdout.read(1)
+        return kind, data
+
+    def read_commit_tree(self, sha):
+        """Returns the SHA of the root tree of the commit sha."""
+        kind, data = self.read(sha)
+        if kind != 'commit' or not data.startswith('tree '):
+            raise GitObjectError('{0!r} is not a commit'.format(sha))
+        return data[5:data.index('\n')]
+
+    def read_tree(self, sha):
+        """Returns a dict of name -> (mode, sha) for the entries of
+        the tree sha."""
+        try:
+            return self._trees[sha]
+        except KeyError:
+            pass
+        kind, data = self.read(sha)
+        if kind != 'tree':
+            raise GitObjectError('{0!r} is not a tree'.format(sha))
+        # A tree is a sequence of "<mode> <name>\0<20 byte SHA>".
+        entries = {}
+        pos = 0
+        while pos < len(data):
+            space = data.index(' ', pos)
+            nul = data.index('\0', space)
+            entries[data[space + 1:nul]] = (data[pos:space],
+                                            data[nul + 1:nul + 21].encode('hex'))
+            pos = nul + 21
+        self._trees[sha] = entries
+        return entries
+
+    def diff_trees(self, old_sha, new_sha, prefix=''):
+        """Yields (path, old blob, new blob) for every blob that was
+        added, removed or changed between the trees old_sha and
+        new_sha. Either SHA may be None, for an empty tree.
+
+        Subtrees with identical SHAs are never looked at, so the cost
+        is proportional to the size of the change, not of the tree."""
+        if old_sha == new_sha:
+            return
+        old = self.read_tree(old_sha) if old_sha else {}
+        new = self.read_tree(new_sha) if new_sha else {}
+        for name in set(old) | set(new):
+            old_mode, old_entry = old.get(name, (None, None))
+            new_mode, new_entry = new.get(name, (None, None))
+            if old_entry == new_entry:
+                continue
+            path = prefix + name
+            old_tree = old_entry if old_mode == TREE_MODE else None
+            new_tree = new_entry if new_mode == TREE_MODE else None
+            if old_tree or new_tree:
+                for change in self.diff_trees(old_tree, new_tree, path + '/'):
+                    yield change
+            old_blob = old_entry if old_mode not in (None, TREE_MODE, SUBMODULE_MODE) else None
+            new_blob = new_entry if new_mode not in (None, TREE_MODE, SUBMODULE_MODE) else None
+            if old_blob or new_blob:
+                yield path, old_blob, new_blob
+
+    def close(self):
+        self._proc.stdin.close()
+        self._proc.wait()
+
+
+def iter_commits(revs):
+    """Returns the SHA of every commit in revs, oldest first. revs is
+    anything git rev-list understands, such as A..B."""
+    command = GIT_REV_LIST_COMMAND + (revs, '--')
+    log.debug('Calling Git command: "%s"', ','.join(command))
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, err_output = proc.communicate()
+    if proc.returncode != 0:
+        raise GitObjectError(err_output.strip())
+    return output.split()
+
+
+class HistorySearcher(object):
+    """Searches every revision in a range of git history.
+
+    Rather than checking out and searching each commit in turn, the
+    trees are diffed against each other straight from the object
+    store to find out which blob every file had in which commits.
+    Each distinct blob is then indexed exactly once, no matter how
+    many commits contain it, and its matches are reported along with
+    the unbroken runs of commits (see CommitSpan) they span. Identical
+    copies of a file share a blob, so their matches are all reported
+    under the path the blob was first seen at.
+
+    This must be run from the root of the git repository."""
+
+    def __init__(self, revs, pattern='*.py'):
+        self.revs = revs
+        self.pattern = pattern
+        # The SHA of every blob that was indexed.
+        self.indexed_blobs = set()
+
+    def find_spans(self, reader, commits):
+        """Returns a list of (blob, list of CommitSpan) pairs, in the
+        order in which the blobs first appeared in commits. The spans
+        of each blob are in the order of commits too."""
+        spans = {}
+        order = []
+        # (path, blob) -> index of the commit the current run began.
+        open_runs = {}
+
+        def close_run(path, blob, end):
+            start = open_runs.pop((path, blob))
+            spans[blob].append(CommitSpan(path, commits[start:end]))
+
+        old_tree = None
+        for i, commit in enumerate(commits):
+            new_tree = reader.read_commit_tree(commit)
+            for path, old_blob, new_blob in reader.diff_trees(old_tree, new_tree):
+                if not fnmatch.fnmatch(path, self.pattern):
+                    continue
+                if old_blob is not None:
+                    close_run(path, old_blob, i)
+                if new_blob is not None:
+                    if new_blob not in spans:
+                        spans[new_blob] = []
+                        order.append(new_blob)
+                    open_runs[(path, new_blob)] = i
+            old_tree = new_tree
+        for path, blob in open_runs.keys():
+            close_run(path, blob, len(commits))
+        positions = dict((commit, i) for i, commit in enumerate(commits))
+        return [(blob, sorted(spans[blob], key=lambda span: (positions[span.commits[0]],
+                                                             span.path)))
+                for blob in order]
+
+    def search(self, query):
+        """Yields (CommitSpan, node) pairs for every match of query
+        in the history."""
+        tree = AssertionParser(query).tree
+        commits = iter_commits(self.revs)
+        log.info('Searching %d commits', len(commits))
+        reader = GitObjectReader()
+        try:
+            blob_spans = self.find_spans(reader, commits)
+            log.info('Found %d distinct blobs', len(blob_spans))
+            for blob, spans in blob_spans:
+                _, source = reader.read(blob)
+                self.indexed_blobs.add(blob)
+                # A blob is usually only ever seen under one path,
+                # but it is indexed under the first one regardless.
+                path = spans[0].path
+                log.info('Commencing with parsing of blob %s (%s)', blob, path)
+                try:
+                    indexer = Indexer(path, source=source)
+                    nodes = SemanticSearcher._find_query_in_module(tree, query,
+                                                                   indexer)
+                except SyntaxError:
+                    log.critical('Syntax Error in %s (blob %s). Skipping...', path, blob)
+                    continue
+                nodes = sorted(nodes, key=lambda n: n.lineno)
+                for span in spans:
+                    for node in nodes:
+                        yield span, node
+        finally:
+            reader.close()
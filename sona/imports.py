@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def module_name(filename, root):
+    """Returns the dotted name of the module filename, relative to
+    root, or None if it is not a Python module under root."""
+    path = os.path.relpath(filename, root)
+    if path.startswith(os.pardir) or not path.endswith('.py'):
+        return None
+    parts = path[:-len('.py')].split(os.sep)
+    if parts[-1] == '__init__':
+        parts.pop()
+    return '.'.join(parts) or None
+
+
+def _candidates(name, package):
+    """Returns the (parts, minimum) pairs to resolve an imported name
+    with, in order. parts is the dotted name split up and minimum the
+    number of its parts that must remain after dropping the imported
+    attribute, if any."""
+    level = len(name) - len(name.lstrip('.'))
+    rest = name[level:].split('.') if name[level:] else []
+    package_parts = package.split('.') if package else []
+    if level:
+        if level - 1 > len(package_parts):
+            return []
+        base = package_parts[:len(package_parts) - (level - 1)]
+        return [(base + rest, len(base))]
+    candidates = []
+    if package_parts:
+        # Python 2 tries an implicit relative import first.
+        candidates.append((package_parts + rest, len(package_parts) + 1))
+    candidates.append((rest, 1))
+    return candidates
+
+
+def resolve_import(name, package, modules):
+    """Returns the module in modules that name refers to when it is
+    imported from a module in package, or None if it is not one of
+    modules.
+
+    name is an import symbol's name (see SymbolExtractor): the dotted
+    module name, preceded by a dot per level for relative imports,
+    and followed by the name imported from it for from-imports. The
+    longest of the two that is a module wins."""
+    for parts, minimum in _candidates(name, package):
+        for length in (len(parts), len(parts) - 1):
+            if length > 0 and length >= minimum:
+                candidate = '.'.join(parts[:length])
+                if candidate in modules:
+                    return candidate
+    return None
+
+
+class ImportGraph(object):
+    """The imports between the modules under root, as resolved from
+    the import symbols of the files in a SymbolIndex.
+
+    modules maps each module name to its file, and targets the
+    (filename, lineno, col_offset, name) of each import symbol to the
+    module it imports. forward and reverse map
+    each module to the set of modules it imports and is imported by.
+    Imports of modules outside root are left out."""
+
+    def __init__(self, root):
+        self.root = root
+        self.modules = {}
+        self.targets = {}
+        self.forward = {}
+        self.reverse = {}
+
+    @classmethod
+    def build(cls, root, imports):
+        """Returns the ImportGraph of imports, a dict mapping each file
+        to its import symbols."""
+        graph = cls(root)
+        for filename in imports:
+            name = module_name(filename, root)
+            if name is not None:
+                graph.modules[name] = filename
+        for name, filename in graph.modules.iteritems():
+            if os.path.basename(filename) == '__init__.py':
+                package = name
+            else:
+                package = name.rpartition('.')[0]
+            for symbol in imports[filename]:
+                target = resolve_import(symbol.name, package, graph.modules)
+                if target is None:
+                    continue
+                graph.targets[(symbol.filename, symbol.lineno,
+                               symbol.col_offset, symbol.name)] = target
+                graph.forward.setdefault(name, set()).add(target)
+                graph.reverse.setdefault(target, set()).add(name)
+        log.debug('Built import graph of %d modules and %d imports',
+                  len(graph.modules), len(graph.targets))
+        return graph
+
+    def dependents(self, modules):
+        """Returns the set of modules that import any of modules,
+        directly or through other modules."""
+        found = set()
+        pending = list(modules)
+        while pending:
+            for importer in self.reverse.get(pending.pop(), ()):
+                if importer not in found:
+                    found.add(importer)
+                    pending.append(importer)
+        return found
@@ -0,0 +1,547 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import hashlib
+import logging
+import cPickle as pickle
+from collections import namedtuple
+
+from sona.symbols import SYMBOL_MAPS, extract_symbols
+from sona.parser import iter_expressions
+from sona.imports import ImportGraph
+from sona.symtable import SymbolTable, write_symbol_table
+from sona.trigram import PATTERN_CONDITIONALS, query_trigrams, name_predicate
+from sona.fuzzy import FUZZY_CONDITIONAL, is_close, max_distance
+from sona.bitmap import SymbolIds
+from sona.words import DocText, words
+from sona.extents import nest_extents, find_enclosing
+from sona.exceptions import InvalidIndexError
+
+log = logging.getLogger(__name__)
+
+# Directory, relative to the root of the search, the index is kept in.
+INDEX_DIRNAME = '.sona'
+
+# Name of the symbol table in INDEX_DIRNAME.
+INDEX_FILENAME = 'symbols.idx'
+
+# Name of the file the import graph is saved to, in INDEX_DIRNAME.
+GRAPH_FILENAME = 'imports.pickle'
+
+# Bumped whenever the format of the import graph changes; the symbol
+# table has a version of its own, TABLE_VERSION. A graph or table with
+# any other version is rebuilt from scratch.
+INDEX_VERSION = 3
+
+# The kinds of Symbols that have docstrings.
+DOC_KINDS = ('mod', 'cls', 'fn')
+
+
+def save_pickle(path, obj):
+    """Pickles obj to path, creating its directory if needed. The
+    pickle is written to a temporary file first so that a concurrent
+    reader never sees half of it."""
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, path)
+
+
+def content_digest(source):
+    """Returns the digest the index uses to tell whether a file's
+    contents have changed. It is the SHA-1 git gives the contents as a
+    blob, so that the digest of a file git tracks can be taken from
+    git's index instead (see sona.gitindex)."""
+    return hashlib.sha1('blob {0}\0{1}'.format(len(source), source)).hexdigest()
+
+
+class FileEntry(namedtuple('FileEntry', 'digest symbols')):
+    """What the index knows about a single file: the digest of the
+    contents its symbols were extracted from, and the symbols."""
+    __slots__ = ()
+
+
+def _iter_locators(tree):
+    """Yields the (field, attribute) of every assertion in the parsed
+    query tree, or None for anything that is not an assertion."""
+    for _, expression in iter_expressions(tree):
+        for assertion in expression:
+            if not isinstance(assertion, list) or len(assertion) not in [2, 4]:
+                yield None
+            else:
+                yield tuple(assertion[:2])
+
+
+def is_indexable(tree):
+    """Returns True if every assertion in the parsed query tree can be
+    answered from a SymbolIndex."""
+    return all(locator in SYMBOL_MAPS or locator in INDEX_MAPS
+               for locator in _iter_locators(tree))
+
+
+def needs_index(tree):
+    """Returns True if the parsed query tree has assertions that can
+    only be answered from a SymbolIndex."""
+    return any(locator in INDEX_MAPS for locator in _iter_locators(tree))
+
+
+class SymbolIndex(object):
+    """A repository-wide index of the Symbols in every file it has
+    seen, kept up to date file by file.
+
+    The index is saved as a SymbolTable, which is memory-mapped when
+    the index is opened, so opening even a large index is cheap and
+    only the symbols a query looks up are ever decoded. Files that
+    change afterwards are kept in memory, as entries, until the index
+    is saved again; the table's copies of them are masked by
+    removed. The entries have postings from each (kind, name) pair,
+    and from each kind, to their symbols, grouped by file, just like
+    the table has. Looking up every reference to a name is therefore a
+    lookup rather than a parse of every file. Likewise, words postings
+    lead from every word of a docstring to the symbols it documents.
+
+    The imports between the files under root make up its ImportGraph,
+    which is only rebuilt when a file changes. It is saved next to the
+    table and only loaded when it is first needed.
+
+    Files can be overlaid with sources that are not on disk, such as
+    unsaved editor buffers (see update). Their entries are searched
+    like any other, but never saved; the table keeps whatever it had
+    for them."""
+
+    def __init__(self, path=None, root=None):
+        self.path = path
+        self.root = root
+        self.table = None
+        self.entries = {}
+        self.removed = set()
+        self.postings = {}
+        self.kinds = {}
+        self.words = {}
+        # Files whose entries were indexed from an overlay.
+        self.overlaid = set()
+        self._symbol_ids = None
+        self._graph = None
+        self.dirty = False
+
+    @classmethod
+    def open(cls, directory, root=None):
+        """Returns the index saved in directory, or an empty one that
+        will be saved there if there is none (or it is unreadable).
+        The root of the index is root or, by default, the directory
+        directory is in."""
+        if root is None:
+            root = os.path.dirname(os.path.abspath(directory))
+        index = cls(os.path.join(directory, INDEX_FILENAME), root)
+        try:
+            index.table = SymbolTable(index.path)
+        except IOError:
+            return index
+        except InvalidIndexError, err:
+            log.info('Rebuilding index %s: %s', index.path, err)
+            return index
+        log.debug('Opened index %s with %d files', index.path, index.table.n_files)
+        return index
+
+    @property
+    def symbol_ids(self):
+        """Dense ids of the symbols queries have found, so that their
+        results can be combined as bitmaps: the numbers of those in the
+        table, which are only good until it is replaced."""
+        if self._symbol_ids is None or self._symbol_ids.table is not self.table:
+            self._symbol_ids = SymbolIds(self.table)
+        return self._symbol_ids
+
+    @property
+    def graph_path(self):
+        return os.path.join(os.path.dirname(self.path), GRAPH_FILENAME)
+
+    def save(self):
+        """Saves the index to path if it changed since it was opened,
+        writing a new table of the files in it and reopening that.
+        Files that no longer exist are dropped.
+
+        Overlaid files are saved as they were before they were
+        overlaid, and their entries are kept in memory."""
+        if self.path is None or not self.dirty:
+            return
+        for filename in [filename for filename in self.filenames()
+                         if filename not in self.overlaid and not os.path.exists(filename)]:
+            self.remove(filename)
+        overlays = dict((filename, self.entries[filename]) for filename in self.overlaid
+                        if filename in self.entries)
+        files = [(filename, entry.digest, entry.symbols)
+                 for filename, entry in self.entries.iteritems()
+                 if filename not in overlays]
+        generation = 0
+        if self.table is not None:
+            generation = self.table.generation + 1
+            files.extend((filename, self.table.digest(filename),
+                          self.table.file_symbols(filename))
+                         for filename in self.table.filenames()
+                         if filename not in self.removed or filename in overlays)
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # The graph of the overlays is not that of the table.
+        graph = self.graph if not overlays else None
+        write_symbol_table(self.path, files, generation)
+        if self.table is not None:
+            self.table.close()
+        self.table = SymbolTable(self.path)
+        self.entries = {}
+        self.removed = set()
+        self.postings = {}
+        self.kinds = {}
+        self.words = {}
+        if graph is not None:
+            save_pickle(self.graph_path, (INDEX_VERSION, generation, graph))
+        for filename, entry in overlays.iteritems():
+            if self.table.digest(filename) is not None:
+                self.removed.add(filename)
+            self._add(filename, entry)
+        self.dirty = False
+
+    def _load_graph(self):
+        """Returns the ImportGraph saved with the table, or None if
+        there is none or it is not that of the table."""
+        if self.table is None or self.entries or self.removed:
+            return None
+        try:
+            with open(self.graph_path, 'rb') as f:
+                version, generation, graph = pickle.load(f)
+        except IOError:
+            return None
+        except Exception, err:
+            log.warning('Ignoring unreadable import graph %s: %s', self.graph_path, err)
+            return None
+        if (version != INDEX_VERSION or generation != self.table.generation
+                or graph.root != self.root):
+            return None
+        return graph
+
+    @property
+    def graph(self):
+        """The ImportGraph of the files under root, or None if the
+        index has no root."""
+        if self._graph is None and self.root is not None:
+            self._graph = self._load_graph()
+            if self._graph is None:
+                self._graph = ImportGraph.build(self.root, dict(
+                    (filename, self.file_symbols(filename, 'import'))
+                    for filename in self.filenames()))
+        return self._graph
+
+    def filenames(self):
+        """Returns the path of every file in the index."""
+        filenames = set(self.entries)
+        if self.table is not None:
+            filenames.update(filename for filename in self.table.filenames()
+                             if filename not in self.removed)
+        return sorted(filenames)
+
+    def digest(self, filename):
+        """Returns the digest of the contents filename was last indexed
+        with, or None if it is not in the index."""
+        entry = self.entries.get(filename)
+        if entry is not None:
+            return entry.digest
+        if self.table is None or filename in self.removed:
+            return None
+        return self.table.digest(filename)
+
+    def file_symbols(self, filename, kind=None):
+        """Returns the Symbols of filename, only those of kind if it is
+        given."""
+        entry = self.entries.get(filename)
+        if entry is not None:
+            return [symbol for symbol in entry.symbols
+                    if kind is None or symbol.kind == kind]
+        if self.table is None or filename in self.removed:
+            return []
+        return self.table.file_symbols(filename, kind)
+
+    def _add(self, filename, entry):
+        self.entries[filename] = entry
+        self._graph = None
+        for symbol in entry.symbols:
+            self.postings.setdefault((symbol.kind, symbol.name), {})\
+                .setdefault(filename, []).append(symbol)
+            self.kinds.setdefault(symbol.kind, {})\
+                .setdefault(filename, []).append(symbol)
+            if symbol.doc:
+                for word in words(symbol.doc):
+                    self.words.setdefault(word, {})\
+                        .setdefault(filename, []).append(symbol)
+
+    def remove(self, filename):
+        """Removes filename, and all of its symbols, from the index."""
+        self.overlaid.discard(filename)
+        if self.table is not None and filename not in self.removed \
+                and self.table.digest(filename) is not None:
+            self.removed.add(filename)
+            self._graph = None
+            self.dirty = True
+        entry = self.entries.pop(filename, None)
+        if entry is None:
+            return
+        self._graph = None
+        for symbol in entry.symbols:
+            files = self.postings.get((symbol.kind, symbol.name))
+            if files is not None:
+                files.pop(filename, None)
+                if not files:
+                    del self.postings[(symbol.kind, symbol.name)]
+            self.kinds.get(symbol.kind, {}).pop(filename, None)
+            if symbol.doc:
+                for word in words(symbol.doc):
+                    files = self.words.get(word)
+                    if files is not None:
+                        files.pop(filename, None)
+                        if not files:
+                            del self.words[word]
+        self.dirty = True
+
+    def update(self, filename, source=None, digest=None, overlay=False):
+        """Brings the entry for filename, an absolute path, up to date
+        and returns True if its symbols had to be extracted again.
+
+        A file is only ever re-extracted if the digest of its contents
+        changed. If source is given it is used instead of reading the
+        file; if digest is given and matches the index's, the file is
+        not even read. Files that cannot be parsed are indexed with no
+        symbols. Raises IOError if the file cannot be read.
+
+        If overlay is True, source overlays the file, which need not
+        exist, and is not saved (see save) until the file is updated
+        from disk again."""
+        indexed = self.digest(filename)
+        if overlay:
+            self.overlaid.add(filename)
+        else:
+            self.overlaid.discard(filename)
+        if digest is not None and indexed == digest:
+            return False
+        if source is None:
+            with open(filename) as f:
+                source = f.read()
+        digest = content_digest(source)
+        if indexed == digest:
+            return False
+        try:
+            symbols = extract_symbols(filename, source)
+        except SyntaxError:
+            log.critical('Syntax Error in %s. Skipping...', filename)
+            symbols = []
+        # Overlays alone never make the index worth saving again.
+        dirty = self.dirty
+        self.remove(filename)
+        self._add(filename, FileEntry(digest, symbols))
+        if overlay:
+            self.overlaid.add(filename)
+            self.dirty = dirty
+        else:
+            self.dirty = True
+        return True
+
+    def _table_symbols(self, symbols):
+        return [symbol for symbol in symbols if symbol.filename not in self.removed]
+
+    def select(self, kind, matcher, conditional=None, value=None):
+        """Returns the symbols of kind that may satisfy an assertion
+        whose matcher (see SYMBOL_MAPS) is matcher.
+
+        How they are found depends on select_access: assertions that a
+        name equals, or is in a set of, values are answered from the
+        postings, those that it matches a pattern from the names with
+        the pattern's trigrams, and those that it is close to a value
+        from the BK-tree of names; any other assertion gets every
+        symbol of kind. Either way the candidates still have to be
+        checked against the assertion."""
+        access = select_access(matcher, conditional, value)
+        symbols = []
+        if access == 'bk-tree':
+            if self.table is not None:
+                symbols.extend(self._table_symbols(self.table.closest(
+                    kind, value, max_distance(value))))
+            for (symbol_kind, name), files in self.postings.iteritems():
+                if symbol_kind == kind and is_close(name, value):
+                    for file_symbols in files.itervalues():
+                        symbols.extend(file_symbols)
+        elif access == 'trigrams':
+            predicate = name_predicate(conditional, value)
+            if self.table is not None:
+                symbols.extend(self._table_symbols(self.table.search(
+                    kind, predicate, query_trigrams(conditional, value))))
+            for (symbol_kind, name), files in self.postings.iteritems():
+                if symbol_kind == kind and predicate(name):
+                    for file_symbols in files.itervalues():
+                        symbols.extend(file_symbols)
+        elif access == 'postings':
+            for name in ([value] if conditional == '==' else value):
+                if self.table is not None:
+                    symbols.extend(self._table_symbols(self.table.lookup(kind, name)))
+                for file_symbols in self.postings.get((kind, name), {}).itervalues():
+                    symbols.extend(file_symbols)
+        else:
+            if self.table is not None:
+                symbols.extend(self._table_symbols(self.table.kind_symbols(kind)))
+            for file_symbols in self.kinds.get(kind, {}).itervalues():
+                symbols.extend(file_symbols)
+        return symbols
+
+
+    def documented(self, required):
+        """Returns the symbols whose docstring has every word in
+        required, a non-empty set of lowercase words."""
+        symbols = []
+        if self.table is not None:
+            symbols.extend(self._table_symbols(self.table.documented(required)))
+        filenames = None
+        for word in required:
+            files = self.words.get(word, {})
+            filenames = set(files) if filenames is None else filenames & set(files)
+        # A symbol is posted under every word of its docstring, so the
+        # postings of any one of them will do.
+        files = self.words.get(next(iter(required)), {})
+        for filename in filenames:
+            symbols.extend(symbol for symbol in files[filename]
+                           if required <= words(symbol.doc))
+        return symbols
+
+
+    def enclosing(self, filename, lineno, col_offset=None):
+        """Returns the function, class and module Symbols of filename
+        that enclose lineno, and col_offset if it is given, the
+        outermost first. A file saved in the table is answered from its
+        extents there, without reading or parsing it."""
+        entry = self.entries.get(filename)
+        if entry is None:
+            if self.table is None or filename in self.removed:
+                return []
+            return self.table.enclosing(filename, lineno, col_offset)
+        extents = nest_extents(entry.symbols)
+
+        def extent(number):
+            symbol, parent = extents[number]
+            return symbol.lineno, symbol.col_offset, symbol.end_lineno, parent
+
+        return [extents[number][0]
+                for number in find_enclosing(len(extents), extent, lineno, col_offset)]
+
+    def siblings(self, symbol):
+        """Returns the functions and classes directly in the same
+        function, class or module as symbol, itself left out."""
+        extents = nest_extents(self.file_symbols(symbol.filename))
+        parents = [parent for extent, parent in extents if extent == symbol]
+        if not parents:
+            return []
+        return [extent for extent, parent in extents
+                if parent == parents[0] and extent != symbol]
+
+    def callers(self, symbol):
+        """Returns the calls to anything named like symbol."""
+        kind, matcher = SYMBOL_MAPS[('fn', 'call')]
+        return self.select(kind, matcher, '==', symbol.name)
+
+
+def select_access(matcher, conditional=None, value=None):
+    """Returns how SymbolIndex.select finds the candidates for an
+    assertion: 'postings' if it looks up the names it is about,
+    'trigrams' if it narrows the names down with their trigrams,
+    'bk-tree' if it looks up the names close to a value in the tree of
+    names, or 'kind' if it gets every symbol of the kind."""
+    if getattr(matcher, 'attr', None) != 'name':
+        return 'kind'
+    if conditional == '==' or (conditional == 'in' and isinstance(value, list)):
+        return 'postings'
+    if conditional in PATTERN_CONDITIONALS and isinstance(value, basestring):
+        return 'trigrams'
+    if conditional == FUZZY_CONDITIONAL and isinstance(value, basestring):
+        return 'bk-tree'
+    return 'kind'
+
+
+def _find_imports(index, modules, importers):
+    """Returns the import symbols in the modules importers that import
+    any of modules; only the first one of each import statement."""
+    graph = index.graph
+    found = []
+    seen = set()
+    for importer in importers:
+        for symbol in index.file_symbols(graph.modules[importer], 'import'):
+            statement = (symbol.filename, symbol.lineno, symbol.col_offset)
+            if statement not in seen and \
+                    graph.targets.get(statement + (symbol.name,)) in modules:
+                seen.add(statement)
+                found.append(symbol)
+    return found
+
+
+def find_importers(index, comparator, expected_attr_value=None, conditional=None):
+    """Returns the import symbols of every module that imports a
+    module whose name matches expected_attr_value."""
+    graph = index.graph
+    if graph is None:
+        return []
+    if expected_attr_value is None:
+        modules = set(graph.modules)
+    else:
+        modules = set(name for name in graph.modules
+                      if comparator(name, expected_attr_value))
+    importers = set()
+    for module in modules:
+        importers.update(graph.reverse.get(module, ()))
+    return _find_imports(index, modules, importers)
+
+
+def find_dependents(index, comparator, expected_attr_value=None, conditional=None):
+    """Returns the import symbols through which every module depends,
+    directly or not, on a module whose name matches
+    expected_attr_value."""
+    graph = index.graph
+    if graph is None:
+        return []
+    if expected_attr_value is None:
+        modules = set(graph.modules)
+    else:
+        modules = set(name for name in graph.modules
+                      if comparator(name, expected_attr_value))
+    dependents = graph.dependents(modules)
+    return _find_imports(index, modules | dependents, dependents)
+
+
+def find_documented(index, comparator, expected_attr_value=None, conditional=None):
+    """Returns the function, class and module symbols whose docstring
+    matches expected_attr_value, or that have one if it is None.
+
+    A docstring contains a string if it has every word of it (see
+    DocText); those are looked up in the words postings, and never
+    read. Any other assertion is checked against every docstring."""
+    required = None
+    if conditional == 'contains' and isinstance(expected_attr_value, basestring):
+        required = words(expected_attr_value)
+    if required:
+        return index.documented(required)
+    found = []
+    for kind in DOC_KINDS:
+        for symbol in index.select(kind, None):
+            if symbol.doc is None:
+                continue
+            if expected_attr_value is None or \
+                    comparator(DocText(symbol.doc), expected_attr_value):
+                found.append(symbol)
+    return found
+find_documented.access = 'words'
+
+
+INDEX_MAPS = {
+    # <Node type>, <Equiv Attr on Node Class>: <locator>
+    ('mod', 'import'): find_importers,
+    ('mod', 'dependents'): find_dependents,
+    ('doc', 'text'): find_documented,
+    }
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 #  -*- coding: utf-8 -*-
 
+import os
 import logging
 import itertools
 
@@ -15,6 +16,7 @@ from astroid.as_string import AsStringVisitor
 from collections import defaultdict
 
 from sona.locators import compare_by_attr, get_all_parents, find_immediate_name
+from sona.source import SourceText
 
 log = logging.getLogger(__name__)
 
@@ -66,21 +68,37 @@ class Indexer(object):
 
     # Comparator function to use for comparisons
 
-    def __init__(self, filename):
-        """Builds an Indexer given s, a string object."""
+    def __init__(self, filename, source=None):
+        """Builds an Indexer for the file filename.
+
+        If source, a string object, is given it is used as the
+        contents of filename instead of reading the file from disk;
+        the file need not exist at all."""
         self._filename = filename
         self._visitor = None
-        tree = builder.AstroidBuilder().file_build(filename)
+        if source is None:
+            tree = builder.AstroidBuilder().file_build(filename)
+        else:
+            modname = os.path.splitext(os.path.basename(filename))[0]
+            tree = builder.AstroidBuilder().string_build(source, modname, filename)
+            # Keep the source around so results can be displayed
+            # without a file to read it from.
+            tree.source_text = SourceText(source)
         self.tree = tree
 
+    def visit(self):
+        """Walks the tree to build the Visitor's nodemap, if it has
+        not been built yet, and returns it."""
+        if self._visitor is None:
+            self._visitor = IndexVisitor()
+            self._visitor.visit(self.tree)
+        return self._visitor.nodes
+
     def find(self, *node_classes):
         """Searches a Visitor's nodemap for particular classes.
 
         The class, node_class, must derive from astroid.nodes.BaseNG."""
-        if self._visitor is None:
-            self._visitor = IndexVisitor()
-            self._visitor.visit(self.tree)
-        nodes = self._visitor.nodes
+        nodes = self.visit()
         for cls in node_classes:
             assert issubclass(cls, NodeNG)
             matching_nodes = nodes.get(cls, [])
@@ -175,3 +193,9 @@ class Indexer(object):
                     # not isinstance(variable.parent.parent, Function)
                 ]
 
+    def find_variable_by_reference(self, expected_attr_value=None,
+                                   comparator=None, node_list=None):
+        # Name nodes are only ever loads; stores are AssName nodes.
+        return compare_by_attr(self, Name, 'name', expected_attr_value,
+                               comparator, node_list)
+
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import gc
+import os
+import heapq
+import logging
+import resource
+import contextlib
+from collections import OrderedDict
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 has no tracemalloc, unless the pytracemalloc backport
+    # and a patched interpreter are installed.
+    tracemalloc = None
+
+log = logging.getLogger(__name__)
+
+# The phases of a search, in the order they are reported in.
+PHASES = ('list', 'build', 'traverse', 'filter', 'format')
+
+# Number of files that allocated the most that are reported.
+TOP_FILES = 10
+
+_PAGE_SIZE = resource.getpagesize()
+
+
+def current_rss():
+    """Returns the resident set size of this process in bytes, or None
+    if it cannot be told."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (IOError, IndexError, ValueError):
+        return None
+
+
+def peak_rss():
+    """Returns the peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes.
+    return peak if os.uname()[0] == 'Darwin' else peak * 1024
+
+
+class PhaseStats(object):
+    """What one phase of a search allocated, summed over every time it
+    ran: growth is how much the resident set grew, traced how much
+    tracemalloc saw allocated and not freed, if it is available, and
+    objects how many objects it allocated and did not free, if it is
+    not."""
+
+    def __init__(self):
+        self.calls = 0
+        self.growth = 0
+        self.traced = 0
+        self.objects = 0
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.growth += other.growth
+        self.traced += other.traced
+        self.objects += other.objects
+
+
+class MemoryReport(object):
+    """Records how much memory each phase of a search allocates, the
+    files that allocated the most, and the peak resident set size of
+    this process and of every worker process.
+
+    Only one report is active in a process at a time (see start); the
+    phase() context managers used throughout sona record into it, and
+    do nothing if there is none. Workers forked while a report is
+    active get a report of their own, which they send back with their
+    results (see snapshot and merge).
+
+    The resident set only grows by whole pages, and seldom while a
+    single file is searched, so without tracemalloc what files and
+    phases allocate is counted in objects instead of bytes."""
+
+    def __init__(self):
+        self.phases = OrderedDict((name, PhaseStats()) for name in PHASES)
+        self.files = {}
+        self.workers = {}
+        self.peak = 0
+        # True if files holds how many objects each file allocated,
+        # rather than how many bytes.
+        self.counts_objects = tracemalloc is None
+
+    def record(self, name, filename, growth, traced, objects=0):
+        stats = self.phases[name]
+        stats.calls += 1
+        stats.growth += max(growth, 0)
+        stats.traced += max(traced, 0)
+        stats.objects += max(objects, 0)
+        if filename is not None:
+            allocated = objects if self.counts_objects else max(growth, traced)
+            self.files[filename] = self.files.get(filename, 0) + max(allocated, 0)
+
+    def snapshot(self):
+        """Returns what the report recorded and the peak resident set
+        size of this process, to be merged into another report."""
+        self.peak = max(self.peak, peak_rss())
+        return (os.getpid(), self.peak, self.phases, self.files)
+
+    def merge(self, snapshot):
+        """Adds the snapshot of a worker's report to this one."""
+        pid, peak, phases, files = snapshot
+        self.workers[pid] = max(self.workers.get(pid, 0), peak)
+        for name, stats in phases.iteritems():
+            self.phases[name].merge(stats)
+        for filename, allocated in files.iteritems():
+            self.files[filename] = self.files.get(filename, 0) + allocated
+
+    def format(self, top=TOP_FILES):
+        """Returns the report as a list of lines."""
+        self.peak = max(self.peak, peak_rss())
+        lines = ['Peak RSS: {0}'.format(format_bytes(self.peak))]
+        if self.counts_objects:
+            lines.append('No tracemalloc: allocations are counted in objects, not bytes')
+        for name, stats in self.phases.iteritems():
+            line = '  {0:<9} x{1}: RSS +{2}'.format(name, stats.calls,
+                                                     format_bytes(stats.growth))
+            if self.counts_objects:
+                line += ', objects +{0}'.format(stats.objects)
+            else:
+                line += ', traced +{0}'.format(format_bytes(stats.traced))
+            lines.append(line)
+        if self.files:
+            if self.counts_objects:
+                lines.append('Files that allocated the most objects:')
+            else:
+                lines.append('Files that allocated the most:')
+            for allocated, filename in heapq.nlargest(
+                    top, ((allocated, filename) for filename, allocated
+                          in self.files.iteritems())):
+                allocated = allocated if self.counts_objects else format_bytes(allocated)
+                lines.append('  {0:>10} {1}'.format(allocated, filename))
+        if self.workers:
+            lines.append('Worker peak RSS:')
+            for pid, peak in sorted(self.workers.iteritems()):
+                lines.append('  {0:>10} pid {1}'.format(format_bytes(peak), pid))
+        return lines
+
+
+def format_bytes(count):
+    for unit in ('B', 'KiB', 'MiB'):
+        if count < 1024:
+            return '{0:.0f}{1}'.format(count, unit) if unit == 'B' \
+                else '{0:.1f}{1}'.format(count, unit)
+        count /= 1024.0
+    return '{0:.1f}GiB'.format(count)
+
+
+_report = None
+
+
+def start():
+    """Starts recording into a new MemoryReport, and returns it."""
+    global _report
+    _report = MemoryReport()
+    if tracemalloc is not None and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _report
+
+
+def stop():
+    """Stops recording. Returns the report that was active, if any."""
+    global _report
+    report, _report = _report, None
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return report
+
+
+def active():
+    """Returns the active MemoryReport, or None."""
+    return _report
+
+
+@contextlib.contextmanager
+def phase(name, filename=None):
+    """Context manager that records what its body allocates as part of
+    the phase name, and of filename if it is given, in the active
+    report. Does nothing if there is none.
+
+    Without tracemalloc, the objects the body allocates are counted
+    instead: the garbage collector counts the objects it tracks that
+    were allocated, less those freed, since it last ran, so it is kept
+    from running until the body is done."""
+    report = _report
+    if report is None:
+        yield
+        return
+    rss = current_rss()
+    traced = objects = 0
+    if tracemalloc is not None:
+        traced = tracemalloc.get_traced_memory()[0]
+    else:
+        collecting = gc.isenabled()
+        gc.disable()
+        objects = gc.get_count()[0]
+    try:
+        yield
+    finally:
+        growth = 0
+        if rss is not None:
+            growth = (current_rss() or rss) - rss
+        if tracemalloc is not None:
+            traced = tracemalloc.get_traced_memory()[0] - traced
+        else:
+            objects = gc.get_count()[0] - objects
+            if collecting:
+                gc.enable()
+        report.record(name, filename, growth, traced, objects)
+
+
+def iter_phase(name, iterable):
+    """Yields every item of iterable, recording what producing each
+    one allocates as part of the phase name."""
+    iterator = iter(iterable)
+    while True:
+        with phase(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
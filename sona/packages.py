@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import re
+import csv
+import hashlib
+import logging
+from collections import namedtuple
+
+from sona.index import SymbolIndex
+
+log = logging.getLogger(__name__)
+
+# Directory, under the user's cache directory, the indexes of
+# installed distributions are kept in, one directory per name and
+# version and, in it, one per site directory it is installed in.
+PACKAGES_CACHE_DIRNAME = os.path.join('sona', 'packages')
+
+
+class Distribution(namedtuple('Distribution', 'name version filenames')):
+    """An installed distribution: its name, its version and the
+    absolute paths of the Python files it installed."""
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """The name of the directory its indexes are kept in."""
+        return '{0}-{1}'.format(re.sub(r'[^\w.]+', '_', self.name),
+                                re.sub(r'[^\w.+]+', '_', self.version))
+
+
+def site_key(site_dir):
+    """Returns the name of the directory, under that of a
+    distribution, its index for site_dir is kept in. Indexes record
+    absolute paths, so one built for a distribution in one site
+    directory is no good for the same distribution in another."""
+    return hashlib.sha1(os.path.abspath(site_dir)).hexdigest()[:12]
+
+
+def default_cache_dir():
+    """Returns the user-level directory indexes of distributions are
+    shared in."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, PACKAGES_CACHE_DIRNAME)
+
+
+def _read_metadata(path):
+    """Returns the Name and Version headers of the metadata file path,
+    a PKG-INFO or METADATA file, or (None, None)."""
+    headers = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    break
+                key, _, value = line.partition(':')
+                headers.setdefault(key.strip().lower(), value.strip())
+    except IOError:
+        return None, None
+    return headers.get('name'), headers.get('version')
+
+
+def _read_lines(path):
+    try:
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip()]
+    except IOError:
+        return []
+
+
+def _walk_python_files(path):
+    if os.path.isfile(path + '.py'):
+        yield path + '.py'
+    for dirpath, _, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            if filename.endswith('.py'):
+                yield os.path.join(dirpath, filename)
+
+
+def _installed_files(site_dir, info_dir):
+    """Returns the paths, relative to site_dir, of the files the
+    distribution whose metadata is in info_dir installed: from its
+    RECORD, its installed-files.txt or, failing both, its
+    top_level.txt."""
+    record = os.path.join(site_dir, info_dir, 'RECORD')
+    if os.path.isfile(record):
+        with open(record) as f:
+            return [row[0] for row in csv.reader(f) if row]
+    installed = _read_lines(os.path.join(site_dir, info_dir, 'installed-files.txt'))
+    if installed:
+        return [os.path.normpath(os.path.join(info_dir, path)) for path in installed]
+    paths = []
+    for name in _read_lines(os.path.join(site_dir, info_dir, 'top_level.txt')):
+        paths.extend(os.path.relpath(path, site_dir) for path in
+                     _walk_python_files(os.path.join(site_dir, name)))
+    return paths
+
+
+def find_distributions(site_dir):
+    """Returns a Distribution for every distribution installed in
+    site_dir that has .dist-info or .egg-info metadata, sorted by
+    name. Files they installed outside site_dir are left out."""
+    site_dir = os.path.abspath(site_dir)
+    distributions = []
+    for entry in sorted(os.listdir(site_dir)):
+        if entry.endswith('.dist-info'):
+            metadata = 'METADATA'
+        elif entry.endswith('.egg-info') and os.path.isdir(os.path.join(site_dir, entry)):
+            metadata = 'PKG-INFO'
+        else:
+            continue
+        name, version = _read_metadata(os.path.join(site_dir, entry, metadata))
+        if not name or not version:
+            log.warning('Ignoring %s, which has no name or version', entry)
+            continue
+        filenames = []
+        for path in _installed_files(site_dir, entry):
+            path = os.path.normpath(os.path.join(site_dir, path))
+            if path.endswith('.py') and path.startswith(site_dir + os.sep) \
+                    and os.path.isfile(path):
+                filenames.append(path)
+        distributions.append(Distribution(name, version, sorted(set(filenames))))
+    return sorted(distributions, key=lambda distribution: distribution.name.lower())
+
+
+def package_index(distribution, site_dir, cache_dir):
+    """Returns the read-only SymbolIndex of distribution, building and
+    saving it in cache_dir first if it has not been yet, or if the
+    files it was built from are not those distribution installed. Its
+    root is site_dir, so that imports between its modules resolve."""
+    directory = os.path.join(cache_dir, distribution.key, site_key(site_dir))
+    index = SymbolIndex.open(directory, root=os.path.abspath(site_dir))
+    if index.table is not None:
+        if index.filenames() == distribution.filenames:
+            return index
+        log.info('The index of %s %s is out of date', distribution.name,
+                 distribution.version)
+        for filename in index.filenames():
+            if filename not in distribution.filenames:
+                index.remove(filename)
+    log.info('Indexing %s %s', distribution.name, distribution.version)
+    for filename in distribution.filenames:
+        try:
+            index.update(filename)
+        except IOError, err:
+            log.warning('Cannot read %s: %s', filename, err)
+    # A distribution without Python files still gets an empty table,
+    # so that it is not looked at again.
+    index.dirty = True
+    index.save()
+    return index
+
+
+def mount_packages(site_dir, cache_dir=None):
+    """Returns the SymbolIndex of every distribution installed in
+    site_dir, from the shared cache_dir (default_cache_dir() if it is
+    None). Distributions are keyed by name, version and site_dir, so
+    they are only ever indexed again once they are upgraded."""
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    return [package_index(distribution, site_dir, cache_dir)
+            for distribution in find_distributions(site_dir)]
@@ -1,43 +1,246 @@
 #!/usr/bin/env python
 #  -*- coding: utf-8 -*-
 
+import re
 import logging
-# Terrible...
-from pyparsing import *
+import threading
+from collections import OrderedDict
 
-ParserElement.enablePackrat()
+from sona.exceptions import QuerySyntaxError
 
 log = logging.getLogger(__name__)
 
+# Number of parsed queries kept around by parse_query.
+QUERY_CACHE_SIZE = 256
+
+# Every token is a (kind, value, position) tuple. Identifiers may
+# start with a digit, so numbers are told apart by the parser.
+TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<word>\w+)
+  | (?P<string>"[^"\n]*"|'[^'\n]*')
+  | (?P<op>==|!=|=~|[~:,;{}])
+""", re.VERBOSE)
+
+END = 'end'
+
+# Operators that combine the results of an expression with those of
+# the expressions before it, other than ';' (a union).
+SET_OPERATORS = ('except', 'intersect')
+
+
+def iter_expressions(tree):
+    """Yields (operator, expression) for every expression in the
+    parsed query tree, where operator is 'union' for the first one and
+    those after a ';', and otherwise one of SET_OPERATORS."""
+    for expression in tree:
+        if len(expression) == 2 and expression[0] in SET_OPERATORS \
+                and isinstance(expression[1], list):
+            yield expression[0], expression[1]
+        else:
+            yield 'union', expression
+
+
+def tokenize(query):
+    """Returns the list of (kind, value, position) tokens in query,
+    ending with an END token. kind is one of 'word', 'string', 'op'
+    or END; strings have their quotes removed."""
+    tokens = []
+    pos = 0
+    while pos < len(query):
+        match = TOKEN_RE.match(query, pos)
+        if match is None:
+            if query[pos] in '\'"':
+                raise QuerySyntaxError('Unterminated string', query, pos)
+            raise QuerySyntaxError('Unexpected {0!r}'.format(query[pos]), query, pos)
+        kind = match.lastgroup
+        value = match.group()
+        if kind == 'string':
+            tokens.append((kind, value[1:-1], pos))
+        elif kind != 'space':
+            tokens.append((kind, value, pos))
+        pos = match.end()
+    tokens.append((END, '', len(query)))
+    return tokens
+
+
+class QueryParser(object):
+    """A recursive descent parser for the query grammar:
+
+        query      := expression (operator expression)*
+        operator   := ';' | 'except' | 'intersect'
+        expression := string | assertion (',' assertion)*
+        assertion  := field [conditional value]
+        field      := identifier ':' identifier
+        conditional:= '==' | '!=' | '=~' | '~' | 'in' | 'not' 'in' | 'contains'
+        value      := string | number | '{' item (',' item)* '}'
+        item       := string | number
+
+    parse() returns a list of expressions, each of which is a list of
+    assertions. The results of the expressions are combined left to
+    right: ';' adds those of the next expression, 'intersect' keeps
+    only those also found by it and 'except' drops those found by it.
+    An expression after 'intersect' or 'except' is wrapped in a list
+    with the operator, [operator, expression]; see iter_expressions.
+
+    An assertion is a list of either two items, [field, attribute], or
+    four, [field, attribute, conditional, value]. A value is a string,
+    an int, or a list of them for a set; the value of '=~' is a
+    regular expression and that of 'contains' or '~' a string."""
+
+    def __init__(self, query):
+        self.query = query
+        self.tokens = tokenize(query)
+        self.pos = 0
 
-class AssertionParser(object):
-
-
-    IDENTIFIER = alphanums + "_"
-
-    BoolConstant = Keyword("True") | Keyword("False")
-    String = QuotedString('"') | QuotedString("'")
-    Number = Word(nums).setParseAction(lambda s, l, t: [int(t[0])])
-    Set = Group(Suppress('{') + delimitedList(String | Number, delim=',') + Suppress('}'))
-    Identifier = Word(IDENTIFIER)
-
-    Field = Identifier + Suppress(Literal(':')) + Identifier
-
-    Conditional = (Literal("==") | Literal("!=") | Literal("in") |
-                   (Literal("not") + Literal("in")).setParseAction(lambda s, l, t: 'not in'))
-
-    Assertion = (Field + Conditional + (String | Number | Set))
+    @property
+    def token(self):
+        return self.tokens[self.pos]
+
+    def error(self, expected):
+        kind, value, position = self.token
+        found = 'end of query' if kind == END else repr(value)
+        raise QuerySyntaxError('Expected {0}, found {1}'.format(expected, found),
+                               self.query, position)
+
+    def next(self):
+        token = self.token
+        if token[0] != END:
+            self.pos += 1
+        return token
+
+    def accept(self, kind, value=None):
+        """Consumes and returns the current token's value if it is of
+        the given kind (and value); returns None otherwise."""
+        token_kind, token_value, _ = self.token
+        if token_kind == kind and (value is None or token_value == value):
+            self.next()
+            return token_value
+        return None
+
+    def expect(self, kind, value=None, expected=None):
+        token_value = self.accept(kind, value)
+        if token_value is None:
+            self.error(expected or repr(value))
+        return token_value
+
+    def parse(self):
+        expressions = [self.parse_expression()]
+        while True:
+            if self.accept('op', ';') is not None:
+                expressions.append(self.parse_expression())
+                continue
+            operator = self.parse_set_operator()
+            if operator is None:
+                break
+            expressions.append([operator, self.parse_expression()])
+        if self.token[0] != END:
+            self.error("',', ';', 'except', 'intersect' or end of query")
+        return expressions
+
+    def parse_set_operator(self):
+        for operator in SET_OPERATORS:
+            if self.accept('word', operator) is not None:
+                return operator
+        return None
+
+    def parse_expression(self):
+        string = self.accept('string')
+        if string is not None:
+            return [string]
+        assertions = [self.parse_assertion()]
+        while self.accept('op', ',') is not None:
+            assertions.append(self.parse_assertion())
+        return assertions
+
+    def parse_assertion(self):
+        field = self.expect('word', expected='a field')
+        self.expect('op', ':')
+        attribute = self.expect('word', expected='a field attribute')
+        conditional = self.parse_conditional()
+        if conditional is None:
+            return [field, attribute]
+        if conditional in ('=~', '~', 'contains'):
+            return [field, attribute, conditional, self.parse_pattern(conditional)]
+        return [field, attribute, conditional, self.parse_value()]
+
+    def parse_conditional(self):
+        for operator in ('==', '!=', '=~', '~'):
+            if self.accept('op', operator) is not None:
+                return operator
+        if self.accept('word', 'in') is not None:
+            return 'in'
+        if self.accept('word', 'not') is not None:
+            self.expect('word', 'in')
+            return 'not in'
+        if self.accept('word', 'contains') is not None:
+            return 'contains'
+        return None
+
+    def parse_pattern(self, conditional):
+        """Parses the string after conditional, checking that it is a
+        valid regular expression if conditional is '=~'."""
+        kind, value, position = self.token
+        self.expect('string', expected='a string')
+        if conditional == '=~':
+            try:
+                re.compile(value)
+            except re.error, err:
+                raise QuerySyntaxError('Invalid regular expression: {0}'.format(err),
+                                       self.query, position)
+        return value
+
+    def parse_value(self):
+        if self.accept('op', '{') is not None:
+            items = [self.parse_item()]
+            while self.accept('op', ',') is not None:
+                items.append(self.parse_item())
+            self.expect('op', '}')
+            return items
+        return self.parse_item()
+
+    def parse_item(self):
+        kind, value, _ = self.token
+        if kind == 'string':
+            self.next()
+            return value
+        if kind == 'word' and value.isdigit():
+            self.next()
+            return int(value)
+        self.error('a string or a number')
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def parse_query(query):
+    """Returns the parsed tree of query (see QueryParser), which must
+    not be modified. The QUERY_CACHE_SIZE most recently used queries
+    are only ever parsed once. Safe to call from several threads.
+
+    Raises QuerySyntaxError if query is malformed."""
+    with _cache_lock:
+        tree = _cache.pop(query, None)
+        if tree is not None:
+            _cache[query] = tree
+            return tree
+    tree = QueryParser(query).parse()
+    with _cache_lock:
+        _cache.pop(query, None)
+        if len(_cache) >= QUERY_CACHE_SIZE:
+            _cache.popitem(last=False)
+        _cache[query] = tree
+    return tree
 
-    Expression = (Group(Assertion | Field) +
-                  ZeroOrMore(Suppress(",") + Group(Assertion | Field))) | String
 
-    Query = Group(Expression) + Group(ZeroOrMore(Suppress(";") + Expression))
+class AssertionParser(object):
 
     def __init__(self, query=''):
         self._tree = []
         self._query = query
         if query:
-            self._tree = self.Query.parseString(query, parseAll=True)
+            self._tree = parse_query(query)
 
     @property
     def tree(self):
@@ -46,4 +249,3 @@ class AssertionParser(object):
     def iter_tree(self):
         for search_node in self._tree:
             yield search_node
-
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import logging
+import cPickle as pickle
+
+from sona.index import save_pickle
+
+log = logging.getLogger(__name__)
+
+# Name of the file parse times are kept in, next to the index.
+PARSE_TIMES_FILENAME = 'parse_times.pickle'
+
+# Bumped whenever the format of the parse times changes.
+PARSE_TIMES_VERSION = 1
+
+# Seconds it takes to parse and search a byte of source, until enough
+# files have been timed to know better.
+DEFAULT_SECONDS_PER_BYTE = 2e-6
+
+# Files estimated to take less than this many seconds are sent to the
+# workers in batches worth about this much, so that tiny files do not
+# cost more to send than to search.
+BATCH_SECONDS = 0.05
+
+
+class CostModel(object):
+    """Estimates how long searching a file will take, from its size
+    and, if it has been searched before, how long that took.
+
+    times maps each file to the (size, seconds) of the last time it
+    was searched. Files that were never searched are estimated from
+    their size, at the rate of all the files that were. The model
+    lives in memory and, if it has a path, is saved there."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.times = {}
+        self.dirty = False
+        self._seconds_per_byte = None
+
+    @classmethod
+    def open(cls, directory):
+        """Returns the model saved in directory, or an empty one that
+        will be saved there if there is none (or it is unreadable)."""
+        model = cls(os.path.join(directory, PARSE_TIMES_FILENAME))
+        try:
+            with open(model.path, 'rb') as f:
+                version, times = pickle.load(f)
+        except IOError:
+            return model
+        except Exception, err:
+            log.warning('Ignoring unreadable parse times %s: %s', model.path, err)
+            return model
+        if version == PARSE_TIMES_VERSION:
+            model.times = times
+        return model
+
+    def save(self):
+        """Saves the model to path if it changed since it was
+        opened."""
+        if self.path is None or not self.dirty:
+            return
+        save_pickle(self.path, (PARSE_TIMES_VERSION, self.times))
+        self.dirty = False
+
+    @property
+    def seconds_per_byte(self):
+        if self._seconds_per_byte is None:
+            size = sum(size for size, _ in self.times.itervalues())
+            seconds = sum(seconds for _, seconds in self.times.itervalues())
+            if size and seconds:
+                self._seconds_per_byte = seconds / size
+            else:
+                self._seconds_per_byte = DEFAULT_SECONDS_PER_BYTE
+        return self._seconds_per_byte
+
+    def estimate(self, filename, size):
+        """Returns the number of seconds searching filename, which is
+        size bytes long, is expected to take."""
+        timed = self.times.get(filename)
+        if timed is None or not timed[0]:
+            return size * self.seconds_per_byte
+        # A file that grew or shrank takes proportionally longer.
+        timed_size, seconds = timed
+        return seconds * size / timed_size
+
+    def record(self, filename, size, seconds):
+        """Records that searching filename, size bytes long, took
+        seconds."""
+        self.times[filename] = (size, seconds)
+        self._seconds_per_byte = None
+        self.dirty = True
+
+
+def file_size(filename):
+    """Returns the size of filename, or 0 if it cannot be found."""
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def schedule(costs, batch_cost=BATCH_SECONDS):
+    """Returns the order to search files in, given a list of their
+    estimated costs, as a list of batches of positions in costs.
+
+    The most expensive files come first, one per batch, so that they
+    cannot end up as the long tail of a search (longest processing
+    time first). Files cheaper than batch_cost are packed into batches
+    that are worth about batch_cost together. Files that cost the same
+    keep their order."""
+    batches = []
+    small = []
+    small_cost = 0
+    for position in sorted(xrange(len(costs)), key=lambda position: -costs[position]):
+        cost = costs[position]
+        if cost >= batch_cost:
+            batches.append([position])
+            continue
+        small.append(position)
+        small_cost += cost
+        if small_cost >= batch_cost:
+            batches.append(small)
+            small = []
+            small_cost = 0
+    if small:
+        batches.append(small)
+    return batches
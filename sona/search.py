@@ -3,14 +3,34 @@
 
 import logging
 import os
+import re
 import json
+import time
+import itertools
+import multiprocessing
+from collections import OrderedDict
 
-from sona.parser import AssertionParser
+from sona.parser import AssertionParser, iter_expressions
 from sona.indexer import Indexer
+from sona.symbols import Symbol, SYMBOL_MAPS, extract_symbols, symbol_text
+from sona.aggregate import Aggregator
+from sona.index import (SymbolIndex, INDEX_MAPS, content_digest, is_indexable,
+                        needs_index, select_access)
+from sona.cache import normalize_query, file_set_generation
+from sona.source import source_text_for, set_overlay
+from sona.schedule import CostModel, file_size, schedule
+from sona.bitmap import SymbolIds, combine
+from sona.segments import can_split, find_in_segments
+from sona.fuzzy import FUZZY_TOP_K, is_close, fuzzy_value, rank
+from sona import memory
+from sona.locators import (DEFAULT_COMPARATOR, find_immediate_name,
+                           get_all_parents)
 from sona.exceptions import (NoNodeError, NoSemanticIndexerError,
-                             InvalidAssertionError, FormatterError)
+                             InvalidAssertionError, FormatterError,
+                             BudgetExceededError)
 
-from astroid.nodes import Module, Function, Lambda, Class, Arguments, For, While
+from astroid.nodes import (Module, Function, Lambda, Class, Arguments, For, While,
+                           AssName, Name, CallFunc, Getattr, Subscript)
 from astroid.bases import NodeNG
 
 log = logging.getLogger(__name__)
@@ -26,6 +46,16 @@ INDEXER_MAPS = {
     ('cls', 'method'): Indexer.find_class_method,
     ('var', 'name'): Indexer.find_variable_by_name,
 #    ('var', 'parent'): Indexer.find_variable_by_parent,
+    ('var', 'ref'): Indexer.find_variable_by_reference,
+    }
+
+# The Symbol kind of each astroid node class.
+NODE_KINDS = {
+    Function: 'fn',
+    Class: 'cls',
+    AssName: 'var',
+    Name: 'ref',
+    CallFunc: 'call',
     }
 
 # TODO: This should be in parser.py?
@@ -34,6 +64,9 @@ COMPARATOR_MAP = {
     '!=': lambda a,b: a != b,
     'in': lambda a,b: a in b,
     'not in': lambda a,b: a not in b,
+    '=~': lambda a,b: isinstance(a, basestring) and re.search(b, a) is not None,
+    'contains': lambda a,b: isinstance(a, basestring) and b in a,
+    '~': is_close,
     }
 
 class SemanticSearcher(object):
@@ -54,14 +87,127 @@ class SemanticSearcher(object):
     def add_files(self, iterable):
         self.files.extend(iterable)
 
-    def __init__(self):
+    def add_file_source(self, iterable):
+        """Adds every file yielded by iterable.
+
+        Unlike add_files, iterable is not consumed until a search
+        begins, so files are searched as soon as they are found
+        rather than after all of them have been listed. The files it
+        yields are added to files as they are searched."""
+        self.sources.append(iterable)
+
+    def add_source(self, filepath, source):
+        """Adds a file whose contents are source, a string, whether
+        or not there is a file at filepath; the path may be a virtual
+        one. See overlay."""
+        self.overlay(filepath, source)
+        self.files.append(filepath)
+
+    def overlay(self, filepath, source=None):
+        """Searches source, a string, in place of the contents of
+        filepath whenever filepath is searched, such as the buffer of
+        an editor with unsaved changes, or stops doing so if source is
+        None. Unicode sources are encoded as UTF-8.
+
+        Only overlaid files are parsed again: with an index or result
+        cache the rest are still answered from it, and overlays are
+        never saved to either one's files on disk."""
+        path = os.path.abspath(filepath)
+        if isinstance(source, unicode):
+            source = source.encode('utf-8')
+        if source is None:
+            self.overlays.pop(path, None)
+            if self.index is not None and not os.path.exists(path):
+                self.index.remove(path)
+        else:
+            self.overlays[path] = source
+        set_overlay(path, source)
+
+    def iter_files(self):
+        """Yields every file to search, draining any file sources
+        added with add_file_source along the way."""
+        for filename in list(self.files):
+            yield filename
+        while self.sources:
+            for filename in memory.iter_phase('list', self.sources.pop(0)):
+                self.files.append(filename)
+                yield filename
+
+    def __init__(self, budget=None, jobs=1, index=None, result_cache=None,
+                 git_index=None, cost_model=None, plan=None, packages=None,
+                 fuzzy_top=FUZZY_TOP_K):
         self.files = []
+        self.sources = []
+        # The source of every overlaid file (see overlay), by absolute
+        # path.
+        self.overlays = {}
         self.results = []
         self.aggressive_search = False
+        # Per-file limits (a Budget), and the (filename, reason) of
+        # every file that went over them.
+        self.budget = budget
+        self.over_budget = []
+        # Number of worker processes to search with.
+        self.jobs = jobs
+        # A SymbolIndex to answer the queries it can answer from.
+        self.index = index
+        # Every file of the repository, if only some of them are
+        # searched. The index is brought up to date with all of them
+        # for the queries that relate files to one another, such as
+        # mod:dependents, though only results in the searched files
+        # are kept.
+        self.index_files = None
+        # A ResultCache to answer repeated queries from.
+        self.result_cache = result_cache
+        # A GitIndex to tell unchanged files from, without reading
+        # them, for the index and the result cache.
+        self.git_index = git_index
+        # A CostModel to schedule parallel searches with, and to
+        # record how long each file took in.
+        self.cost_model = cost_model
+        # A QueryPlan to record how each assertion was answered in,
+        # for --explain.
+        self.plan = plan
+        # Read-only SymbolIndexes of installed packages, searched
+        # after the files (see sona.packages).
+        self.packages = packages or []
+        # How many of the closest names the results of a query that
+        # ends with a fuzzy name assertion are kept for.
+        self.fuzzy_top = fuzzy_top
+
+    @staticmethod
+    def _unpack_assertion(assertion):
+        """Returns (node_type, node_attr, comparator, comp_value) for
+        a single assertion from a parsed query tree."""
+        if not len(assertion) in [2, 4]:
+            raise InvalidAssertionError(\
+                'Assertion {0!r} contained {1} items instead of\
+ the expected 2 or 4'.format(assertion, len(assertion)))
+        if len(assertion) == 2:
+            node_type, node_attr = assertion
+            # Blank these out if assertion only has two
+            # elements. That means it's of the form
+            # "type:attr" which is shorthand for "match
+            # everything".
+            conditional = None
+            comp_value = None
+        else:
+            node_type, node_attr, conditional, comp_value = assertion
+
+        try:
+            comparator = COMPARATOR_MAP[conditional]
+        except KeyError:
+            comparator = None
+        return node_type, node_attr, comparator, comp_value
 
     @staticmethod
     def _find_query_in_module(tree, query, indexer,
-                              aggressive_search=False):
+                              aggressive_search=False, plan=None):
+        """Evaluates tree, the parsed form of query, against the
+        astroid tree of indexer and returns the set of matching nodes.
+
+        Every assertion evaluated is recorded in plan, a QueryPlan, if
+        one is given."""
         matches = set()
         global_matches = set()
         # Iterate over the tree. A tree is made up of many nested
@@ -69,53 +215,34 @@ class SemanticSearcher(object):
         #
         # [[[assertion], ...],
         #  [[assertion, ...], ...], ...]
-        for expression in tree:
+        #
+        # where an expression after a set operator is wrapped in
+        # [operator, expression].
+        for expression_number, (operator, expression) in \
+                enumerate(iter_expressions(tree)):
             log.debug('Parsing expression %r', expression)
             nodes = None
             # Each expression, in turn, has N number of assertions,
             # which in turn is made up of at least a field node type
             # and a field attribute. Optionally, a conditional and a
             # value may also be there.
-            for assertion in expression:
+            for position, assertion in enumerate(expression):
                 log.debug('\tParsing assertion %r', assertion)
-                if not len(assertion) in [2, 4]:
-                    raise InvalidAssertionError(\
-                        'Assertion {0!r} contained {1} items instead of\
- the expected 2 or 4'.format(assertion, len(assertion)))
+                node_type, node_attr, comparator, comp_value = \
+                    SemanticSearcher._unpack_assertion(assertion)
                 try:
-                    if len(assertion) == 2:
-                        node_type, node_attr = assertion
-                        # Blank these out if assertion only has two
-                        # elements. That means it's of the form
-                        # "type:attr" which is shorthand for "match
-                        # everything".
-                        conditional = None
-                        comp_value = None
-                    else:
-                        node_type, node_attr, conditional, comp_value = assertion
-                    # We need to do this here - annoyingly - because
-                    # the behaviour of the default ParseResults object
-                    # is not consistent with standard Python
-                    # containers.
-                    if comp_value is not None:
-                        # Just try and call asList() - if that fails,
-                        # fall through and do nothing.
-                        try:
-                            comp_value = comp_value.asList()
-                        except AttributeError:
-                            pass
-
-                    try:
-                        comparator = COMPARATOR_MAP[conditional]
-                    except KeyError:
-                        comparator = None
-
                     indexer_fn = INDEXER_MAPS[(node_type, node_attr)]
+                    candidates = None if nodes is None else len(nodes)
+                    start = time.time()
                     try:
                         # This actually returns a list of nodes that
                         # matches the query.
                         nodes = indexer_fn(indexer, comp_value,
                                            comparator=comparator, node_list=nodes)
+                        if plan is not None:
+                            plan.record(query, expression_number, position, assertion,
+                                        'Indexer.' + indexer_fn.__name__, 'scan',
+                                        candidates, len(nodes), time.time() - start)
                         log.debug('\t\tFound %d new submatches (%d total)',
                                   len(nodes), len(matches))
                         # Override the old list with the new one. We
@@ -129,6 +256,10 @@ class SemanticSearcher(object):
                         # failed to match.
                         nodes = None
                         matches = set()
+                        if plan is not None:
+                            plan.record(query, expression_number, position, assertion,
+                                        'Indexer.' + indexer_fn.__name__, 'scan',
+                                        candidates, 0, time.time() - start)
 
                         log.debug('\t\tFound 0 matching nodes')
                         # Break if aggressive_search is not True.
@@ -141,14 +272,94 @@ class SemanticSearcher(object):
  locator assigned to it.'.format(assertion))
                 except NoNodeError:
                     raise
-            # Once we're done with one expression we need to shunt all
-            # the nodes in the matches set into the set
+            # Once we're done with one expression we need to combine
+            # the nodes in the matches set with the set
             # global_matches. The filtering applied by assertions do
-            # not cross "expressions".
-            global_matches.update(matches)
+            # not cross "expressions"; only the set operators do.
+            if operator == 'union':
+                global_matches.update(matches)
+            elif operator == 'intersect':
+                global_matches.intersection_update(matches)
+            else:
+                global_matches.difference_update(matches)
             matches = set()
         return global_matches
 
+    @staticmethod
+    def _find_query_in_symbols(tree, query, symbols, plan=None):
+        """Like _find_query_in_module, but evaluates tree against a
+        list of Symbols, or a SymbolIndex, instead of an Indexer's
+        astroid tree.
+
+        The results of the expressions are combined as bitmaps of the
+        symbols' ids, those of the index if there is one."""
+        if isinstance(symbols, SymbolIndex):
+            ids = symbols.symbol_ids
+        else:
+            ids = SymbolIds()
+        global_matches = 0
+        for expression_number, (operator, expression) in \
+                enumerate(iter_expressions(tree)):
+            log.debug('Parsing expression %r', expression)
+            matches = None
+            for position, assertion in enumerate(expression):
+                log.debug('\tParsing assertion %r', assertion)
+                node_type, node_attr, comparator, comp_value = \
+                    SemanticSearcher._unpack_assertion(assertion)
+                candidates = None if matches is None else len(matches)
+                start = time.time()
+                if (node_type, node_attr) in INDEX_MAPS:
+                    if not isinstance(symbols, SymbolIndex):
+                        raise NoSemanticIndexerError('{0!r} can only be\
+ answered from an index.'.format(assertion))
+                    locator = INDEX_MAPS[(node_type, node_attr)]
+                    conditional = assertion[2] if len(assertion) == 4 else None
+                    found = locator(symbols, comparator or DEFAULT_COMPARATOR, comp_value,
+                                    conditional)
+                    if matches is None:
+                        matches = found
+                    else:
+                        found = set(found)
+                        matches = [symbol for symbol in matches if symbol in found]
+                    if plan is not None:
+                        plan.record(query, expression_number, position, assertion,
+                                    locator.__name__,
+                                    'index ' + getattr(locator, 'access', 'import graph'),
+                                    candidates, len(matches), time.time() - start)
+                    log.debug('\t\tFound %d matching symbols', len(matches))
+                    if not matches:
+                        break
+                    continue
+                try:
+                    kind, matcher = SYMBOL_MAPS[(node_type, node_attr)]
+                except KeyError:
+                    raise NoSemanticIndexerError('{0!r} does not have a valid\
+ locator assigned to it.'.format(assertion))
+                access = 'symbols'
+                if matches is None:
+                    if isinstance(symbols, SymbolIndex):
+                        conditional = assertion[2] if len(assertion) == 4 else None
+                        matches = symbols.select(kind, matcher, conditional, comp_value)
+                        access = 'index ' + select_access(matcher, conditional, comp_value)
+                    else:
+                        matches = [symbol for symbol in symbols if symbol.kind == kind]
+                    candidates = len(matches)
+                elif isinstance(symbols, SymbolIndex):
+                    access = 'index'
+                if comp_value is not None:
+                    matches = [symbol for symbol in matches
+                               if matcher(symbol, comparator or DEFAULT_COMPARATOR,
+                                          comp_value)]
+                if plan is not None:
+                    plan.record(query, expression_number, position, assertion,
+                                matcher.__name__, access, candidates, len(matches),
+                                time.time() - start)
+                log.debug('\t\tFound %d matching symbols', len(matches))
+                if not matches:
+                    break
+            global_matches = combine(global_matches, operator, ids.bitmap(matches or ()))
+        return set(ids.symbols_of(global_matches))
+
     @staticmethod
     def _do_search(filename, query):
         """Actual method that does the search.
@@ -156,27 +367,410 @@ class SemanticSearcher(object):
         This method is designed to operate on a single file ONLY for
         the purposes of enabling paralleism with multiprocessing."""
         tree = AssertionParser(query).tree
+        for _, node in SemanticSearcher._do_search_many(filename,
+                                                        [(query, tree)]):
+            yield node
+
+    @staticmethod
+    def _do_search_many(filename, trees, budget=None):
+        """Evaluates every query in trees against a single file.
+
+        trees is a list of (query, tree) pairs, where tree is the
+        already-parsed form of query. The file is only parsed and
+        indexed once, no matter how many queries there are. Yields
+        (query, node) pairs, grouped by query in the order given."""
+        results, _ = SemanticSearcher._search_file(filename, trees, budget)
+        for result in results:
+            yield result
+
+    @staticmethod
+    def _search_file(filename, trees, budget=None, plan=None, source=None):
+        """Evaluates every query in trees against a single file,
+        keeping within budget, a Budget instance, if one is given. If
+        source is given it is searched instead of the file's contents.
+
+        Returns (results, over_budget). results is a list of (query,
+        result) pairs, grouped by query in the order given and sorted
+        by line number. over_budget is None, or the reason the file
+        went over budget if it did; the file is then either skipped
+        or its results come from the fallback extractor, as Symbols
+        instead of astroid nodes.
+
+        Every assertion evaluated is recorded in plan, a QueryPlan, if
+        one is given."""
         log.info('Commencing with parsing of file %s', filename)
+        over_budget = None
         try:
-            indexer = Indexer(filename)
-            all_nodes = SemanticSearcher._find_query_in_module(tree,
-                                                               query,
-                                                               indexer)
-            for node in all_nodes:
-                yield node
+            try:
+                if budget is None:
+                    matches = SemanticSearcher._search_module(filename, trees, plan, source)
+                else:
+                    budget.check_size(filename, len(source) if source is not None else None)
+                    with budget.time_limit(filename):
+                        matches = SemanticSearcher._search_module(filename, trees, plan,
+                                                                  source)
+            except BudgetExceededError, err:
+                over_budget = str(err)
+                if not budget.fallback:
+                    log.warning('%s. Skipping...', over_budget)
+                    return [], over_budget
+                log.warning('%s. Using the fallback extractor...', over_budget)
+                symbols = extract_symbols(filename, source)
+                matches = [SemanticSearcher._find_query_in_symbols(tree, query, symbols, plan)
+                           for query, tree in trees]
         except SyntaxError:
             log.critical('Syntax Error in %s. Skipping...', filename)
+            return [], over_budget
+        results = []
+        for (query, _), found in zip(trees, matches):
+            results.extend((query, result)
+                           for result in sorted(found, key=lambda r: (r.lineno, r.col_offset)))
+        return results, over_budget
+
+    @staticmethod
+    def _search_module(filename, trees, plan=None, source=None):
+        """Returns a list with the set of matching nodes in filename,
+        or in source if it is given, for each tree in trees."""
+        with memory.phase('build', filename):
+            indexer = Indexer(filename, source)
+        with memory.phase('traverse', filename):
+            indexer.visit()
+        with memory.phase('filter', filename):
+            return [SemanticSearcher._find_query_in_module(tree, query, indexer, plan=plan)
+                    for query, tree in trees]
+
+    def _iter_file_results(self, queries, trees, with_text=True, filenames=None):
+        """Yields (filename, results, over_budget) for every file, or
+        only those in filenames if it is given, as returned by
+        _search_file; in parallel across self.jobs worker processes if
+        there is more than one.
 
+        Either way the files are yielded in the order they were added.
+        Workers are handed the files in the order schedule() picks
+        from the cost model's estimates, so every file has to be
+        listed before the first one is searched. Results from workers
+        are Symbols, as astroid nodes cannot be sent between
+        processes; if with_text is False their text is not formatted.
+
+        How long each file took is recorded in the cost model, if the
+        searcher has one. A searcher with a query plan always searches
+        in this process, so that every step ends up in its plan."""
+        if filenames is None:
+            filenames = self.iter_files()
+        model = self.cost_model
+        if self.jobs <= 1 or self.plan is not None:
+            for filename in filenames:
+                start = time.time()
+                results, over_budget = self._search_file(
+                    filename, trees, self.budget, self.plan,
+                    self.overlays.get(os.path.abspath(filename)))
+                if model is not None:
+                    model.record(os.path.abspath(filename), file_size(filename),
+                                 time.time() - start)
+                yield filename, results, over_budget
+            if model is not None:
+                model.save()
+            return
+        filenames = list(filenames)
+        sizes = [file_size(filename) for filename in filenames]
+        estimator = model or CostModel()
+        batches = schedule([estimator.estimate(os.path.abspath(filename), size)
+                            for filename, size in zip(filenames, sizes)])
+        log.debug('Scheduled %d files in %d batches', len(filenames), len(batches))
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            jobs = ([(position, filenames[position], queries, self.budget, with_text,
+                      self.overlays.get(os.path.abspath(filenames[position])))
+                     for position in batch] for batch in batches)
+            done = {}
+            next_position = 0
+            for batch_results, snapshot in pool.imap_unordered(_search_batch_worker, jobs):
+                if snapshot is not None and memory.active() is not None:
+                    memory.active().merge(snapshot)
+                for position, file_results, seconds in batch_results:
+                    done[position] = file_results
+                    if model is not None:
+                        model.record(os.path.abspath(filenames[position]),
+                                     sizes[position], seconds)
+                while next_position in done:
+                    yield done.pop(next_position)
+                    next_position += 1
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        if model is not None:
+            model.save()
 
     def search(self, query):
-        for filename in self.files:
-            # There may be many nodes returned from each job, so we
-            # need to iterate over them and, sigh, yield them again...
-            # Also, this is as good a time as any to sort the items by
-            # line number.
-            results = SemanticSearcher._do_search(filename, query)
-            for node in sorted(results, key=lambda n: n.lineno):
-                yield node
+        for _, result in self.search_many([query]):
+            yield result
+
+    def search_many(self, queries):
+        """Searches for every query in queries in a single pass over
+        the files.
+
+        Every query is parsed up front, so a malformed query is
+        reported before any file is read. Each file is then parsed
+        and indexed once and all the queries are evaluated against
+        it. Yields (query, result) pairs so that each result can be
+        traced back to the query that produced it.
+
+        Files that go over budget are recorded in over_budget.
+
+        If the searcher has an index, the queries it can answer are
+        answered from it first, and only the rest are searched for in
+        each file. If it has a result cache, only the files that
+        changed since the queries were last run are searched. Results
+        from installed packages, if there are any, come last.
+
+        The results of a query that is a single expression ending with
+        a fuzzy name assertion, like 'fn:name ~ "downlaod"', are held
+        back until every other result has been yielded; only those
+        named one of the fuzzy_top names closest to its value are
+        kept, the closest first."""
+        return self._search_many(queries)
+
+    def _search_many(self, queries, with_text=True):
+        trees = [(query, AssertionParser(query).tree) for query in queries]
+        if self.index is None and any(needs_index(tree) for _, tree in trees):
+            # Some locators are only ever answered from an index;
+            # build a throwaway one, rooted at the current directory.
+            self.index = SymbolIndex(root=os.getcwd())
+        if self.result_cache is not None:
+            results = self._search_cached(trees, with_text)
+        else:
+            results = self._search_trees(trees, with_text)
+        if self.packages:
+            results = itertools.chain(results, self._search_packages(trees))
+        ranked = dict((query, fuzzy_value(tree)) for query, tree in trees
+                      if fuzzy_value(tree) is not None)
+        if ranked:
+            results = self._rank_fuzzy(trees, ranked, results)
+        return results
+
+    def _rank_fuzzy(self, trees, ranked, results):
+        """Yields results, holding back those of the queries in ranked,
+        which maps them to the value of their fuzzy name assertion, to
+        yield them ranked at the end."""
+        held = dict((query, []) for query in ranked)
+        for query, result in results:
+            if query in held:
+                held[query].append((query, result))
+            else:
+                yield query, result
+        for query, _ in trees:
+            if query in held:
+                for result in rank(held.pop(query), ranked[query], self.fuzzy_top):
+                    yield result
+
+    def _search_packages(self, trees):
+        """Yields (query, Symbol) pairs for every query in trees that
+        can be answered from an index, from the index of every package
+        in packages, in turn. Queries that cannot are not searched for
+        in the packages at all."""
+        indexed = []
+        for query, tree in trees:
+            if is_indexable(tree):
+                indexed.append((query, tree))
+            else:
+                log.warning('%s cannot be answered from an index, so installed '
+                            'packages are not searched for it', query)
+        for package in self.packages:
+            for query, tree in indexed:
+                symbols = self._find_query_in_symbols(tree, query, package, self.plan)
+                for symbol in sorted(symbols, key=lambda symbol: (
+                        symbol.filename, symbol.lineno, symbol.col_offset)):
+                    yield query, symbol
+
+    def _search_trees(self, trees, with_text=True, filenames=None, digests=None):
+        """Yields (query, result) pairs for every (query, tree) pair in
+        trees, searching every file or only those in filenames.
+
+        digests, if given, maps absolute filenames to the digests of
+        their contents, sparing the index from reading them again."""
+        queries = [query for query, _ in trees]
+        if self.index is not None:
+            indexed = [(query, tree) for query, tree in trees if is_indexable(tree)]
+            if indexed:
+                for result in self._search_index(indexed, filenames, digests):
+                    yield result
+                trees = [(query, tree) for query, tree in trees
+                         if not is_indexable(tree)]
+                queries = [query for query, _ in trees]
+                if not trees:
+                    return
+        for filename, results, over_budget in self._iter_file_results(queries, trees,
+                                                                      with_text, filenames):
+            if over_budget is not None:
+                self.over_budget.append((filename, over_budget))
+            for result in results:
+                yield result
+
+    def _file_digest(self, filename):
+        """Returns the content digest of filename, taken from the git
+        index if it is unchanged since git last saw it. Raises IOError
+        if it has to be read and cannot be."""
+        source = self.overlays.get(filename)
+        if source is not None:
+            return content_digest(source)
+        if self.git_index is not None:
+            digest = self.git_index.digest(filename)
+            if digest is not None:
+                return digest
+        with open(filename) as f:
+            return content_digest(f.read())
+
+    def _search_cached(self, trees, with_text=True):
+        """Like _search_trees, but answers what it can from the result
+        cache and records the rest in it.
+
+        If no file changed since the queries were last run they are
+        answered without searching anything. Otherwise only the files
+        whose contents changed are searched again; the results of the
+        others come from the cache, as Symbols. Files that go over
+        budget, and overlaid files, are never cached.
+
+        Queries that relate files to one another, such as
+        mod:dependents, are the exception: a change to one file can
+        change their results in any other, so they are searched in
+        every file again whenever any file changed."""
+        cache = self.result_cache
+        digests = OrderedDict()
+        for filename in self.iter_files():
+            path = os.path.abspath(filename)
+            if path in digests:
+                continue
+            try:
+                digests[path] = self._file_digest(path)
+            except IOError, err:
+                log.warning('Cannot read %s: %s', filename, err)
+        generation = file_set_generation(digests)
+        unique_trees = OrderedDict(trees).items()
+        keys = dict((query, normalize_query(tree)) for query, tree in unique_trees)
+        per_file = [(query, tree) for query, tree in unique_trees if not needs_index(tree)]
+        whole_set = [(query, tree) for query, tree in unique_trees if needs_index(tree)]
+        if all(cache.is_current(keys[query], generation) for query, _ in per_file):
+            stale = []
+        else:
+            stale = [path for path, digest in digests.iteritems()
+                     if any(cache.get(keys[query], path, digest) is None
+                            for query, _ in per_file)]
+        log.debug('%d of %d files changed since the last search', len(stale), len(digests))
+        searches = [(per_file, stale)]
+        if not all(cache.is_current(keys[query], generation) for query, _ in whole_set):
+            searches.append((whole_set, list(digests)))
+        # The results found in each file searched again, by query.
+        found = {}
+        over_budget_count = len(self.over_budget)
+        for searched, paths in searches:
+            if not searched or not paths:
+                continue
+            for path in paths:
+                found.setdefault(path, {}).update((query, []) for query, _ in searched)
+            for query, result in self._search_trees(searched, with_text, paths, digests):
+                if isinstance(result, Symbol):
+                    path = result.filename
+                else:
+                    path = result.root().file
+                found[os.path.abspath(path)][query].append(result)
+        over_budget = set(os.path.abspath(filename) for filename, _ in
+                          self.over_budget[over_budget_count:])
+        # Unsaved sources must not end up on disk, so the results of
+        # overlaid files are never cached, and are searched again
+        # every time.
+        overlaid = set(path for path in found if path in self.overlays)
+        for path in found:
+            if path in over_budget or path in overlaid:
+                continue
+            for query, results in found[path].iteritems():
+                symbols = [result if isinstance(result, Symbol) else symbol_from_node(result)
+                           for result in results]
+                cache.put(keys[query], path, digests[path], symbols)
+        if not over_budget and not overlaid:
+            for key in keys.itervalues():
+                cache.set_generation(key, generation, digests)
+        cache.save()
+        return self._iter_cached_results(trees, keys, digests, found)
+
+    def _iter_cached_results(self, trees, keys, digests, found):
+        """Yields the (query, result) pairs of _search_cached, file by
+        file, from found or, for the files not in it, the cache."""
+        for path, digest in digests.iteritems():
+            searched = found.get(path, {})
+            for query, _ in trees:
+                if query in searched:
+                    results = searched[query]
+                else:
+                    results = self.result_cache.get(keys[query], path, digest) or []
+                for result in results:
+                    yield query, result
+
+    def _search_index(self, trees, filenames=None, digests=None):
+        """Answers every query in trees from the index, once it has
+        been brought up to date with the files to search, or those in
+        filenames if it is given. A large index is searched in
+        segments, in parallel across self.jobs worker processes (see
+        sona.segments).
+
+        Yields (query, Symbol) pairs for the files to search only,
+        grouped by file in the order they were added and then by
+        query, just like a search of each file would."""
+        if filenames is None:
+            filenames = self.iter_files()
+        digests = digests or {}
+        positions = {}
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            if path in positions:
+                continue
+            positions[path] = len(positions)
+            source = self.overlays.get(path)
+            digest = digests.get(path)
+            if digest is None and source is None and self.git_index is not None:
+                digest = self.git_index.digest(path)
+            try:
+                self.index.update(path, source, digest, overlay=source is not None)
+            except IOError, err:
+                log.warning('Cannot read %s: %s', filename, err)
+        if self.index_files is not None and any(needs_index(tree) for _, tree in trees):
+            for filename in self.index_files:
+                path = os.path.abspath(filename)
+                if path in positions or path in self.overlays or not os.path.isfile(path):
+                    continue
+                digest = self.git_index.digest(path) if self.git_index is not None else None
+                try:
+                    self.index.update(path, digest=digest)
+                except IOError, err:
+                    log.warning('Cannot read %s: %s', filename, err)
+        self.index.save()
+        if self.plan is None and can_split(self.index, self.jobs):
+            found = find_in_segments(self.index, trees, self.jobs)
+        else:
+            found = [self._find_query_in_symbols(tree, query, self.index, self.plan)
+                     for query, tree in trees]
+        results = []
+        for position, ((query, tree), symbols) in enumerate(zip(trees, found)):
+            for symbol in symbols:
+                if symbol.filename in positions:
+                    results.append((positions[symbol.filename], position,
+                                    symbol.lineno, symbol.col_offset, query, symbol))
+        results.sort(key=lambda result: result[:4])
+        for _, _, _, _, query, symbol in results:
+            yield query, symbol
+
+    def aggregate(self, queries, group_by=None, top=None):
+        """Counts the results of every query in queries, without
+        formatting them.
+
+        group_by is None, for one count per query, or one of the keys
+        in sona.aggregate.GROUP_KEYS. If top is given, only the top
+        largest counts are kept. Returns a list of (query, key, count)
+        tuples, largest counts first."""
+        aggregator = Aggregator(group_by, top, queries)
+        for query, result in self._search_many(queries, with_text=False):
+            aggregator.add(query, result)
+        return aggregator.counts()
 
     # def search(self, query):
     #     jobs = [gevent.spawn(SemanticSearcher._do_search, filename, query)
@@ -193,6 +787,89 @@ class SemanticSearcher(object):
 
 
 
+def count_trailers(node):
+    """Returns the number of attributes, call arguments and subscripts
+    that follow the first atom of the source of the astroid node
+    node: 2 for a.b(), for instance."""
+    count = 0
+    while True:
+        if isinstance(node, Getattr):
+            node = node.expr
+        elif isinstance(node, CallFunc):
+            node = node.func
+        elif isinstance(node, Subscript):
+            node = node.value
+        else:
+            return count
+        count += 1
+
+
+def symbol_from_node(node, with_text=True):
+    """Returns a Symbol standing in for the astroid node node, with
+    its text formatted by OutputFormatterBase unless with_text is
+    False."""
+    name = find_immediate_name(node)
+    parent = cls = None
+    for parent_node in get_all_parents(node):
+        # Only scopes count; an except handler has a "name" too.
+        if parent is None and isinstance(parent_node, (Function, Class, Module)):
+            parent = parent_node.name
+        if isinstance(parent_node, Class):
+            cls = parent_node.name
+            break
+    argcount = bases = None
+    if isinstance(node, Function):
+        argcount = len(node.args.args) + bool(node.args.vararg) + bool(node.args.kwarg)
+    elif isinstance(node, Class):
+        bases = tuple(find_immediate_name(base) for base in node.bases)
+    doc = getattr(node, 'doc', None)
+    if isinstance(doc, unicode):
+        doc = doc.encode('utf-8')
+    end_lineno = node.tolineno if isinstance(node, (Function, Class)) else None
+    text = OutputFormatterBase().format_single_result(node) if with_text else None
+    return Symbol(NODE_KINDS.get(node.__class__), name, node.root().file,
+                  node.lineno, node.col_offset, parent, cls, argcount, bases,
+                  text, doc, end_lineno)
+
+
+def _search_batch_worker(batch):
+    """Searches a batch of files in a worker process. batch is a list
+    of (position, filename, queries, budget, with_text, source) tuples.
+
+    Returns (results, snapshot). results is a list of (position,
+    file_results, seconds), where file_results is what _search_worker
+    returns and seconds how long it took. snapshot is what the batch
+    allocated, as returned by MemoryReport.snapshot, if the parent
+    process was recording a memory report when it forked, or None."""
+    # A fresh report per batch, so that the parent can add up the
+    # snapshots of every batch a worker ran.
+    report = memory.start() if memory.active() is not None else None
+    results = []
+    for job in batch:
+        start = time.time()
+        file_results = _search_worker(job[1:])
+        results.append((job[0], file_results, time.time() - start))
+    return results, report.snapshot() if report is not None else None
+
+
+def _search_worker(job):
+    """Searches a single file in a worker process. job is a
+    (filename, queries, budget, with_text, source) tuple, where source
+    is the file's overlay, or None.
+
+    Returns the same as SemanticSearcher._iter_file_results, with
+    every astroid node replaced by a Symbol. The Symbols' text is
+    only formatted if with_text is True."""
+    filename, queries, budget, with_text, source = job
+    trees = [(query, AssertionParser(query).tree) for query in queries]
+    results, over_budget = SemanticSearcher._search_file(filename, trees, budget,
+                                                         source=source)
+    results = [(query, result if isinstance(result, Symbol)
+                else symbol_from_node(result, with_text))
+               for query, result in results]
+    return filename, results, over_budget
+
+
 class OutputFormatterBase(object):
     """Base Class for formatting a SemanticSearcher's results for
     display on the screen.
@@ -201,6 +878,9 @@ class OutputFormatterBase(object):
     along with helper methods to iterate over, and display, each node
     result."""
 
+    TAGGED_RESULT_FORMAT = '[{value}] {result}'
+
+    COUNT_FORMAT = '{count:>7} {key}'
 
     def __init__(self, results=None, **settings):
         """Creates an Output Formatter class.
@@ -237,17 +917,98 @@ class OutputFormatterBase(object):
         result."""
         results = results or self.results
         for result in results:
-            self.print_single_result(result, self.format_single_result(result))
+            with memory.phase('format'):
+                formatted_result = self._format_or_skip(result)
+            if formatted_result is not None:
+                self.print_single_result(result, formatted_result)
         self.post_output()
 
+    def print_all_tagged_results(self, tagged_results, tag='query'):
+        """Like print_all_results, but for (value, result) pairs such
+        as the ones returned by SemanticSearcher.search_many.
+
+        tag names what the values are -- the query that produced the
+        result, the commits it was found in, and so on. Each result is
+        handed to print_single_tagged_result along with its tag and
+        value."""
+        for value, result in tagged_results:
+            with memory.phase('format'):
+                formatted_result = self._format_or_skip(result)
+            if formatted_result is not None:
+                self.print_single_tagged_result(tag, value, result, formatted_result)
+        self.post_output()
+
+    def print_single_tagged_result(self, tag, value, result, formatted_result):
+        """Called for every result by print_all_tagged_results.
+
+        By default the value is folded into formatted_result using
+        TAGGED_RESULT_FORMAT and passed on to print_single_result."""
+        self.print_single_result(result, self.TAGGED_RESULT_FORMAT.format(
+            value=value, result=formatted_result))
+
+    def print_all_counts(self, counts, tagged=False):
+        """Displays the (query, key, count) tuples returned by
+        SemanticSearcher.aggregate. The query is only shown if tagged
+        is True."""
+        for query, key, count in counts:
+            self.print_single_count(query if tagged else None, key, count)
+        self.post_output()
+
+    def print_single_count(self, query, key, count):
+        """Called for every count by print_all_counts. key is None if
+        the results were not grouped, and query None unless it should
+        be shown."""
+        text = self.COUNT_FORMAT.format(count=count, key='' if key is None else key).rstrip()
+        if query is not None:
+            text = self.TAGGED_RESULT_FORMAT.format(value=query, result=text.strip())
+        self.output(text)
+
+    @property
+    def has_context(self):
+        """True if context lines are displayed around each result."""
+        return bool(self.settings.get('before_context') or
+                    self.settings.get('after_context'))
+
+    def context_lines(self, result):
+        """Returns (before, after), the lists of (lineno, line) around
+        result to display along with it, as set by the before_context
+        and after_context settings."""
+        before_context = self.settings.get('before_context') or 0
+        after_context = self.settings.get('after_context') or 0
+        if not self.has_context:
+            return [], []
+        try:
+            source_text = source_text_for(result)
+        except IOError, err:
+            log.warning('No context for a result that cannot be read: %s', err)
+            return [], []
+        return (source_text.lines(result.lineno - before_context, result.lineno - 1),
+                source_text.lines(result.lineno + 1, result.lineno + after_context))
+
+    def _format_or_skip(self, result):
+        """Returns format_single_result(result), or None if the file
+        result was found in has to be read to format it and can no
+        longer be, such as an uninstalled package's."""
+        try:
+            return self.format_single_result(result)
+        except IOError, err:
+            log.warning('Skipping a result that cannot be read: %s', err)
+            return None
+
     def format_single_result(self, result):
         """Dispatcher method that formats result based on its node type.
 
         This is done by, in turn, calling another method named
         _format_<Node Class> with the result."""
-        # Use dispatching to get the method name of the formatter
+        # Use dispatching to get the method name of the formatter; a
+        # subclass, such as TableSymbol, is formatted like the class it
+        # extends.
+        name = '_format_{0}'.format(result.__class__.__name__)
+        for cls in result.__class__.__mro__:
+            if hasattr(self, '_format_{0}'.format(cls.__name__)):
+                name = '_format_{0}'.format(cls.__name__)
+                break
         try:
-            name = '_format_{0}'.format(result.__class__.__name__)
             formatter = getattr(self, name)
             assert callable(formatter)
             return formatter(result)
@@ -266,24 +1027,39 @@ not exist on class {2!r}'.format(result, name, self))
         return fmt
 
     def _format_AssName(self, node):
-        try:
-            if isinstance(node.parent, Arguments):
-                s = self._format_Function(node.parent.parent)
-            else:
-                # as_string() is a bit aggressive and will happily
-                # rebuild the entire body; we just want the top line
-                # the "AssName" (snicker) object is on. splitlines()
-                # will give us what we want, but it's a horrible hack.
-                s = node.parent.as_string().splitlines().pop()
-        except AttributeError:
-            s = node.as_string().splitlines().pop()
+        if isinstance(node.parent, Arguments):
+            s = self._format_Function(node.parent.parent)
+        else:
+            # Slice the line the "AssName" (snicker) object is on out
+            # of the original source, rather than regenerate its
+            # parent -- which may be an entire loop or function body
+            # -- with as_string().
+            s = source_text_for(node).line(node.lineno)
         fmt = 'var assign -> {0}'.format(s.strip())
         return fmt
 
+    def _format_Name(self, node):
+        s = source_text_for(node).line(node.lineno)
+        fmt = 'var ref -> {0}'.format(s.strip())
+        return fmt
+
     def _format_CallFunc(self, node):
-        fmt = 'call -> {0}'.format(node.as_string())
+        # The call starts where what it calls does, so it ends after the
+        # trailers of that, such as the earlier calls of a chain, and
+        # its own arguments.
+        s = source_text_for(node).expression(node.lineno, node.col_offset,
+                                             count_trailers(node.func) + 1)
+        # Calls spanning several lines are shown on one.
+        fmt = 'call -> {0}'.format(' '.join(s.replace('\\\n', ' ').split()))
         return fmt
 
+    def _format_Symbol(self, symbol):
+        """Symbols carry their own text, formatted when they were
+        extracted, unless they were read from a symbol table."""
+        if symbol.text is None:
+            return symbol_text(symbol.kind, symbol.lineno, source_text_for(symbol))
+        return symbol.text
+
     def _format_Class(self, node):
         """Formats a Class node to make it look like it would in
         Python."""
@@ -306,32 +1082,103 @@ def return_sane_filepath(filepath, root_dir='.'):
         os.chdir(old_dir)
 
 
+def result_filepath(result):
+    """Returns the sane filepath of the file result, an astroid node
+    or a Symbol, was found in."""
+    if isinstance(result, Symbol):
+        return return_sane_filepath(result.filename)
+    return return_sane_filepath(result.root().file)
+
+
 class GrepOutputFormatter(OutputFormatterBase):
 
     GREP_OUTPUT_FORMAT = './{filename}:{lineno}:{result}'
 
+    GREP_CONTEXT_FORMAT = './{filename}-{lineno}-{line}'
+
+    GREP_GROUP_SEPARATOR = '--'
+
+    def __init__(self, results=None, **settings):
+        super(GrepOutputFormatter, self).__init__(results, **settings)
+        # The (filename, lineno) of the last line printed, so that
+        # overlapping context lines are only printed once.
+        self._last_printed = None
+
+    def print_line(self, filename, lineno, text, is_context=False):
+        """Prints a result or context line, preceded by a separator if
+        it does not follow on from the last line printed. Context
+        lines that were already printed are skipped."""
+        if self._last_printed is not None:
+            last_filename, last_lineno = self._last_printed
+            if filename == last_filename and lineno <= last_lineno:
+                if is_context:
+                    return
+            elif filename != last_filename or lineno > last_lineno + 1:
+                self.output(self.GREP_GROUP_SEPARATOR)
+            if filename == last_filename:
+                lineno = max(lineno, last_lineno)
+        self.output(text)
+        self._last_printed = (filename, lineno)
+
     def print_single_result(self, result, formatted_result):
+        filename = result_filepath(result)
         output = self.GREP_OUTPUT_FORMAT.format(
-            filename=return_sane_filepath(result.root().file),
+            filename=filename,
             lineno=result.lineno,
             result=formatted_result)
-        self.output(output)
+        if not self.has_context:
+            self.output(output)
+            return
+        before, after = self.context_lines(result)
+        for lineno, line in before:
+            self.print_line(filename, lineno, self.GREP_CONTEXT_FORMAT.format(
+                    filename=filename, lineno=lineno, line=line), is_context=True)
+        self.print_line(filename, result.lineno, output)
+        for lineno, line in after:
+            self.print_line(filename, lineno, self.GREP_CONTEXT_FORMAT.format(
+                    filename=filename, lineno=lineno, line=line), is_context=True)
 
     def post_output(self):
         pass
 
 class JSONOutputFormatter(OutputFormatterBase):
 
-    _store = []
+    def __init__(self, results=None, **settings):
+        super(JSONOutputFormatter, self).__init__(results, **settings)
+        # Everything output so far, printed as one JSON list by
+        # post_output.
+        self._store = []
 
     def output(self, text):
         """Outputs text in JSON format to stdout."""
         self._store.append(text)
 
+    def result_dict(self, result, formatted_result):
+        """Returns the dict that represents result in the output."""
+        output = {'filename': result_filepath(result),
+                  'lineno': result.lineno,
+                  'result': formatted_result,}
+        before, after = self.context_lines(result)
+        if self.has_context:
+            output['context'] = {'before': [line for lineno, line in before],
+                                 'after': [line for lineno, line in after]}
+        return output
+
     def print_single_result(self, result, formatted_result):
-        self.output({'filename': return_sane_filepath(result.root().file),
-                     'lineno': result.lineno,
-                     'result': formatted_result,})
+        self.output(self.result_dict(result, formatted_result))
+
+    def print_single_tagged_result(self, tag, value, result, formatted_result):
+        output = self.result_dict(result, formatted_result)
+        output[tag] = str(value)
+        self.output(output)
+
+    def print_single_count(self, query, key, count):
+        count = {'count': count}
+        if key is not None:
+            count['key'] = key
+        if query is not None:
+            count['query'] = query
+        self.output(count)
 
     def post_output(self):
         print json.dumps(self._store)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import logging
+import multiprocessing
+
+from sona.index import SymbolIndex
+from sona.symtable import SymbolTable
+from sona.exceptions import InvalidIndexError
+
+log = logging.getLogger(__name__)
+
+# Fewest symbols a table must have for a query over it to be split
+# among worker processes; below that, starting them costs more than
+# the split saves.
+MIN_SEGMENT_SYMBOLS = 50000
+
+# The table a worker process attached to (see _attach_table).
+_table = None
+_root = None
+
+
+def can_split(index, jobs):
+    """Returns True if a query over index is worth splitting among jobs
+    worker processes: it must all be in its saved table, which must be
+    large enough."""
+    return (jobs > 1 and index.table is not None and index.path is not None
+            and not index.entries and not index.removed
+            and index.table.n_symbols >= MIN_SEGMENT_SYMBOLS)
+
+
+def split_symbols(table, count):
+    """Returns up to count (start, stop) ranges of symbol numbers, as
+    even as they can be, that cover the symbols of table. Ranges start
+    where files do, so that the symbols of a file, such as the names
+    one import statement imports, are never split up."""
+    n_symbols = table.n_symbols
+    count = max(min(count, n_symbols), 1)
+    bounds = sorted(set([table.file_start(n_symbols * number // count)
+                         for number in xrange(count)] + [n_symbols]))
+    return zip(bounds, bounds[1:])
+
+
+def _attach_table(path, generation, root):
+    """Maps the table at path into a worker process, once. The pages of
+    the mapping are those of the file, shared with the parent and every
+    other worker, so nothing is copied or decoded up front."""
+    global _table, _root
+    table = SymbolTable(path)
+    if table.generation != generation:
+        table.close()
+        raise InvalidIndexError('{0} changed from generation {1} while it was '
+                                'being searched'.format(path, generation))
+    _table, _root = table, root
+
+
+def _search_segment(job):
+    """Evaluates every query in a worker process, against the symbols
+    numbered start up to stop of its table only. job is a (start,
+    stop, trees) tuple, where trees is a list of (query, tree) pairs.
+    Returns a list with the set of matching Symbols for each query."""
+    from sona.search import SemanticSearcher
+    start, stop, trees = job
+    index = SymbolIndex(_table.path, _root)
+    index.table = _table.segment(start, stop)
+    return [SemanticSearcher._find_query_in_symbols(tree, query, index)
+            for query, tree in trees]
+
+
+def find_in_segments(index, trees, jobs):
+    """Returns a list with the set of Symbols in index that match each
+    (query, tree) pair in trees, like _find_query_in_symbols, with the
+    symbols of the saved table split among jobs worker processes.
+
+    Each worker maps the table itself, rather than receiving any of
+    it, and is only ever sent the range of symbols to search and the
+    parsed queries. Queries only combine symbols one at a time, so the
+    results of the ranges add up to those of the whole table."""
+    table = index.table
+    segments = split_symbols(table, jobs)
+    log.debug('Searching %d symbols in %d segments', table.n_symbols, len(segments))
+    found = [set() for _ in trees]
+    pool = multiprocessing.Pool(min(jobs, len(segments)), _attach_table,
+                                (table.path, table.generation, index.root))
+    try:
+        for results in pool.imap_unordered(
+                _search_segment, [(start, stop, trees) for start, stop in segments]):
+            for symbols, segment_symbols in zip(found, results):
+                symbols.update(segment_symbols)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return found
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import logging
+import threading
+
+from sona.index import SymbolIndex, INDEX_FILENAME, is_indexable
+from sona.symtable import SymbolTable
+from sona.parser import AssertionParser
+from sona.search import SemanticSearcher
+from sona.fuzzy import FUZZY_TOP_K, fuzzy_value, rank
+from sona.exceptions import InvalidAssertionError, InvalidIndexError
+
+log = logging.getLogger(__name__)
+
+
+class IndexSnapshot(object):
+    """A saved index as it was at one generation, for any number of
+    threads to query at once.
+
+    A snapshot never changes: it is a SymbolTable, which is read-only,
+    and the ImportGraph saved with it, loaded the first time a query
+    needs it. Each query gets a SymbolIndex of its own over the
+    snapshot (see index), so that nothing a query keeps track of is
+    shared with any other."""
+
+    def __init__(self, table, root=None):
+        self.table = table
+        self.root = root
+        self._graph = None
+        self._graph_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, directory, root=None):
+        """Returns a snapshot of the index saved in directory, or None
+        if there is none (or it is unreadable). The root of the index
+        is root or, by default, the directory directory is in."""
+        if root is None:
+            root = os.path.dirname(os.path.abspath(directory))
+        path = os.path.join(directory, INDEX_FILENAME)
+        try:
+            return cls(SymbolTable(path), root)
+        except (IOError, InvalidIndexError), err:
+            log.debug('No snapshot of %s: %s', path, err)
+            return None
+
+    @property
+    def path(self):
+        return self.table.path
+
+    @property
+    def generation(self):
+        return self.table.generation
+
+    @property
+    def graph(self):
+        """The ImportGraph of the snapshot's files. Only one thread
+        ever loads, or builds, it."""
+        if self._graph is None:
+            with self._graph_lock:
+                if self._graph is None:
+                    index = SymbolIndex(self.path, self.root)
+                    index.table = self.table
+                    self._graph = index.graph
+        return self._graph
+
+    def index(self):
+        """Returns a SymbolIndex over the snapshot for a single query.
+        It must not be updated or saved."""
+        return SnapshotIndex(self)
+
+
+class SnapshotIndex(SymbolIndex):
+    """The SymbolIndex a query over an IndexSnapshot is answered from.
+    It shares the snapshot's table and import graph, but has symbol
+    ids of its own."""
+
+    def __init__(self, snapshot):
+        super(SnapshotIndex, self).__init__(snapshot.path, snapshot.root)
+        self.snapshot = snapshot
+        self.table = snapshot.table
+
+    @property
+    def graph(self):
+        return self.snapshot.graph
+
+
+class QueryService(object):
+    """Answers queries from any number of threads at once, from
+    snapshots of the index saved in directory.
+
+    Every query is answered from whichever snapshot is current when it
+    starts, and from that one only, however long it takes. Meanwhile
+    refresh re-indexes the files in the background and, once the new
+    table is saved, swaps a snapshot of it in: replacing the snapshot
+    is a single assignment, so queries never wait for a lock. An old
+    snapshot is unmapped once the last query using it is done.
+
+    Only queries that can be answered from an index are served."""
+
+    def __init__(self, directory, root=None, fuzzy_top=FUZZY_TOP_K):
+        self.directory = directory
+        if root is None:
+            root = os.path.dirname(os.path.abspath(directory))
+        self.root = root
+        # How many of the closest names the results of a query that
+        # ends with a fuzzy name assertion are kept for.
+        self.fuzzy_top = fuzzy_top
+        self.snapshot = IndexSnapshot.open(directory, root)
+        # Only one refresh at a time writes the table.
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def generation(self):
+        """The generation of the current snapshot, or None if there is
+        no index yet."""
+        snapshot = self.snapshot
+        return snapshot.generation if snapshot is not None else None
+
+    def search(self, query):
+        """Returns the Symbols that match query, like search_many."""
+        return [result for _, result in self.search_many([query])]
+
+    def search_many(self, queries):
+        """Returns a list of (query, Symbol) pairs for every query in
+        queries, all of them answered from the same snapshot, grouped
+        by query in the order given and then sorted by file and line.
+        The results of a query that ends with a fuzzy name assertion
+        are ranked as SemanticSearcher.search_many ranks them.
+
+        Raises QuerySyntaxError if a query is malformed, and
+        InvalidAssertionError if it cannot be answered from an
+        index."""
+        trees = [(query, AssertionParser(query).tree) for query in queries]
+        for query, tree in trees:
+            if not is_indexable(tree):
+                raise InvalidAssertionError(
+                    '{0!r} cannot be answered from an index'.format(query))
+        snapshot = self.snapshot
+        if snapshot is None:
+            return []
+        index = snapshot.index()
+        results = []
+        for query, tree in trees:
+            symbols = SemanticSearcher._find_query_in_symbols(tree, query, index)
+            found = [(query, symbol) for symbol in sorted(symbols, key=lambda symbol: (
+                symbol.filename, symbol.lineno, symbol.col_offset))]
+            value = fuzzy_value(tree)
+            if value is not None:
+                found = rank(found, value, self.fuzzy_top)
+            results.extend(found)
+        return results
+
+    def refresh(self, filenames, git_index=None):
+        """Brings the index up to date with filenames, the files to
+        serve queries about, and swaps in a snapshot of it if anything
+        changed. Files that are in the index but not in filenames are
+        dropped from it. Returns the current snapshot.
+
+        Unchanged files are not read again; with a GitIndex, those git
+        knows to be unchanged are not read at all. Queries go on being
+        answered from the previous snapshot in the meantime."""
+        with self._refresh_lock:
+            index = SymbolIndex.open(self.directory, self.root)
+            paths = set()
+            for filename in filenames:
+                path = os.path.abspath(filename)
+                paths.add(path)
+                digest = git_index.digest(path) if git_index is not None else None
+                try:
+                    index.update(path, digest=digest)
+                except IOError, err:
+                    log.warning('Cannot read %s: %s', filename, err)
+            for filename in index.filenames():
+                if filename not in paths:
+                    index.remove(filename)
+            saved = index.dirty or index.table is None
+            if saved:
+                index.dirty = True
+                index.save()
+            snapshot = self.snapshot
+            if saved or snapshot is None or snapshot.generation != index.table.generation:
+                # The writer's table is handed over to the snapshot, and
+                # never used by the writer again.
+                self.snapshot = IndexSnapshot(index.table, self.root)
+                log.debug('Swapped in generation %d of %s', self.generation, self.directory)
+            return self.snapshot
+
+    def refresh_in_background(self, filenames, git_index=None):
+        """Runs refresh in a daemon thread, which it returns."""
+        thread = threading.Thread(target=self.refresh, args=(list(filenames), git_index))
+        thread.daemon = True
+        thread.start()
+        return thread
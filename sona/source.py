@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+from sona.symbols import Symbol
+
+log = logging.getLogger(__name__)
+
+# Number of files whose source is kept around by get_source_text.
+SOURCE_CACHE_SIZE = 64
+
+# Brackets that must be balanced when slicing an expression out of
+# the source, and the quotes of the strings that can hide them.
+OPENING_BRACKETS = '([{'
+CLOSING_BRACKETS = ')]}'
+QUOTES = '\'"'
+
+
+class SourceText(object):
+    """The source of a module along with a table of the offsets at
+    which each line begins, so any line or expression can be sliced
+    out of the original text without splitting, or regenerating, the
+    whole thing."""
+
+    def __init__(self, text):
+        self.text = text
+        offsets = [0]
+        pos = text.find('\n')
+        while pos != -1:
+            offsets.append(pos + 1)
+            pos = text.find('\n', pos + 1)
+        self.offsets = offsets
+
+    def __len__(self):
+        """Returns the number of lines."""
+        if self.text.endswith('\n'):
+            return len(self.offsets) - 1
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        """Returns the line at index, counting from 0 like the list
+        of lines it stands in for."""
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.line(index + 1)
+
+    def offset(self, lineno, col_offset=0):
+        """Returns the offset into text of a line number (counting
+        from 1) and column."""
+        return self.offsets[lineno - 1] + col_offset
+
+    def line(self, lineno):
+        """Returns line number lineno, without its line ending, or ''
+        if there is no such line."""
+        if not 0 < lineno <= len(self):
+            return ''
+        start = self.offsets[lineno - 1]
+        end = self.offsets[lineno] if lineno < len(self.offsets) else len(self.text)
+        return self.text[start:end].rstrip('\r\n')
+
+    def lines(self, first, last):
+        """Returns a list of (lineno, line) for the lines first to
+        last, inclusive, that exist."""
+        first = max(first, 1)
+        last = min(last, len(self))
+        return [(lineno, self.line(lineno)) for lineno in xrange(first, last + 1)]
+
+    def expression(self, lineno, col_offset, trailers=None):
+        """Returns the source of the expression starting at lineno and
+        col_offset: an atom, such as a name, a string or a bracketed
+        expression, followed by trailers trailers -- attributes, call
+        arguments and subscripts -- or, if trailers is None, by every
+        trailer that follows it. Strings are skipped over so brackets
+        inside them do not count. Falls back to the rest of the line
+        if a bracket is never closed."""
+        text = self.text
+        start = self.offset(lineno, col_offset)
+        pos = self._skip_atom(start)
+        count = 0
+        while pos is not None and (trailers is None or count < trailers):
+            after = self._skip_space(pos)
+            if after >= len(text) or text[after] not in '.([':
+                break
+            if text[after] == '.':
+                pos = self._skip_name(self._skip_space(after + 1))
+            else:
+                pos = self._skip_brackets(after)
+            count += 1
+        if pos is None or pos == start:
+            return self.line(lineno)[col_offset:]
+        return text[start:pos]
+
+    def _skip_space(self, pos):
+        """Returns the offset of the first character from pos on that
+        is not whitespace, a line continuation or a comment."""
+        text = self.text
+        while pos < len(text):
+            if text[pos] == '#':
+                pos = text.find('\n', pos)
+                if pos == -1:
+                    return len(text)
+            elif not text[pos].isspace() and text[pos] != '\\':
+                break
+            pos += 1
+        return pos
+
+    def _skip_name(self, pos):
+        text = self.text
+        while pos < len(text) and (text[pos].isalnum() or text[pos] == '_'):
+            pos += 1
+        return pos
+
+    def _skip_string(self, pos):
+        """Returns the offset just past the string literal whose quote
+        is at pos, minding escapes and triple quotes, or None if it is
+        never closed."""
+        text = self.text
+        quote = text[pos] * 3 if text[pos:pos + 3] == text[pos] * 3 else text[pos]
+        pos += len(quote)
+        while pos < len(text):
+            if text[pos] == '\\':
+                pos += 2
+            elif text.startswith(quote, pos):
+                return pos + len(quote)
+            else:
+                pos += 1
+        return None
+
+    def _skip_brackets(self, pos):
+        """Returns the offset just past the bracket that closes the one
+        at pos, or None if it is never closed."""
+        text = self.text
+        depth = 0
+        while pos is not None and pos < len(text):
+            char = text[pos]
+            if char in QUOTES:
+                pos = self._skip_string(pos)
+                continue
+            if char in OPENING_BRACKETS:
+                depth += 1
+            elif char in CLOSING_BRACKETS:
+                depth -= 1
+                if depth <= 0:
+                    return pos + 1
+            pos += 1
+        return None
+
+    def _skip_atom(self, pos):
+        """Returns the offset just past the atom at pos, or None if it
+        is a bracket or string that is never closed."""
+        text = self.text
+        if pos < len(text) and text[pos] in OPENING_BRACKETS:
+            return self._skip_brackets(pos)
+        # A name, a number or the prefix of a string, such as u'...'.
+        pos = self._skip_name(pos)
+        if pos < len(text) and text[pos] in QUOTES:
+            return self._skip_string(pos)
+        return pos
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# The SourceText of every file whose contents are overlaid by a string
+# (see set_overlay), by absolute path.
+_overlays = {}
+
+
+def set_overlay(filename, text):
+    """Makes get_source_text return the SourceText of text for
+    filename, which need not exist, instead of reading it, or stop
+    doing so if text is None."""
+    if text is None:
+        _overlays.pop(os.path.abspath(filename), None)
+    else:
+        _overlays[os.path.abspath(filename)] = SourceText(text)
+
+
+def get_source_text(filename):
+    """Returns the SourceText of filename, reading it only if it is
+    not among the SOURCE_CACHE_SIZE most recently used files or has
+    been modified since it was read. Overlaid files are never read.
+    Raises IOError if filename cannot be read. Safe to call from
+    several threads."""
+    if _overlays:
+        source_text = _overlays.get(os.path.abspath(filename))
+        if source_text is not None:
+            return source_text
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError, err:
+        raise IOError(err.errno, err.strerror, filename)
+    with _cache_lock:
+        cached_mtime, source_text = _cache.pop(filename, (None, None))
+        if cached_mtime == mtime:
+            _cache[filename] = (mtime, source_text)
+            return source_text
+    with open(filename) as f:
+        source_text = SourceText(f.read())
+    with _cache_lock:
+        _cache.pop(filename, None)
+        if len(_cache) >= SOURCE_CACHE_SIZE:
+            _cache.popitem(last=False)
+        _cache[filename] = (mtime, source_text)
+    return source_text
+
+
+def source_text_for(result):
+    """Returns the SourceText of the module result, an astroid node or
+    a Symbol, was found in. Modules built from a string (see Indexer)
+    carry their own source; everything else is read from disk."""
+    if isinstance(result, Symbol):
+        return get_source_text(result.filename)
+    module = result.root()
+    source_text = getattr(module, 'source_text', None)
+    if source_text is None:
+        source_text = get_source_text(module.file)
+    return source_text
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import ast
+import logging
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+# Names Python 2's ast reads like any variable, but astroid parses as
+# constants, so the Indexer never finds them as references.
+CONSTANT_NAMES = frozenset(['None', 'True', 'False'])
+
+
+class Symbol(namedtuple('Symbol', 'kind name filename lineno col_offset '
+                        'parent cls argcount bases text doc end_lineno')):
+    """A lightweight, picklable stand-in for an astroid node.
+
+    kind is one of 'fn', 'cls', 'var', 'ref', 'call', 'import' or
+    'mod', for the module itself; a 'ref' is a variable that is read
+    rather than assigned. An import's
+    name is the module imported, with a leading dot per level of a
+    relative import, followed by the name imported from it for
+    from-imports. parent is the name of
+    the closest enclosing function, class or module, and cls that of
+    the closest enclosing class, if any. argcount is only set for
+    functions and bases only for classes. text is what an output
+    formatter displays for the symbol; if it is None, it is worked out
+    from the source with symbol_text. doc is the docstring of a
+    function, class or module, if it has one, and end_lineno the last
+    line of one (see sona.extents)."""
+    __slots__ = ()
+
+
+def _immediate_name(node):
+    """The stdlib ast equivalent of locators.find_immediate_name."""
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    if isinstance(node, ast.Name):
+        return node.id
+    return ''
+
+
+# The keyword that starts the definition of each kind of symbol that
+# is displayed as its definition.
+DEFINITION_KEYWORDS = {
+    'fn': 'def ',
+    'cls': 'class ',
+    }
+
+# How every other kind of symbol is displayed, given its line.
+TEXT_FORMATS = {
+    'var': 'var assign -> {0}',
+    'ref': 'var ref -> {0}',
+    'call': 'call -> {0}',
+    'import': 'import -> {0}',
+    'mod': 'module -> {0}',
+    }
+
+
+def symbol_text(kind, lineno, lines):
+    """Returns the text displayed for a symbol of kind on line lineno
+    of lines, a sequence of source lines numbered from 1.
+
+    Definitions are displayed as the line they are defined on, past
+    any decorators and without the trailing colon; everything else as
+    the first line it is on."""
+    def line(lineno):
+        if 0 < lineno <= len(lines):
+            return lines[lineno - 1].strip()
+        return ''
+    keyword = DEFINITION_KEYWORDS.get(kind)
+    if keyword is None:
+        return TEXT_FORMATS[kind].format(line(lineno))
+    for definition_lineno in xrange(lineno, len(lines) + 1):
+        text = line(definition_lineno)
+        if text.startswith(keyword):
+            return text[:-1] if text.endswith(':') else text
+    return line(lineno)
+
+
+def _end_lineno(node):
+    """Returns the last line of a function or class node: that of the
+    last node in it, as the ast module does not record where nodes
+    end. Returns None for anything else."""
+    if not isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+        return None
+    return max(getattr(child, 'lineno', node.lineno) for child in ast.walk(node))
+
+
+def _docstring(node):
+    """Returns the docstring of a function, class or module node, as
+    written, or None if it has none or node is anything else."""
+    if not isinstance(node, (ast.FunctionDef, ast.ClassDef, ast.Module)):
+        return None
+    doc = ast.get_docstring(node, clean=False)
+    if isinstance(doc, unicode):
+        doc = doc.encode('utf-8')
+    return doc
+
+
+class SymbolExtractor(ast.NodeVisitor):
+    """Extracts Symbols from a module using the stdlib ast module.
+
+    It is far cheaper than building an astroid tree, at the price of
+    only ever displaying the first source line of a symbol."""
+
+    def __init__(self, filename, source, modname):
+        self.filename = filename
+        self.lines = source.splitlines()
+        self.scopes = [modname]
+        self.classes = [None]
+        self.symbols = []
+
+    def add(self, kind, name, node, argcount=None, bases=None):
+        self.symbols.append(Symbol(kind, name, self.filename, node.lineno,
+                                   node.col_offset, self.scopes[-1],
+                                   self.classes[-1], argcount, bases,
+                                   symbol_text(kind, node.lineno, self.lines),
+                                   _docstring(node), _end_lineno(node)))
+
+    def visit_Module(self, node):
+        # Modules have no position of their own; they start at the
+        # top of the file.
+        self.symbols.append(Symbol('mod', self.scopes[0], self.filename, 1, 0,
+                                   None, None, None, None,
+                                   symbol_text('mod', 1, self.lines), _docstring(node),
+                                   max(len(self.lines), 1)))
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        args = node.args
+        argcount = len(args.args) + bool(args.vararg) + bool(args.kwarg)
+        self.add('fn', node.name, node, argcount=argcount)
+        self.scopes.append(node.name)
+        self.generic_visit(node)
+        self.scopes.pop()
+
+    def visit_ClassDef(self, node):
+        bases = tuple(_immediate_name(base) for base in node.bases)
+        self.add('cls', node.name, node, bases=bases)
+        self.scopes.append(node.name)
+        self.classes.append(node.name)
+        self.generic_visit(node)
+        self.classes.pop()
+        self.scopes.pop()
+
+    def visit_Name(self, node):
+        # Function arguments are Param, not Store, so they are left
+        # out just like Indexer.find_variable_by_name does.
+        if isinstance(node.ctx, ast.Store):
+            self.add('var', node.id, node)
+        elif isinstance(node.ctx, ast.Load) and node.id not in CONSTANT_NAMES:
+            self.add('ref', node.id, node)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.add('import', alias.name, node)
+
+    def visit_ImportFrom(self, node):
+        module = '.' * (node.level or 0) + (node.module or '')
+        if module and not module.endswith('.'):
+            module += '.'
+        for alias in node.names:
+            self.add('import', module + alias.name, node)
+
+    def visit_Call(self, node):
+        self.add('call', _immediate_name(node.func), node)
+        self.generic_visit(node)
+
+
+def extract_symbols(filename, source=None):
+    """Returns a list of every Symbol in filename.
+
+    If source is given it is used instead of reading filename. Raises
+    SyntaxError if the source cannot be parsed."""
+    if source is None:
+        with open(filename) as f:
+            source = f.read()
+    modname = os.path.splitext(os.path.basename(filename))[0]
+    extractor = SymbolExtractor(os.path.abspath(filename), source, modname)
+    extractor.visit(ast.parse(source, filename))
+    return extractor.symbols
+
+
+def match_attr(attr):
+    """Returns a matcher that compares the attribute attr of a
+    symbol. The attribute is kept on the matcher as attr, so an index
+    can tell which attribute an assertion is about."""
+    def matcher(symbol, comparator, expected_attr_value):
+        return comparator(getattr(symbol, attr), expected_attr_value)
+    matcher.attr = attr
+    matcher.__name__ = 'match_' + attr
+    return matcher
+
+
+def match_bases(symbol, comparator, expected_attr_value):
+    """Matches if every base of a class matches, like
+    Indexer.find_class_by_parent."""
+    bases = [comparator(base, expected_attr_value) for base in symbol.bases or ()]
+    return bool(bases) and all(bases)
+
+
+SYMBOL_MAPS = {
+    # <Node type>, <Equiv Attr on Node Class>: <Symbol kind>, <matcher>
+    ('fn', 'name'): ('fn', match_attr('name')),
+    ('fn', 'argcount'): ('fn', match_attr('argcount')),
+    ('fn', 'parent'): ('fn', match_attr('parent')),
+    ('fn', 'call'): ('call', match_attr('name')),
+    ('cls', 'name'): ('cls', match_attr('name')),
+    ('cls', 'parent'): ('cls', match_bases),
+    ('cls', 'method'): ('fn', match_attr('parent')),
+    ('var', 'name'): ('var', match_attr('name')),
+    ('var', 'ref'): ('ref', match_attr('name')),
+    }
@@ -0,0 +1,564 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import copy
+import mmap
+import struct
+import logging
+import binascii
+
+from sona.symbols import Symbol
+from sona.trigram import trigrams
+from sona.fuzzy import BKTree, edit_distance, search_flat
+from sona.words import words
+from sona.extents import nest_extents, find_enclosing
+from sona.exceptions import InvalidIndexError
+
+log = logging.getLogger(__name__)
+
+
+class TableSymbol(Symbol):
+    """A Symbol read from a SymbolTable. number is its number in the
+    table, which sona.bitmap.SymbolIds uses as its id; it is None once
+    the symbol has been pickled. A TableSymbol is equal to the Symbol
+    it was written from."""
+
+    number = None
+
+# A symbol table is a single file made up of a header followed by
+# these sections, each an array of fixed-width records or strings:
+#
+#  string offsets  uint32 offset of every string, plus the end
+#  string data     every string, sorted, so ids follow their order
+#  files           path id, SHA-1 digest, first symbol, symbol count,
+#                  first extent, extent count
+#  symbols         one SYMBOL_RECORD per symbol, grouped by file
+#  names           kind, name id, first posting, posting count,
+#                  sorted by kind and then name
+#  postings        uint32 symbol number, in the order of names
+#  trigrams        trigram, first posting, posting count, sorted
+#  trigram postings
+#                  uint32 string id of every name with that trigram
+#  name tree       name id, first edge, edge count of every node of a
+#                  BK-tree of the names, the root first
+#  name tree edges edit distance, node number
+#  words           word id, first posting, posting count of every word
+#                  of a docstring, sorted by word id
+#  word postings   uint32 number of every symbol whose docstring has
+#                  that word
+#  extents         lineno, col_offset, end_lineno, symbol number and
+#                  enclosing extent of every function, class and
+#                  module, grouped by file and sorted by where they
+#                  start (see sona.extents)
+#
+# Strings are interned: every name, path and scope is stored once
+# and referred to by its id everywhere else.
+MAGIC = 'SONA'
+TABLE_VERSION = 6
+
+HEADER = struct.Struct('<4sIIIIIIIIIIII')
+FILE_RECORD = struct.Struct('<I20sIIII')
+SYMBOL_RECORD = struct.Struct('<B3xIIIiIIIiIi')
+NAME_RECORD = struct.Struct('<B3xIII')
+TRIGRAM_RECORD = struct.Struct('<3sxII')
+BK_NODE_RECORD = struct.Struct('<III')
+BK_EDGE_RECORD = struct.Struct('<II')
+WORD_RECORD = struct.Struct('<III')
+EXTENT_RECORD = struct.Struct('<IiiII')
+UINT32 = struct.Struct('<I')
+
+# Stands in for a missing string, such as the class of a symbol that
+# is not in one.
+NO_STRING = 0xffffffff
+
+# Every kind of Symbol, by the number it is stored as.
+KINDS = ('fn', 'cls', 'var', 'ref', 'call', 'import', 'mod')
+KIND_NUMBERS = dict((kind, number) for number, kind in enumerate(KINDS))
+
+# Ends each of the bases of a class, which are stored as one string.
+BASES_SEPARATOR = ','
+
+
+def _join_bases(bases):
+    if bases is None:
+        return None
+    return ''.join(base + BASES_SEPARATOR for base in bases)
+
+
+def _sections(n_strings, n_files, n_symbols, n_names, n_trigrams,
+              n_trigram_postings, n_tree_nodes, n_words, n_word_postings, n_extents,
+              strings_size):
+    """Returns the offset of every section, and of the end of the
+    table, given the number of records in each and the size of the
+    string data."""
+    offsets = []
+    offset = HEADER.size
+    for size in ((n_strings + 1) * UINT32.size, strings_size,
+                 n_files * FILE_RECORD.size, n_symbols * SYMBOL_RECORD.size,
+                 n_names * NAME_RECORD.size, n_symbols * UINT32.size,
+                 n_trigrams * TRIGRAM_RECORD.size, n_trigram_postings * UINT32.size,
+                 n_tree_nodes * BK_NODE_RECORD.size,
+                 max(n_tree_nodes - 1, 0) * BK_EDGE_RECORD.size,
+                 n_words * WORD_RECORD.size, n_word_postings * UINT32.size,
+                 n_extents * EXTENT_RECORD.size):
+        offsets.append(offset)
+        offset += size
+    offsets.append(offset)
+    return offsets
+
+
+def write_symbol_table(path, files, generation=0):
+    """Writes a symbol table of files, an iterable of (filename,
+    digest, symbols) tuples where digest is a hex SHA-1, to path.
+
+    The table is written to a temporary file first, so that a table
+    being read is never overwritten."""
+    files = sorted(files)
+    strings = set()
+    for filename, digest, symbols in files:
+        strings.add(filename)
+        for symbol in symbols:
+            strings.update((symbol.name, symbol.parent or '', symbol.cls or '',
+                            _join_bases(symbol.bases) or '', symbol.doc or ''))
+            if symbol.doc:
+                strings.update(words(symbol.doc))
+    strings = sorted(strings)
+    ids = dict((string, number) for number, string in enumerate(strings))
+
+    def string_id(string):
+        return NO_STRING if string is None else ids[string]
+
+    string_offsets = []
+    offset = 0
+    for string in strings:
+        string_offsets.append(offset)
+        offset += len(string)
+    string_offsets.append(offset)
+
+    file_records = []
+    symbol_records = []
+    extent_records = []
+    postings = {}
+    word_postings = {}
+    for filename, digest, symbols in files:
+        first_symbol = len(symbol_records)
+        extents = nest_extents(symbols)
+        file_records.append(FILE_RECORD.pack(ids[filename], binascii.unhexlify(digest),
+                                             first_symbol, len(symbols),
+                                             len(extent_records), len(extents)))
+        numbers = dict((id(symbol), first_symbol + number)
+                       for number, symbol in enumerate(symbols))
+        for symbol, parent in extents:
+            extent_records.append(EXTENT_RECORD.pack(
+                symbol.lineno, symbol.col_offset, symbol.end_lineno, numbers[id(symbol)],
+                parent))
+        for symbol in symbols:
+            kind = KIND_NUMBERS[symbol.kind]
+            postings.setdefault((kind, ids[symbol.name]), []).append(len(symbol_records))
+            if symbol.doc:
+                for word in words(symbol.doc):
+                    word_postings.setdefault(ids[word], []).append(len(symbol_records))
+            symbol_records.append(SYMBOL_RECORD.pack(
+                kind, ids[symbol.name], ids[filename], symbol.lineno, symbol.col_offset,
+                string_id(symbol.parent), string_id(symbol.cls),
+                string_id(_join_bases(symbol.bases)),
+                -1 if symbol.argcount is None else symbol.argcount,
+                string_id(symbol.doc),
+                -1 if symbol.end_lineno is None else symbol.end_lineno))
+
+    name_records = []
+    posting_records = []
+    for kind, name in sorted(postings):
+        numbers = postings[(kind, name)]
+        name_records.append(NAME_RECORD.pack(kind, name, len(posting_records), len(numbers)))
+        posting_records.extend(UINT32.pack(number) for number in numbers)
+
+    grams = {}
+    for name in sorted(set(name for _, name in postings)):
+        for gram in trigrams(strings[name]):
+            grams.setdefault(gram, []).append(name)
+    trigram_records = []
+    trigram_postings = []
+    for gram in sorted(grams):
+        trigram_records.append(TRIGRAM_RECORD.pack(gram, len(trigram_postings),
+                                                   len(grams[gram])))
+        trigram_postings.extend(UINT32.pack(name) for name in grams[gram])
+
+    tree = BKTree()
+    for name in sorted(set(name for _, name in postings)):
+        tree.add(strings[name])
+    tree_nodes, tree_edges = tree.flatten()
+
+    word_records = []
+    word_posting_records = []
+    for word in sorted(word_postings):
+        numbers = word_postings[word]
+        word_records.append(WORD_RECORD.pack(word, len(word_posting_records), len(numbers)))
+        word_posting_records.extend(UINT32.pack(number) for number in numbers)
+
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, TABLE_VERSION, generation, len(strings),
+                            len(file_records), len(symbol_records), len(name_records),
+                            len(trigram_records), len(trigram_postings), len(tree_nodes),
+                            len(word_records), len(word_posting_records),
+                            len(extent_records)))
+        f.write(''.join(UINT32.pack(offset) for offset in string_offsets))
+        f.write(''.join(strings))
+        f.write(''.join(file_records))
+        f.write(''.join(symbol_records))
+        f.write(''.join(name_records))
+        f.write(''.join(posting_records))
+        f.write(''.join(trigram_records))
+        f.write(''.join(trigram_postings))
+        f.write(''.join(BK_NODE_RECORD.pack(ids[name], first, count)
+                        for name, first, count in tree_nodes))
+        f.write(''.join(BK_EDGE_RECORD.pack(*edge) for edge in tree_edges))
+        f.write(''.join(word_records))
+        f.write(''.join(word_posting_records))
+        f.write(''.join(extent_records))
+    os.rename(tmp_path, path)
+
+
+class SymbolTable(object):
+    """A read-only symbol table written by write_symbol_table.
+
+    The table is memory-mapped, so opening it costs the same no matter
+    how large it is; every lookup reads straight from the mapping and
+    only decodes the records it returns. Symbols read from a table
+    have no text, and are displayed from the source instead.
+
+    Raises InvalidIndexError if path is not a symbol table of the
+    current version."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error), err:
+                raise InvalidIndexError('Cannot map {0}: {1}'.format(path, err))
+        if len(self._map) < HEADER.size:
+            raise InvalidIndexError('{0} is not a symbol table'.format(path))
+        (magic, version, self.generation, self.n_strings, self.n_files,
+         self.n_symbols, self.n_names, self.n_trigrams,
+         self.n_trigram_postings, self.n_tree_nodes, self.n_words,
+         self.n_word_postings, self.n_extents) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise InvalidIndexError('{0} is not a symbol table'.format(path))
+        if version != TABLE_VERSION:
+            raise InvalidIndexError('{0} has version {1}, not {2}'.format(
+                path, version, TABLE_VERSION))
+        strings_size = UINT32.unpack_from(
+            self._map, HEADER.size + self.n_strings * UINT32.size)[0]
+        (self._string_offsets, self._strings, self._files, self._symbols,
+         self._names, self._postings, self._trigrams, self._trigram_postings,
+         self._tree_nodes, self._tree_edges, self._words, self._word_postings,
+         self._extents, end) = _sections(
+            self.n_strings, self.n_files, self.n_symbols, self.n_names,
+            self.n_trigrams, self.n_trigram_postings, self.n_tree_nodes,
+            self.n_words, self.n_word_postings, self.n_extents, strings_size)
+        if len(self._map) != end:
+            raise InvalidIndexError('{0} is truncated'.format(path))
+        # The symbols numbered first_symbol up to last_symbol are the
+        # only ones the table returns (see segment).
+        self.first_symbol = 0
+        self.last_symbol = self.n_symbols
+
+    def close(self):
+        self._map.close()
+
+    def segment(self, start, stop):
+        """Returns a view of the table that only returns the symbols
+        numbered start up to, but not including, stop, so that a query
+        can be split among processes by ranges of symbols. The view
+        shares the table's mapping: closing either closes both."""
+        view = copy.copy(self)
+        view.first_symbol = max(start, 0)
+        view.last_symbol = min(stop, self.n_symbols)
+        return view
+
+    def _in_segment(self, number):
+        return self.first_symbol <= number < self.last_symbol
+
+    def file_start(self, number):
+        """Returns the number of the first symbol of the file the
+        symbol numbered number is in. Symbols are numbered file by
+        file, so the files' first symbols are in order."""
+        low, high = 0, self.n_files
+        while low < high:
+            middle = (low + high) // 2
+            if self._file(middle)[2] <= number:
+                low = middle + 1
+            else:
+                high = middle
+        return self._file(low - 1)[2] if low else 0
+
+    def string(self, number):
+        """Returns the string with id number, or None for NO_STRING."""
+        if number == NO_STRING:
+            return None
+        start, end = struct.unpack_from('<II', self._map,
+                                        self._string_offsets + number * UINT32.size)
+        return self._map[self._strings + start:self._strings + end]
+
+    def find_string(self, string):
+        """Returns the id of string, or None if it is not in the
+        table."""
+        low, high = 0, self.n_strings
+        while low < high:
+            middle = (low + high) // 2
+            if self.string(middle) < string:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_strings and self.string(low) == string:
+            return low
+        return None
+
+    def _file(self, number):
+        return FILE_RECORD.unpack_from(self._map, self._files + number * FILE_RECORD.size)
+
+    def _find_file(self, filename):
+        """Returns the number of the file filename, or None. Files are
+        sorted by path, and so by path id."""
+        path_id = self.find_string(filename)
+        if path_id is None:
+            return None
+        low, high = 0, self.n_files
+        while low < high:
+            middle = (low + high) // 2
+            if self._file(middle)[0] < path_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_files and self._file(low)[0] == path_id:
+            return low
+        return None
+
+    def filenames(self):
+        """Returns the path of every file in the table."""
+        return [self.string(self._file(number)[0]) for number in xrange(self.n_files)]
+
+    def digest(self, filename):
+        """Returns the hex digest of filename, or None if it is not in
+        the table."""
+        number = self._find_file(filename)
+        if number is None:
+            return None
+        return binascii.hexlify(self._file(number)[1])
+
+    def symbol(self, number):
+        """Returns the Symbol numbered number."""
+        (kind, name, filename, lineno, col_offset, parent, cls, bases,
+         argcount, doc, end_lineno) = SYMBOL_RECORD.unpack_from(
+            self._map, self._symbols + number * SYMBOL_RECORD.size)
+        bases = self.string(bases)
+        if bases is not None:
+            bases = tuple(bases.split(BASES_SEPARATOR)[:-1])
+        symbol = TableSymbol(KINDS[kind], self.string(name), self.string(filename), lineno,
+                             col_offset, self.string(parent), self.string(cls),
+                             None if argcount < 0 else argcount, bases, None,
+                             self.string(doc), None if end_lineno < 0 else end_lineno)
+        symbol.number = number
+        return symbol
+
+    def file_symbols(self, filename, kind=None):
+        """Returns the Symbols of filename, only those of kind if it is
+        given."""
+        number = self._find_file(filename)
+        if number is None:
+            return []
+        _, _, first, count, _, _ = self._file(number)
+        symbols = []
+        for symbol_number in xrange(max(first, self.first_symbol),
+                                    min(first + count, self.last_symbol)):
+            if kind is not None:
+                offset = self._symbols + symbol_number * SYMBOL_RECORD.size
+                if KINDS[ord(self._map[offset])] != kind:
+                    continue
+            symbols.append(self.symbol(symbol_number))
+        return symbols
+
+    def _name(self, number):
+        return NAME_RECORD.unpack_from(self._map, self._names + number * NAME_RECORD.size)
+
+    def _bisect_names(self, key):
+        """Returns the number of the first name whose (kind, name id)
+        is not less than key."""
+        low, high = 0, self.n_names
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(middle)[:2] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _posted_symbols(self, first, last):
+        """Returns the Symbols posted under the names numbered first up
+        to, but not including, last."""
+        if first >= last:
+            return []
+        start = self._name(first)[2]
+        end = self._name(last - 1)[2] + self._name(last - 1)[3]
+        numbers = (UINT32.unpack_from(self._map, self._postings + number * UINT32.size)[0]
+                   for number in xrange(start, end))
+        return [self.symbol(number) for number in numbers if self._in_segment(number)]
+
+    def lookup(self, kind, name):
+        """Returns every Symbol of kind named name."""
+        name_id = self.find_string(name) if isinstance(name, basestring) else None
+        if kind not in KIND_NUMBERS or name_id is None:
+            return []
+        first = self._bisect_names((KIND_NUMBERS[kind], name_id))
+        if first < self.n_names and self._name(first)[:2] == (KIND_NUMBERS[kind], name_id):
+            return self._posted_symbols(first, first + 1)
+        return []
+
+    def kind_symbols(self, kind):
+        """Returns every Symbol of kind. Names are sorted by kind, so
+        their postings are all next to each other."""
+        if kind not in KIND_NUMBERS:
+            return []
+        number = KIND_NUMBERS[kind]
+        return self._posted_symbols(self._bisect_names((number, 0)),
+                                    self._bisect_names((number + 1, 0)))
+
+    def _trigram(self, number):
+        return TRIGRAM_RECORD.unpack_from(self._map,
+                                          self._trigrams + number * TRIGRAM_RECORD.size)
+
+    def _trigram_names(self, gram):
+        """Returns the set of ids of the names that contain gram."""
+        low, high = 0, self.n_trigrams
+        while low < high:
+            middle = (low + high) // 2
+            if self._trigram(middle)[0] < gram:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.n_trigrams or self._trigram(low)[0] != gram:
+            return set()
+        _, first, count = self._trigram(low)
+        return set(UINT32.unpack_from(self._map, self._trigram_postings + number * UINT32.size)[0]
+                   for number in xrange(first, first + count))
+
+    def search(self, kind, predicate, required=()):
+        """Returns every Symbol of kind whose name predicate is True of.
+
+        Only the names that contain every trigram in required are
+        checked, found by intersecting the trigrams' postings; if there
+        are none, every name of kind is."""
+        if kind not in KIND_NUMBERS:
+            return []
+        number = KIND_NUMBERS[kind]
+        first = self._bisect_names((number, 0))
+        last = self._bisect_names((number + 1, 0))
+        if not required:
+            candidates = (self._name(name)[1] for name in xrange(first, last))
+        else:
+            candidates = None
+            for gram in sorted(required):
+                names = self._trigram_names(gram)
+                candidates = names if candidates is None else candidates & names
+                if not candidates:
+                    return []
+            candidates = sorted(candidates)
+        symbols = []
+        for name_id in candidates:
+            if not predicate(self.string(name_id)):
+                continue
+            name = self._bisect_names((number, name_id))
+            if name < last and self._name(name)[1] == name_id:
+                symbols.extend(self._posted_symbols(name, name + 1))
+        return symbols
+
+    def _tree_node(self, number):
+        return BK_NODE_RECORD.unpack_from(self._map,
+                                          self._tree_nodes + number * BK_NODE_RECORD.size)
+
+    def _tree_node_edges(self, number):
+        _, first, count = self._tree_node(number)
+        return [BK_EDGE_RECORD.unpack_from(self._map,
+                                           self._tree_edges + edge * BK_EDGE_RECORD.size)
+                for edge in xrange(first, first + count)]
+
+    def closest(self, kind, value, radius):
+        """Returns every Symbol of kind whose name is at most radius
+        edits away from value.
+
+        The names are looked up in the table's BK-tree of names, which
+        only measures the distance to the names under the edges that
+        can lead to a match, rather than to every name."""
+        if kind not in KIND_NUMBERS or not self.n_tree_nodes:
+            return []
+        number = KIND_NUMBERS[kind]
+        last = self._bisect_names((number + 1, 0))
+
+        def distance_of(node):
+            return edit_distance(value, self.string(self._tree_node(node)[0]))
+
+        symbols = []
+        for _, node in search_flat(value, radius, 0, distance_of, self._tree_node_edges):
+            name_id = self._tree_node(node)[0]
+            name = self._bisect_names((number, name_id))
+            if name < last and self._name(name)[1] == name_id:
+                symbols.extend(self._posted_symbols(name, name + 1))
+        return symbols
+
+    def _word_symbols(self, word):
+        """Returns the set of numbers of the symbols whose docstring has
+        the word word."""
+        word_id = self.find_string(word)
+        if word_id is None:
+            return set()
+        low, high = 0, self.n_words
+        while low < high:
+            middle = (low + high) // 2
+            if WORD_RECORD.unpack_from(self._map, self._words + middle * WORD_RECORD.size)[0] \
+                    < word_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.n_words:
+            return set()
+        found, first, count = WORD_RECORD.unpack_from(self._map,
+                                                      self._words + low * WORD_RECORD.size)
+        if found != word_id:
+            return set()
+        return set(UINT32.unpack_from(self._map, self._word_postings + number * UINT32.size)[0]
+                   for number in xrange(first, first + count))
+
+    def documented(self, required):
+        """Returns every Symbol whose docstring has every word in
+        required, a non-empty set of lowercase words, found by
+        intersecting the words' postings."""
+        numbers = None
+        for word in sorted(required):
+            found = self._word_symbols(word)
+            numbers = found if numbers is None else numbers & found
+            if not numbers:
+                return []
+        return [self.symbol(number) for number in sorted(numbers) if self._in_segment(number)]
+
+    def enclosing(self, filename, lineno, col_offset=None):
+        """Returns the Symbols of the functions, classes and module of
+        filename that enclose lineno, and col_offset if it is given,
+        the outermost first. Only the records of the extents on the
+        way are read."""
+        number = self._find_file(filename)
+        if number is None:
+            return []
+        _, _, _, _, first, count = self._file(number)
+
+        def extent(number):
+            lineno, col_offset, end_lineno, _, parent = EXTENT_RECORD.unpack_from(
+                self._map, self._extents + (first + number) * EXTENT_RECORD.size)
+            return lineno, col_offset, end_lineno, parent
+
+        numbers = [EXTENT_RECORD.unpack_from(
+            self._map, self._extents + (first + number) * EXTENT_RECORD.size)[3]
+            for number in find_enclosing(count, extent, lineno, col_offset)]
+        return [self.symbol(number) for number in numbers if self._in_segment(number)]
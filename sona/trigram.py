@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import re
+import logging
+import sre_parse
+import sre_constants
+
+log = logging.getLogger(__name__)
+
+# Conditionals that match part of a name, and so can be narrowed down
+# with trigrams rather than answered with a lookup of the whole name.
+PATTERN_CONDITIONALS = ('=~', 'contains')
+
+
+def trigrams(string):
+    """Returns the set of every three character substring of
+    string."""
+    return set(string[i:i + 3] for i in xrange(len(string) - 2))
+
+
+def _literal_runs(pattern, runs, run):
+    """Adds the literal runs of the parsed regular expression pattern
+    to runs, continuing run, and returns the run that is still open
+    at its end. Anything that is not a literal, or a group of them,
+    ends the current run."""
+    for op, argument in pattern:
+        if op == sre_constants.LITERAL and argument < 128:
+            run.append(chr(argument))
+        elif op == sre_constants.SUBPATTERN and \
+                not any(sub_op == sre_constants.BRANCH for sub_op, _ in argument[1]):
+            run = _literal_runs(argument[1], runs, run)
+        else:
+            runs.append(''.join(run))
+            run = []
+    return run
+
+
+def required_literals(pattern):
+    """Returns the list of strings every name that matches the regular
+    expression pattern has to contain. It is empty if nothing can be
+    said about them, like for an alternation or a case-insensitive
+    pattern."""
+    parsed = sre_parse.parse(pattern)
+    if parsed.pattern.flags & sre_constants.SRE_FLAG_IGNORECASE:
+        return []
+    if any(op == sre_constants.BRANCH for op, _ in parsed):
+        return []
+    runs = []
+    runs.append(''.join(_literal_runs(parsed, runs, [])))
+    return [run for run in runs if run]
+
+
+def query_trigrams(conditional, value):
+    """Returns the set of trigrams every name that satisfies
+    conditional value has to contain; an empty set means every name
+    has to be checked."""
+    if conditional == 'contains':
+        literals = [value]
+    else:
+        literals = required_literals(value)
+    required = set()
+    for literal in literals:
+        required.update(trigrams(literal))
+    return required
+
+
+def name_predicate(conditional, value):
+    """Returns a function that is True of the names that satisfy
+    conditional value, one of PATTERN_CONDITIONALS."""
+    if conditional == 'contains':
+        return lambda name: value in name
+    regex = re.compile(value)
+    return lambda name: regex.search(name) is not None
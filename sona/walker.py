@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import glob
+import logging
+import fnmatch
+import threading
+import Queue
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+log = logging.getLogger(__name__)
+
+# Directory names that are never descended into, unless they are
+# given explicitly. They are matched with fnmatch.
+DEFAULT_EXCLUDES = (
+    '.git', '.hg', '.svn', '.bzr',
+    '.tox', '.nox', '.venv', 'venv', 'virtualenv',
+    'node_modules', '__pycache__', 'build', 'dist', '*.egg-info',
+    '.sona',
+    )
+
+# A directory containing this file is a virtualenv (PEP 405), no
+# matter what it is called.
+VIRTUALENV_MARKER = 'pyvenv.cfg'
+
+# Number of threads walking the directory tree. Most of the time is
+# spent waiting on the filesystem, so threads work well here.
+DEFAULT_WORKERS = 8
+
+
+def _scan(path):
+    """Returns (files, directories) for the entries in path."""
+    files, directories = [], []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.name)
+            elif entry.is_file():
+                files.append(entry.name)
+    else:
+        for name in os.listdir(path):
+            fullpath = os.path.join(path, name)
+            if os.path.isdir(fullpath) and not os.path.islink(fullpath):
+                directories.append(name)
+            elif os.path.isfile(fullpath):
+                files.append(name)
+    return files, directories
+
+
+class DirectoryWalker(object):
+    """Walks directory trees in parallel, yielding every file that
+    matches pattern in the same order on every run.
+
+    Directories whose names match any of the fnmatch patterns in
+    excludes are skipped, as are virtualenvs if skip_virtualenvs is
+    True. Directories given explicitly to walk() are always walked."""
+
+    def __init__(self, pattern='*.py', excludes=DEFAULT_EXCLUDES,
+                 skip_virtualenvs=True, workers=DEFAULT_WORKERS):
+        self.pattern = pattern
+        self.excludes = tuple(excludes)
+        self.skip_virtualenvs = skip_virtualenvs
+        self.workers = workers
+
+    def is_excluded(self, name):
+        """Returns True if the directory name should not be walked."""
+        for exclude in self.excludes:
+            if fnmatch.fnmatch(name, exclude):
+                return True
+        return False
+
+    def _worker(self, directories, scanned, state):
+        while True:
+            item = directories.get()
+            if item is None:
+                return
+            path, explicit = item
+            files, subdirectories = [], []
+            if not state['stopped']:
+                try:
+                    files, subdirectories = _scan(path)
+                except OSError, err:
+                    log.warning('Cannot read directory %s: %s', path, err)
+            if self.skip_virtualenvs and not explicit and VIRTUALENV_MARKER in files:
+                log.debug('Skipping virtualenv %s', path)
+                files, subdirectories = [], []
+            files = [os.path.join(path, name) for name in sorted(files)
+                     if fnmatch.fnmatch(name, self.pattern)]
+            walked = []
+            for name in sorted(subdirectories):
+                if self.is_excluded(name):
+                    log.debug('Skipping excluded directory %s', os.path.join(path, name))
+                    continue
+                subdirectory = os.path.join(path, name)
+                with state['lock']:
+                    if os.path.abspath(subdirectory) in state['queued']:
+                        # Also a root, walked as such.
+                        continue
+                    state['queued'].add(os.path.abspath(subdirectory))
+                walked.append(subdirectory)
+                directories.put((subdirectory, False))
+            with state['lock']:
+                scanned[path] = (files, walked)
+                state['lock'].notify_all()
+
+    def walk(self, *roots):
+        """Yields every matching file under the directories roots.
+
+        Directories are read by several threads at once, ahead of the
+        files being yielded, but the files are yielded in the same
+        order on every run: depth first, each directory's files
+        before its subdirectories, both sorted by name.
+
+        Every directory is walked once, however many roots it is
+        under: a root that is also under another root is walked as a
+        root, in its turn, and left out of the walk of the other."""
+        if not roots:
+            return
+        directories = Queue.Queue()
+        # The (files, subdirectories) of every directory read but not
+        # yet yielded, by path.
+        scanned = {}
+        # The absolute path of every directory queued to be walked.
+        state = {'lock': threading.Condition(), 'stopped': False, 'queued': set()}
+        distinct = []
+        for root in roots:
+            if os.path.abspath(root) not in state['queued']:
+                state['queued'].add(os.path.abspath(root))
+                distinct.append(root)
+                directories.put((root, True))
+        roots = distinct
+        threads = [threading.Thread(target=self._worker,
+                                    args=(directories, scanned, state))
+                   for _ in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            stack = list(reversed(roots))
+            while stack:
+                path = stack.pop()
+                with state['lock']:
+                    while path not in scanned:
+                        state['lock'].wait()
+                    files, subdirectories = scanned.pop(path)
+                for filename in files:
+                    yield filename
+                stack.extend(reversed(subdirectories))
+        finally:
+            # If the consumer gave up early, drain the remaining
+            # directories without reading them.
+            state['stopped'] = True
+            for thread in threads:
+                directories.put(None)
+
+    def iter_files(self, paths):
+        """Yields every file to search given a list of paths, which
+        may be files, directories or glob patterns.
+
+        Files named explicitly are always yielded, whether they match
+        pattern or not; directories are walked. No file is yielded
+        twice, even if paths name it more than once."""
+        roots = []
+        yielded = set()
+        for path in paths:
+            if os.path.isdir(path):
+                roots.append(path)
+            elif os.path.isfile(path):
+                if os.path.abspath(path) not in yielded:
+                    yielded.add(os.path.abspath(path))
+                    yield path
+            else:
+                matches = sorted(glob.glob(path))
+                if not matches:
+                    log.warning('No such file or directory: %s', path)
+                for match in matches:
+                    if os.path.isdir(match):
+                        roots.append(match)
+                    elif fnmatch.fnmatch(os.path.basename(match), self.pattern) \
+                            and os.path.abspath(match) not in yielded:
+                        yielded.add(os.path.abspath(match))
+                        yield match
+        for filename in self.walk(*roots):
+            if os.path.abspath(filename) not in yielded:
+                yield filename
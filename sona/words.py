@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import re
+import logging
+
+log = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+')
+
+
+def words(text):
+    """Returns the set of words in text, lowercased. A word is a run of
+    letters, digits and underscores, so identifiers are kept whole."""
+    return set(word.lower() for word in WORD_RE.findall(text))
+
+
+class DocText(str):
+    """A docstring, as compared by the doc:text locator.
+
+    It is the docstring itself for every comparator but 'contains',
+    which tests for words rather than a substring: a DocText contains
+    a string if it has every word of it, in any order and case."""
+
+    def __contains__(self, value):
+        if not isinstance(value, basestring):
+            return False
+        return words(value) <= words(self)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import shutil
+import logging
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.bitmap import SymbolIds, to_bitmap, iter_bits, combine
+from sona.symbols import extract_symbols
+from sona.symtable import SymbolTable, write_symbol_table
+
+
+log = logging.getLogger(__name__)
+
+
+class BitmapTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for numbers in [[], [0], [7, 8], [3, 64, 65, 1000]]:
+            bitmap = to_bitmap(numbers, 1001)
+            self.assertEqual(list(iter_bits(bitmap)), numbers)
+        self.assertEqual(to_bitmap([0, 2], 3), 5)
+
+    def test_combine(self):
+        a, b = to_bitmap([1, 2, 3], 4), to_bitmap([2, 3], 4)
+        self.assertEqual(list(iter_bits(combine(a, 'union', b))), [1, 2, 3])
+        self.assertEqual(list(iter_bits(combine(a, 'intersect', b))), [2, 3])
+        self.assertEqual(list(iter_bits(combine(a, 'except', b))), [1])
+        with self.assertRaises(ValueError):
+            combine(a, 'xor', b)
+
+    def test_symbol_ids(self):
+        ids = SymbolIds()
+        first = ids.bitmap(['a', 'b'])
+        second = ids.bitmap(['c', 'a'])
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(ids.symbols_of(combine(first, 'union', second)), ['a', 'b', 'c'])
+        self.assertEqual(ids.symbols_of(combine(first, 'except', second)), ['b'])
+        self.assertEqual(ids.symbols_of(0), [])
+
+    def test_table_ids(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'symbols.idx')
+            write_symbol_table(path, [('/src/mod.py', '0' * 40, extract_symbols(
+                '/src/mod.py', 'def get():\n    pass\n\ndef put():\n    pass\n'))], 0)
+            table = SymbolTable(path)
+            ids = SymbolIds(table)
+            get, put = table.lookup('fn', 'get') + table.lookup('fn', 'put')
+            # The symbols of the table are never hashed.
+            self.assertEqual(ids.bitmap([put]), 1 << put.number)
+            self.assertEqual(ids.ids, {})
+            other = extract_symbols('/src/new.py', 'def get():\n    pass\n')[-1]
+            bitmap = combine(ids.bitmap([get, put]), 'except', ids.bitmap([put, other]))
+            self.assertEqual(ids.symbols_of(bitmap), [get])
+            self.assertEqual(ids.symbols_of(ids.bitmap([other])), [other])
+            self.assertEqual(len(ids), table.n_symbols + 1)
+            table.close()
+        finally:
+            shutil.rmtree(tmpdir)
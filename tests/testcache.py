@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import shutil
+import logging
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.cache import ResultCache, normalize_query
+from sona.search import SemanticSearcher
+from sona.symbols import Symbol
+from sona.parser import AssertionParser
+
+
+log = logging.getLogger(__name__)
+
+
+SOURCES = [
+    ('module1.py', 'def fn1(a, b):\n    return fn2(a)\n'),
+    ('module2.py', 'def fn2(a):\n    return a\n\ndef fn3(a, b):\n    pass\n'),
+    ]
+
+
+class CountingSearcher(SemanticSearcher):
+
+    searched = []
+
+    @staticmethod
+    def _search_file(filename, trees, budget=None, plan=None, source=None):
+        CountingSearcher.searched.append(os.path.basename(filename))
+        return SemanticSearcher._search_file(filename, trees, budget, plan, source)
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filenames = []
+        for name, source in SOURCES:
+            filename = os.path.join(self.tmpdir, name)
+            with open(filename, 'w') as f:
+                f.write(source)
+            self.filenames.append(filename)
+        self.cache_dir = os.path.join(self.tmpdir, '.sona')
+        CountingSearcher.searched = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def search(self, query, cache):
+        ss = CountingSearcher(result_cache=cache)
+        ss.add_files(self.filenames)
+        return [(os.path.basename(result.filename if isinstance(result, Symbol)
+                                  else result.root().file), result.lineno)
+                for result in ss.search(query)]
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query(AssertionParser('fn:name=="a";cls:name').tree),
+                         normalize_query(AssertionParser("fn:name == 'a' ; cls:name").tree))
+
+    def test_repeat(self):
+        cache = ResultCache()
+        expected = [('module1.py', 1), ('module2.py', 4)]
+        self.assertEqual(self.search('fn:argcount == 2', cache), expected)
+        self.assertEqual(CountingSearcher.searched, ['module1.py', 'module2.py'])
+        CountingSearcher.searched = []
+        self.assertEqual(self.search('fn:argcount==2', cache), expected)
+        self.assertEqual(CountingSearcher.searched, [])
+
+    def test_changed_file(self):
+        cache = ResultCache()
+        self.search('fn:argcount == 2', cache)
+        CountingSearcher.searched = []
+        with open(self.filenames[1], 'a') as f:
+            f.write('\ndef fn4(a, b):\n    pass\n')
+        self.assertEqual(self.search('fn:argcount == 2', cache),
+                         [('module1.py', 1), ('module2.py', 4), ('module2.py', 7)])
+        self.assertEqual(CountingSearcher.searched, ['module2.py'])
+
+    def test_eviction(self):
+        cache = ResultCache(max_queries=1)
+        self.search('fn:name', cache)
+        self.search('fn:call', cache)
+        self.assertEqual(len(cache.entries), 1)
+        CountingSearcher.searched = []
+        self.search('fn:name', cache)
+        self.assertEqual(len(CountingSearcher.searched), 2)
+
+    def test_persistence(self):
+        expected = self.search('fn:call', ResultCache.open(self.cache_dir))
+        CountingSearcher.searched = []
+        self.assertEqual(self.search('fn:call', ResultCache.open(self.cache_dir)), expected)
+        self.assertEqual(CountingSearcher.searched, [])
+
+    def test_dependents(self):
+        for name, source in [('a.py', 'X = 1\n'), ('b.py', 'Y = 2\n'), ('c.py', 'import b\n')]:
+            with open(os.path.join(self.tmpdir, name), 'w') as f:
+                f.write(source)
+        self.filenames = [os.path.join(self.tmpdir, name) for name in ['a.py', 'b.py', 'c.py']]
+        cache = ResultCache()
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            self.assertEqual(self.search('mod:dependents == "a"', cache), [])
+            # Only b.py changes, but c.py now depends on a too.
+            with open(self.filenames[1], 'w') as f:
+                f.write('import a\n')
+            self.assertEqual(self.search('mod:dependents == "a"', cache),
+                             [('b.py', 1), ('c.py', 1)])
+            self.assertEqual(self.search('mod:dependents == "a"', cache),
+                             [('b.py', 1), ('c.py', 1)])
+        finally:
+            os.chdir(cwd)
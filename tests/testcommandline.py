@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import shutil
+import logging
+import tempfile
+import subprocess
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.commandline import Sona, create_argparser
+
+
+log = logging.getLogger(__name__)
+
+
+def git(*args):
+    return subprocess.check_output(('git', '-c', 'user.name=Sona',
+                                    '-c', 'user.email=sona@example.com') + args)
+
+
+class ChangedFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.repo = os.path.realpath(tempfile.mkdtemp())
+        os.chdir(self.repo)
+        git('init', '-q')
+        self.commit({'a.py': 'A = 1\n', 'b.py': 'B = 1\n', 'c.py': 'C = 1\n',
+                     'notes.txt': 'notes\n'})
+        self.base = git('rev-parse', 'HEAD').strip()
+        self.commit({'a.py': 'A = 2\n', 'notes.txt': 'more notes\n'})
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.repo)
+
+    def commit(self, files):
+        self.write(files)
+        git('add', '-A')
+        git('commit', '-q', '-m', 'commit')
+
+    def write(self, files):
+        for filename, contents in files.items():
+            if contents is None:
+                os.remove(filename)
+            else:
+                with open(filename, 'w') as f:
+                    f.write(contents)
+
+    def changed(self, since=None, uncommitted=False):
+        return sorted(Sona.iter_git_changed_files(since, uncommitted))
+
+    def test_committed(self):
+        self.assertEqual(self.changed(self.base), ['a.py'])
+        self.assertEqual(self.changed('HEAD'), [])
+
+    def test_unstaged(self):
+        self.write({'b.py': 'B = 2\n'})
+        self.assertEqual(self.changed(uncommitted=True), ['b.py'])
+        self.assertEqual(self.changed(self.base), ['a.py'])
+        self.assertEqual(self.changed(self.base, uncommitted=True), ['a.py', 'b.py'])
+
+    def test_staged(self):
+        self.write({'b.py': 'B = 2\n'})
+        git('add', 'b.py')
+        self.assertEqual(self.changed(uncommitted=True), ['b.py'])
+
+    def test_untracked(self):
+        self.write({'d.py': 'D = 1\n', 'other.txt': 'text\n'})
+        self.assertEqual(self.changed(uncommitted=True), ['d.py'])
+        self.assertEqual(self.changed(self.base), ['a.py'])
+
+    def test_deleted(self):
+        self.commit({'c.py': None})
+        self.assertEqual(self.changed(self.base), ['a.py'])
+        self.write({'b.py': None})
+        self.assertEqual(self.changed(self.base, uncommitted=True), ['a.py'])
+
+    def test_diverged(self):
+        git('checkout', '-q', '-b', 'other')
+        self.commit({'b.py': 'B = 2\n'})
+        git('checkout', '-q', '-')
+        self.commit({'c.py': 'C = 2\n'})
+        # What changed on other alone is left out.
+        self.assertEqual(self.changed('other'), ['c.py'])
+        self.write({'a.py': 'A = 3\n'})
+        self.assertEqual(self.changed('other', uncommitted=True), ['a.py', 'c.py'])
+
+    def search(self, flags, query):
+        args = create_argparser().parse_args(flags + [query])
+        searcher = Sona(args).make_searcher()
+        return searcher, sorted(os.path.relpath(result.filename, self.repo)
+                                for result in searcher.search(query))
+
+    def test_dependents(self):
+        self.commit({'b.py': 'import a\n'})
+        self.write({'c.py': 'import b\n'})
+        query = 'mod:dependents == "a"'
+        searcher, found = self.search(['--changed'], query)
+        # b.py is not searched, but it is what c.py depends on a through.
+        self.assertEqual(found, ['c.py'])
+        self.assertEqual(searcher.index.path, None)
+        self.search(['--index'], 'fn:name')
+        searcher, found = self.search(['--changed'], query)
+        self.assertEqual(found, ['c.py'])
+        self.assertNotEqual(searcher.index.path, None)
+
+    def test_path_rejected(self):
+        for flags in [['--changed'], ['--since', 'HEAD']]:
+            args = create_argparser().parse_args(flags + ['-p', '.', 'fn:name'])
+            self.assertEqual(Sona(args).make_searcher(), None)
+        args = create_argparser().parse_args(['-p', '.', 'fn:name'])
+        self.assertNotEqual(Sona(args).make_searcher(), None)
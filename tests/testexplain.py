@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import shutil
+import logging
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.explain import QueryPlan, format_assertion
+from sona.index import SymbolIndex
+from sona.search import SemanticSearcher
+
+
+log = logging.getLogger(__name__)
+
+
+SOURCES = {
+    'a.py': 'def fn1():\n    pass\n\ndef fn2(x):\n    pass\n',
+    'b.py': 'class Cls(object):\n    def fn1(self):\n        pass\n',
+    }
+
+
+class QueryPlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filenames = []
+        for name, source in sorted(SOURCES.items()):
+            filename = os.path.join(self.tmpdir, name)
+            with open(filename, 'w') as f:
+                f.write(source)
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def explain(self, query, index=None):
+        ss = SemanticSearcher(index=index, plan=QueryPlan(), jobs=2)
+        ss.add_files(self.filenames)
+        list(ss.search(query))
+        return ss.plan
+
+    def steps(self, plan):
+        return [(step.assertion, step.locator, step.access, step.evaluations,
+                 None if step.unknown_candidates else step.candidates, step.rows)
+                for _, step in sorted(plan.steps.items())]
+
+    def test_format_assertion(self):
+        self.assertEqual(format_assertion(['fn', 'name']), 'fn:name')
+        self.assertEqual(format_assertion(['fn', 'argcount', 'in', [1, 'x']]),
+                         'fn:argcount in {1, "x"}')
+
+    def test_scan(self):
+        plan = self.explain('fn:name == "fn1", fn:argcount == 1; cls:name')
+        self.assertEqual(self.steps(plan), [
+            ('fn:name == "fn1"', 'Indexer.find_function_by_name', 'scan', 2, None, 2),
+            ('fn:argcount == 1', 'Indexer.find_function_by_argcount', 'scan', 2, 2, 1),
+            ('cls:name', 'Indexer.find_class_by_name', 'scan', 2, None, 1),
+            ])
+
+    def test_index(self):
+        index = SymbolIndex.open(os.path.join(self.tmpdir, '.sona'))
+        plan = self.explain('fn:name == "fn1", fn:parent != "Cls"; fn:name contains "2"',
+                            index)
+        self.assertEqual(self.steps(plan), [
+            ('fn:name == "fn1"', 'match_name', 'index postings', 1, 2, 2),
+            ('fn:parent != "Cls"', 'match_parent', 'index', 1, 2, 1),
+            ('fn:name contains "2"', 'match_name', 'index trigrams', 1, 1, 1),
+            ])
+        lines = plan.format()
+        self.assertEqual(lines[0], 'Query: fn:name == "fn1", fn:parent != "Cls"; '
+                         'fn:name contains "2"')
+        self.assertEqual(lines[1], '  1.1 fn:name == "fn1"')
+        self.assertTrue(lines[2].startswith('      match_name (index postings) x1: '
+                                            'est 2 -> 2 rows, '))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import logging
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.symbols import extract_symbols
+from sona.extents import nest_extents, find_enclosing, NO_PARENT
+from sona.commandline import parse_position
+
+
+log = logging.getLogger(__name__)
+
+
+SOURCE = """
+def outer(a):
+    def inner():
+        return a
+    return inner
+
+class Cls(object):
+    def first(self):
+        pass
+
+    def second(self):
+        pass; x = 1
+"""
+
+
+class ExtentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.extents = nest_extents(extract_symbols('/src/mod.py', SOURCE))
+
+    def enclosing(self, lineno, col_offset=None):
+        def extent(number):
+            symbol, parent = self.extents[number]
+            return symbol.lineno, symbol.col_offset, symbol.end_lineno, parent
+        return [self.extents[number][0].name for number in
+                find_enclosing(len(self.extents), extent, lineno, col_offset)]
+
+    def test_nest_extents(self):
+        self.assertEqual([(symbol.name, symbol.end_lineno, parent)
+                          for symbol, parent in self.extents],
+                         [('mod', 12, NO_PARENT), ('outer', 5, 0), ('inner', 4, 1),
+                          ('Cls', 12, 0), ('first', 9, 3), ('second', 12, 3)])
+
+    def test_find_enclosing(self):
+        self.assertEqual(self.enclosing(4), ['mod', 'outer', 'inner'])
+        self.assertEqual(self.enclosing(5), ['mod', 'outer'])
+        self.assertEqual(self.enclosing(6), ['mod'])
+        self.assertEqual(self.enclosing(10), ['mod', 'Cls'])
+        self.assertEqual(self.enclosing(12), ['mod', 'Cls', 'second'])
+        self.assertEqual(self.enclosing(20), [])
+
+    def test_find_enclosing_column(self):
+        # A position on the line a function starts, but before it,
+        # is in what encloses the function.
+        self.assertEqual(self.enclosing(8, 0), ['mod', 'Cls'])
+        self.assertEqual(self.enclosing(8, 4), ['mod', 'Cls', 'first'])
+
+    def test_parse_position(self):
+        self.assertEqual(parse_position('mod.py:12'), ('mod.py', 12, None))
+        self.assertEqual(parse_position('mod.py:12:5'), ('mod.py', 12, 4))
+        self.assertEqual(parse_position('c:/mod.py:12'), ('c:/mod.py', 12, None))
+        for spec in ['mod.py', 'mod.py:x', ':12']:
+            with self.assertRaises(ValueError):
+                parse_position(spec)
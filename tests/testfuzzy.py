@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import logging
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.fuzzy import BKTree, edit_distance, is_close, search_flat, fuzzy_value
+from sona.parser import AssertionParser
+from sona.search import SemanticSearcher
+
+
+log = logging.getLogger(__name__)
+
+
+NAMES = ['download_file', 'upload_file', 'download', 'UserSerializer',
+         'UserSerialiser', 'load', 'file', 'serialize', 'user']
+
+
+class FuzzyTest(unittest.TestCase):
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance('downlaod_file', 'download_file'), 2)
+        self.assertEqual(edit_distance('UserSerialiser', 'UserSerializer'), 1)
+        self.assertEqual(edit_distance('', 'abc'), 3)
+        self.assertEqual(edit_distance('abc', 'abc'), 0)
+        self.assertEqual(edit_distance('download_file', 'x', limit=3), 4)
+
+    def test_is_close(self):
+        self.assertTrue(is_close('download_file', 'downlaod_file'))
+        self.assertFalse(is_close('upload', 'download_file'))
+        self.assertFalse(is_close(None, 'download_file'))
+
+    def test_bk_tree(self):
+        tree = BKTree()
+        for name in NAMES:
+            tree.add(name)
+        nodes, edges = tree.flatten()
+        self.assertEqual(sorted(word for word, _, _ in nodes), sorted(NAMES))
+        self.assertEqual(len(edges), len(NAMES) - 1)
+        measured = []
+
+        def distance_of(node):
+            measured.append(node)
+            return edit_distance('downlaod_file', nodes[node][0])
+
+        def edges_of(node):
+            _, first, count = nodes[node]
+            return edges[first:first + count]
+
+        found = sorted((distance, nodes[node][0]) for distance, node in
+                       search_flat('downlaod_file', 4, 0, distance_of, edges_of))
+        self.assertEqual(found, sorted((edit_distance('downlaod_file', name), name)
+                                       for name in NAMES
+                                       if edit_distance('downlaod_file', name) <= 4))
+        self.assertLess(len(measured), len(NAMES))
+
+    def test_fuzzy_value(self):
+        self.assertEqual(fuzzy_value(AssertionParser('cls:parent, fn:name ~ "run"').tree),
+                         'run')
+        self.assertIsNone(fuzzy_value(AssertionParser('fn:name ~ "run", cls:name').tree))
+        self.assertIsNone(fuzzy_value(AssertionParser('fn:name ~ "run"; cls:name').tree))
+
+    def test_search(self):
+        with tempfile.NamedTemporaryFile(suffix='.py') as f:
+            f.write(''.join('def {0}():\n    pass\n'.format(name) for name in NAMES))
+            f.flush()
+            ss = SemanticSearcher()
+            ss.add_file(f.name)
+            self.assertEqual([result.name for result in ss.search('fn:name ~ "dowload_file"')],
+                             ['download_file', 'upload_file'])
+            self.assertEqual([result.name for result in ss.search('fn:name ~ "UserSerialiser"')],
+                             ['UserSerialiser', 'UserSerializer'])
+            ss = SemanticSearcher(fuzzy_top=1)
+            ss.add_file(f.name)
+            self.assertEqual([result.name for result in ss.search('fn:name ~ "dowload_file"')],
+                             ['download_file'])
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+import subprocess
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.gitindex import GitIndex, parse_index
+from sona.index import SymbolIndex, content_digest
+from sona.search import SemanticSearcher
+
+
+log = logging.getLogger(__name__)
+
+
+FILES = {
+    'a.py': 'def fn1():\n    pass\n',
+    'pkg/b.py': 'def fn2():\n    pass\n',
+    }
+
+
+def git(repo, *args):
+    return subprocess.check_output(('git', '-C', repo) + args)
+
+
+class GitIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = os.path.realpath(tempfile.mkdtemp())
+        git(self.repo, 'init', '-q')
+        # Written a while ago, so that git does not see the files as
+        # racily clean.
+        past = time.time() - 60
+        for name, source in FILES.items():
+            self.write(name, source, past)
+        git(self.repo, 'add', '.')
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+
+    def path(self, name):
+        return os.path.join(self.repo, name)
+
+    def write(self, name, source, mtime=None):
+        if not os.path.isdir(os.path.dirname(self.path(name))):
+            os.makedirs(os.path.dirname(self.path(name)))
+        with open(self.path(name), 'w') as f:
+            f.write(source)
+        if mtime is not None:
+            os.utime(self.path(name), (mtime, mtime))
+
+    def test_parse(self):
+        for version in ['2', '3', '4']:
+            git(self.repo, 'update-index', '--index-version', version)
+            with open(os.path.join(self.repo, '.git', 'index'), 'rb') as f:
+                entries = parse_index(f.read())
+            self.assertEqual(sorted(entries), sorted(FILES), version)
+            for name, source in FILES.items():
+                self.assertEqual(entries[name].sha, content_digest(source))
+                self.assertEqual(entries[name].size, len(source))
+
+    def test_digest(self):
+        git_index = GitIndex.read(os.path.join(self.repo, 'pkg'))
+        self.assertEqual(git_index.root, self.repo)
+        self.assertEqual(git_index.digest(self.path('a.py')), content_digest(FILES['a.py']))
+        self.write('a.py', FILES['a.py'] + '\n')
+        self.assertEqual(git_index.digest(self.path('a.py')), None)
+        self.write('c.py', 'x = 1\n')
+        self.assertEqual(git_index.digest(self.path('c.py')), None)
+
+    def test_racily_clean(self):
+        self.write('a.py', FILES['a.py'])
+        git(self.repo, 'add', 'a.py')
+        self.assertEqual(GitIndex.read(self.repo).digest(self.path('a.py')), None)
+
+    def test_not_a_repo(self):
+        shutil.rmtree(os.path.join(self.repo, '.git'))
+        self.assertEqual(GitIndex.read(self.repo), None)
+
+    def test_unchanged_files_not_read(self):
+        filenames = [self.path(name) for name in sorted(FILES)]
+        index_dir = os.path.join(self.repo, '.sona')
+        ss = SemanticSearcher(index=SymbolIndex.open(index_dir),
+                              git_index=GitIndex.read(self.repo))
+        ss.add_files(filenames)
+        self.assertEqual(len(list(ss.search('fn:name == "fn1"'))), 1)
+        # Same size, mtime and inode: only reading it would tell.
+        mtime = os.stat(self.path('a.py')).st_mtime
+        with open(self.path('a.py'), 'r+') as f:
+            f.write(FILES['a.py'].replace('fn1', 'fn9'))
+        os.utime(self.path('a.py'), (mtime, mtime))
+        ss = SemanticSearcher(index=SymbolIndex.open(index_dir),
+                              git_index=GitIndex.read(self.repo))
+        ss.add_files(filenames)
+        self.assertEqual(len(list(ss.search('fn:name == "fn1"'))), 1)
+        ss = SemanticSearcher(index=SymbolIndex.open(index_dir))
+        ss.add_files(filenames)
+        self.assertEqual(len(list(ss.search('fn:name == "fn1"'))), 0)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import shutil
+import logging
+import tempfile
+import subprocess
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.history import HistorySearcher, iter_commits
+
+
+log = logging.getLogger(__name__)
+
+
+def git(*args):
+    return subprocess.check_output(('git', '-c', 'user.name=Sona',
+                                    '-c', 'user.email=sona@example.com') + args)
+
+
+class HistorySearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.repo = tempfile.mkdtemp()
+        os.chdir(self.repo)
+        git('init', '-q')
+        self.commit({'a.py': 'def fn1():\n    pass\n',
+                     'b.py': 'def fn2():\n    pass\n'})
+        self.commit({'b.py': 'def fn2():\n    pass\n\ndef fn3():\n    pass\n'})
+        self.commit({'c.py': 'x = 1\n'})
+        self.commit({'b.py': None})
+        self.commits = iter_commits('HEAD')
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.repo)
+
+    def commit(self, files):
+        for filename, contents in files.items():
+            if contents is None:
+                git('rm', '-q', filename)
+            else:
+                with open(filename, 'w') as f:
+                    f.write(contents)
+                git('add', filename)
+        git('commit', '-q', '-m', 'commit')
+
+    def test_spans(self):
+        hs = HistorySearcher('HEAD')
+        results = [(node.name, span.path, span.commits)
+                   for span, node in hs.search('fn:name')]
+        c1, c2, c3, c4 = self.commits
+        # Blobs in the order they appeared, each in commit order.
+        self.assertEqual(results, [
+                ('fn1', 'a.py', [c1, c2, c3, c4]),
+                ('fn2', 'b.py', [c1]),
+                ('fn2', 'b.py', [c2, c3]),
+                ('fn3', 'b.py', [c2, c3]),
+                ])
+
+    def test_spans_in_commit_order(self):
+        # The same blob comes and goes, so it has several spans.
+        for _ in range(3):
+            self.commit({'d.py': 'def fn4():\n    pass\n'})
+            self.commit({'d.py': None})
+        commits = iter_commits('HEAD')
+        hs = HistorySearcher('HEAD')
+        spans = [span.commits for span, node in hs.search('fn:name == "fn4"')]
+        self.assertEqual(spans, [[commit] for commit in commits[4::2]])
+
+    def test_blobs_indexed_once(self):
+        hs = HistorySearcher('HEAD')
+        list(hs.search('fn:name'))
+        # a.py never changes, b.py has two versions and c.py one.
+        self.assertEqual(len(hs.indexed_blobs), 4)
+
+    def test_range(self):
+        c1, c2, c3, c4 = self.commits
+        hs = HistorySearcher('{0}..{1}'.format(c2, c4))
+        results = [(node.name, span.path, span.commits)
+                   for span, node in hs.search('fn:name == "fn2"')]
+        self.assertEqual(results, [('fn2', 'b.py', [c3])])
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import shutil
+import logging
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.index import SymbolIndex, is_indexable
+from sona.imports import resolve_import
+from sona.search import SemanticSearcher
+from sona.parser import AssertionParser
+
+
+log = logging.getLogger(__name__)
+
+
+MODULE1 = """
+TIMEOUT = 10
+
+def connect(host):
+    return open_socket(host, TIMEOUT)
+"""
+
+MODULE2 = """
+from settings import TIMEOUT
+
+class Client(object):
+    def wait(self):
+        sleep(TIMEOUT)
+"""
+
+
+class SymbolIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filenames = []
+        for name, source in [('module1.py', MODULE1), ('module2.py', MODULE2)]:
+            filename = os.path.join(self.tmpdir, name)
+            with open(filename, 'w') as f:
+                f.write(source)
+            self.filenames.append(filename)
+        self.index_dir = os.path.join(self.tmpdir, '.sona')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def search(self, query, index):
+        ss = SemanticSearcher(index=index)
+        ss.add_files(self.filenames)
+        return [(os.path.basename(result.filename), result.lineno, result.parent)
+                for result in ss.search(query)]
+
+    def test_is_indexable(self):
+        self.assertTrue(is_indexable(AssertionParser('var:ref == "x"; fn:name').tree))
+        self.assertFalse(is_indexable(AssertionParser('"string"').tree))
+
+    def test_ref(self):
+        index = SymbolIndex.open(self.index_dir)
+        self.assertEqual(self.search('var:ref == "TIMEOUT"', index),
+                         [('module1.py', 5, 'connect'), ('module2.py', 6, 'wait')])
+        self.assertEqual(self.search('var:ref in {"host", "self"}', index),
+                         [('module1.py', 5, 'connect')])
+
+    def test_same_as_searcher(self):
+        for query in ['var:ref == "TIMEOUT"', 'fn:call', 'var:name; cls:name',
+                      'fn:name contains "n"', 'cls:name =~ "^Cl"', 'var:ref =~ "T.*OUT"',
+                      'fn:name ~ "conect"', 'var:name ~ "TIMEOT"; cls:name ~ "Clint"',
+                      'fn:name except fn:parent == "Client"',
+                      'var:ref intersect var:ref == "TIMEOUT"; cls:name']:
+            ss = SemanticSearcher()
+            ss.add_files(self.filenames)
+            expected = [(os.path.basename(result.root().file), result.lineno)
+                        for result in ss.search(query)]
+            found = [(filename, lineno) for filename, lineno, _ in
+                     self.search(query, SymbolIndex.open(self.index_dir))]
+            self.assertEqual(found, expected, query)
+
+    def test_update(self):
+        index = SymbolIndex()
+        filename = self.filenames[0]
+        self.assertTrue(index.update(filename))
+        self.assertFalse(index.update(filename))
+        self.assertTrue(index.update(filename, MODULE1.replace('TIMEOUT', 'DELAY')))
+        self.assertFalse(index.postings.get(('ref', 'TIMEOUT')))
+        self.assertEqual(len(index.postings[('ref', 'DELAY')][filename]), 1)
+        index.remove(filename)
+        self.assertFalse(index.entries)
+        self.assertFalse(index.postings)
+
+    def test_update_saved(self):
+        index = SymbolIndex.open(self.index_dir)
+        self.search('var:ref', index)
+        filename = self.filenames[0]
+        with open(filename, 'w') as f:
+            f.write(MODULE1.replace('TIMEOUT', 'DELAY'))
+        self.assertTrue(index.update(filename))
+        self.assertEqual(index.removed, set([filename]))
+        self.assertEqual([symbol.filename for symbol in index.select('ref', None)
+                          if symbol.name == 'TIMEOUT'], [self.filenames[1]])
+        index.save()
+        self.assertFalse(index.removed)
+        self.assertEqual(index.table.generation, 1)
+        self.assertEqual(self.search('var:ref == "DELAY"', SymbolIndex.open(self.index_dir)),
+                         [('module1.py', 5, 'connect')])
+
+    def test_persistence(self):
+        index = SymbolIndex.open(self.index_dir)
+        self.search('var:ref', index)
+        self.assertFalse(index.dirty)
+        reopened = SymbolIndex.open(self.index_dir)
+        self.assertTrue(reopened.table is not None)
+        self.assertFalse(reopened.entries)
+        self.assertEqual(reopened.filenames(), sorted(self.filenames))
+        self.assertFalse(any(reopened.update(filename) for filename in self.filenames))
+        self.assertEqual(self.search('var:ref == "TIMEOUT"', reopened),
+                         self.search('var:ref == "TIMEOUT"', index))
+
+    def test_documented(self):
+        with open(self.filenames[1], 'w') as f:
+            f.write('"""Client of the sleep API."""\n' + MODULE2.replace(
+                'def wait(self):\n', 'def wait(self):\n        """Sleeps, deprecated."""\n'))
+        index = SymbolIndex.open(self.index_dir)
+        self.assertEqual(self.search('doc:text contains "API client"', index),
+                         [('module2.py', 1, None)])
+        self.assertEqual(self.search('fn:name, doc:text contains "deprecated"', index),
+                         [('module2.py', 6, 'Client')])
+        self.assertEqual(self.search('doc:text =~ "^Sleeps"', index),
+                         [('module2.py', 6, 'Client')])
+        self.assertEqual(self.search('doc:text contains "sleep"',
+                                     SymbolIndex.open(self.index_dir)),
+                         [('module2.py', 1, None)])
+        index = SymbolIndex()
+        index.update(self.filenames[1])
+        self.assertEqual(len(index.documented(set(['sleeps', 'deprecated']))), 1)
+        index.remove(self.filenames[1])
+        self.assertFalse(index.words)
+
+    def test_enclosing(self):
+        index = SymbolIndex()
+        index.update(self.filenames[1])
+        chain = index.enclosing(self.filenames[1], 6)
+        self.assertEqual([symbol.name for symbol in chain], ['module2', 'Client', 'wait'])
+        self.search('var:ref', SymbolIndex.open(self.index_dir))
+        reopened = SymbolIndex.open(self.index_dir)
+        self.assertEqual(reopened.enclosing(self.filenames[1], 6),
+                         [symbol._replace(text=None) for symbol in chain])
+        self.assertFalse(reopened.entries)
+        self.assertEqual(reopened.siblings(chain[1]), [])
+        self.assertEqual(reopened.enclosing(self.filenames[0], 50), [])
+
+    def test_callers(self):
+        with open(self.filenames[1], 'a') as f:
+            f.write('\n    def retry(self):\n        connect(1)\n        self.wait()\n')
+        index = SymbolIndex.open(self.index_dir)
+        for filename in self.filenames:
+            index.update(filename)
+        wait = index.enclosing(self.filenames[1], 6)[-1]
+        self.assertEqual([symbol.name for symbol in index.siblings(wait)], ['retry'])
+        connect = index.enclosing(self.filenames[0], 5)[-1]
+        self.assertEqual([(os.path.basename(symbol.filename), symbol.lineno)
+                          for symbol in index.callers(connect)], [('module2.py', 9)])
+
+
+PACKAGE = {
+    'pkg/__init__.py': 'from .util import helper\n',
+    'pkg/core.py': 'import os\nVALUE = 1\n',
+    'pkg/util.py': 'from .core import VALUE\n\ndef helper():\n    return VALUE\n',
+    'app.py': 'import sys\nfrom pkg import util\n',
+    'other.py': 'import pkg.core\nimport app\n',
+    'unrelated.py': 'import os.path\n',
+    }
+
+
+class ImportGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filenames = []
+        for name, source in sorted(PACKAGE.items()):
+            filename = os.path.join(self.tmpdir, name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'w') as f:
+                f.write(source)
+            self.filenames.append(filename)
+        self.index_dir = os.path.join(self.tmpdir, '.sona')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def search(self, query, index=None):
+        ss = SemanticSearcher(index=index)
+        ss.add_files(self.filenames)
+        return [(os.path.relpath(result.filename, self.tmpdir), result.lineno)
+                for result in ss.search(query)]
+
+    def test_resolve_import(self):
+        modules = set(['pkg', 'pkg.core', 'pkg.util', 'app'])
+        self.assertEqual(resolve_import('.core.VALUE', 'pkg', modules), 'pkg.core')
+        self.assertEqual(resolve_import('pkg.util', '', modules), 'pkg.util')
+        self.assertEqual(resolve_import('pkg.helper', '', modules), 'pkg')
+        self.assertEqual(resolve_import('core', 'pkg', modules), 'pkg.core')
+        self.assertEqual(resolve_import('os', 'pkg', modules), None)
+        self.assertEqual(resolve_import('...core', 'pkg', modules), None)
+
+    def test_importers(self):
+        index = SymbolIndex.open(self.index_dir)
+        self.assertEqual(self.search('mod:import == "pkg.core"', index),
+                         [('other.py', 1), ('pkg/util.py', 1)])
+        self.assertEqual(self.search('mod:import == "pkg.util"', index),
+                         [('app.py', 2), ('pkg/__init__.py', 1)])
+
+    def test_dependents(self):
+        index = SymbolIndex.open(self.index_dir)
+        self.assertEqual(self.search('mod:dependents == "pkg.core"', index),
+                         [('app.py', 2), ('other.py', 1), ('other.py', 2),
+                          ('pkg/__init__.py', 1), ('pkg/util.py', 1)])
+
+    def test_without_index(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            self.assertEqual(self.search('mod:import == "app"'), [('other.py', 2)])
+        finally:
+            os.chdir(cwd)
+
+    def test_persistence(self):
+        index = SymbolIndex.open(self.index_dir)
+        self.search('mod:import', index)
+        reopened = SymbolIndex.open(self.index_dir)
+        self.assertTrue(reopened._load_graph() is not None)
+        self.assertEqual(reopened.graph.reverse, index.graph.reverse)
+        self.assertEqual(reopened.graph.forward['pkg.util'], set(['pkg.core']))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import gc
+import os
+import shutil
+import logging
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona import memory
+from sona.search import SemanticSearcher
+
+
+log = logging.getLogger(__name__)
+
+
+class MemoryReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filenames = []
+        for number in xrange(3):
+            filename = os.path.join(self.tmpdir, 'mod{0}.py'.format(number))
+            with open(filename, 'w') as f:
+                f.write('def fn{0}():\n    pass\n'.format(number))
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        memory.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def search(self, jobs=1):
+        ss = SemanticSearcher(jobs=jobs)
+        ss.add_file_source(iter(self.filenames))
+        return list(ss.search('fn:name'))
+
+    def test_inactive(self):
+        with memory.phase('build', 'nothing.py'):
+            pass
+        self.assertIsNone(memory.stop())
+
+    def test_phases(self):
+        report = memory.start()
+        self.assertEqual(len(self.search()), 3)
+        self.assertEqual([(name, stats.calls) for name, stats in report.phases.items()],
+                         [('list', 4), ('build', 3), ('traverse', 3), ('filter', 3),
+                          ('format', 0)])
+        self.assertEqual(sorted(report.files), self.filenames)
+        self.assertIs(memory.stop(), report)
+
+    def test_workers(self):
+        report = memory.start()
+        self.assertEqual(len(self.search(jobs=2)), 3)
+        self.assertEqual(report.phases['build'].calls, 3)
+        self.assertTrue(report.workers)
+        self.assertNotIn(os.getpid(), report.workers)
+        self.assertTrue(all(peak > 0 for peak in report.workers.values()))
+
+    def test_allocating_file(self):
+        report = memory.start()
+        with memory.phase('build', 'big.py'):
+            kept = [[number] for number in xrange(1000)]
+        with memory.phase('build', 'small.py'):
+            pass
+        self.assertEqual(len(kept), 1000)
+        self.assertGreater(report.files['big.py'], 0)
+        self.assertGreater(report.files['big.py'], report.files['small.py'])
+        self.assertTrue(gc.isenabled())
+
+    def test_format(self):
+        report = memory.MemoryReport()
+        report.counts_objects = False
+        report.record('build', 'big.py', 3 * 1024 * 1024, 0)
+        report.record('build', 'small.py', 100, 0)
+        report.merge((1234, 2048, {}, {'small.py': 1024}))
+        lines = report.format(top=1)
+        self.assertTrue(lines[0].startswith('Peak RSS: '))
+        self.assertIn('  build     x2: RSS +3.0MiB, traced +0B', lines)
+        self.assertEqual(lines[-4:], ['Files that allocated the most:',
+                                      '      3.0MiB big.py',
+                                      'Worker peak RSS:',
+                                      '      2.0KiB pid 1234'])
+
+    def test_format_objects(self):
+        report = memory.MemoryReport()
+        report.counts_objects = True
+        report.record('build', 'big.py', 0, 0, 1500)
+        lines = report.format()
+        self.assertEqual(lines[1], 'No tracemalloc: allocations are counted in objects, not bytes')
+        self.assertIn('  build     x1: RSS +0B, objects +1500', lines)
+        self.assertEqual(lines[-2:], ['Files that allocated the most objects:',
+                                      '        1500 big.py'])
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import shutil
+import logging
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.packages import find_distributions, mount_packages
+from sona.search import SemanticSearcher, JSONOutputFormatter
+
+
+log = logging.getLogger(__name__)
+
+
+SITE_PACKAGES = {
+    'requests/__init__.py': 'from .api import get\n',
+    'requests/api.py': 'def get(url):\n    pass\n',
+    'requests-2.0.dist-info/METADATA': 'Metadata-Version: 2.0\nName: requests\n'
+                                       'Version: 2.0\n\nLong description\n',
+    'requests-2.0.dist-info/RECORD': 'requests/__init__.py,sha256=x,20\n'
+                                     'requests/api.py,sha256=y,25\n'
+                                     'requests-2.0.dist-info/METADATA,,\n'
+                                     '../../bin/requests,,\n',
+    'six.py': 'def get(key):\n    pass\n',
+    'six-1.9.egg-info/PKG-INFO': 'Metadata-Version: 1.0\nName: six\nVersion: 1.9\n',
+    'six-1.9.egg-info/top_level.txt': 'six\n',
+    'broken.dist-info/METADATA': 'Metadata-Version: 2.0\n',
+    }
+
+
+class PackagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.site_dir = os.path.join(self.tmpdir, 'site-packages')
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        for name, contents in SITE_PACKAGES.items():
+            path = os.path.join(self.site_dir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(contents)
+        self.project_file = os.path.join(self.tmpdir, 'app.py')
+        with open(self.project_file, 'w') as f:
+            f.write('import requests\n\ndef get():\n    return requests.get(URL)\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def search(self, query, site_dir=None):
+        ss = SemanticSearcher(packages=mount_packages(site_dir or self.site_dir,
+                                                      self.cache_dir))
+        ss.add_file(self.project_file)
+        return [(os.path.relpath(result.root().file if hasattr(result, 'root')
+                                 else result.filename, self.tmpdir), result.lineno)
+                for result in ss.search(query)]
+
+    def test_find_distributions(self):
+        self.assertEqual(
+            [(distribution.key, [os.path.relpath(filename, self.site_dir)
+                                 for filename in distribution.filenames])
+             for distribution in find_distributions(self.site_dir)],
+            [('requests-2.0', ['requests/__init__.py', 'requests/api.py']),
+             ('six-1.9', ['six.py'])])
+
+    def test_search(self):
+        self.assertEqual(self.search('fn:name == "get"'),
+                         [('app.py', 3), ('site-packages/requests/api.py', 1),
+                          ('site-packages/six.py', 1)])
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['requests-2.0', 'six-1.9'])
+
+    def test_site_dirs(self):
+        other_site_dir = os.path.join(self.tmpdir, 'other-site-packages')
+        shutil.copytree(self.site_dir, other_site_dir)
+        self.search('fn:name')
+        shutil.rmtree(self.site_dir)
+        # The same versions in another site directory have indexes of
+        # their own, with their own paths.
+        self.assertEqual(self.search('fn:name == "get"', other_site_dir),
+                         [('app.py', 3), ('other-site-packages/requests/api.py', 1),
+                          ('other-site-packages/six.py', 1)])
+        self.assertEqual(len(os.listdir(os.path.join(self.cache_dir, 'six-1.9'))), 2)
+
+    def test_changed_files(self):
+        self.search('fn:name')
+        os.remove(os.path.join(self.site_dir, 'requests', 'api.py'))
+        self.assertEqual(self.search('fn:name == "get"'),
+                         [('app.py', 3), ('site-packages/six.py', 1)])
+
+    def test_missing_file(self):
+        ss = SemanticSearcher(packages=mount_packages(self.site_dir, self.cache_dir))
+        ss.add_file(self.project_file)
+        results = list(ss.search('fn:name == "get"'))
+        os.remove(os.path.join(self.site_dir, 'six.py'))
+        formatter = JSONOutputFormatter()
+        formatter.post_output = lambda: None
+        formatter.print_all_results(results)
+        self.assertEqual([os.path.basename(output['filename']) for output in formatter._store],
+                         ['app.py', 'api.py'])
+
+    def test_reused(self):
+        self.search('fn:name')
+        # Installed packages are only ever indexed once per version.
+        with open(os.path.join(self.site_dir, 'six.py'), 'w') as f:
+            f.write('def put(key):\n    pass\n')
+        self.assertEqual(self.search('fn:name == "put"'), [])
+
+    def test_imports(self):
+        self.assertEqual(self.search('mod:import == "requests.api"'),
+                         [('site-packages/requests/__init__.py', 1)])
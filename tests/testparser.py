@@ -7,12 +7,17 @@ try:
 except ImportError:
     import unittest
 
-from sona.parser import AssertionParser
-import pyparsing
+from sona.parser import (AssertionParser, QueryParser, parse_query, tokenize,
+                         iter_expressions)
+from sona.exceptions import QuerySyntaxError
 
 log = logging.getLogger(__name__)
 
 
+def parse_value(value):
+    return QueryParser(value).parse_value()
+
+
 class AssertionParserTest(unittest.TestCase):
 
     def setUp(self):
@@ -22,129 +27,137 @@ class AssertionParserTest(unittest.TestCase):
         pass
 
     def test_string(self):
-        ap = AssertionParser()
-        pt = ap.String.parseString('"Test String"')
-        self.assertEqual(pt.pop(), 'Test String')
-        pt = ap.String.parseString("'Test String'")
-        self.assertEqual(pt.pop(), 'Test String')
+        self.assertEqual(parse_value('"Test String"'), 'Test String')
+        self.assertEqual(parse_value("'Test String'"), 'Test String')
 
     def test_number(self):
-        ap = AssertionParser()
-        pt = ap.Number.parseString('100392')
-        self.assertEqual(pt.pop(), 100392)
+        self.assertEqual(parse_value('100392'), 100392)
 
     def test_string_error(self):
-        ap = AssertionParser()
-        with self.assertRaises(pyparsing.ParseException):
-            ap.String.parseString("'Test String\"")
+        with self.assertRaises(QuerySyntaxError):
+            tokenize("'Test String\"")
 
     def test_set(self):
-        ap = AssertionParser()
-        pt = set(ap.Set.parseString("{42, 'hello world', 10}").asList()[0])
+        pt = set(parse_value("{42, 'hello world', 10}"))
         self.assertSetEqual(pt, set([42, 'hello world', 10]))
 
     def test_set_wrong(self):
-        ap = AssertionParser()
-        with self.assertRaises(pyparsing.ParseException):
-            pt = set(ap.Set.parseString("{42, 'hello world', 10, foo bar}").asList()[0])
+        with self.assertRaises(QuerySyntaxError):
+            parse_value("{42, 'hello world', 10, foo bar}")
 
     def test_field(self):
-        ap = AssertionParser()
-        pt = ap.Field.parseString("testfield:testattr")
-        self.assertEqual(pt.pop(0), 'testfield')
-        self.assertEqual(pt.pop(0), 'testattr')
+        pt = QueryParser("testfield:testattr").parse_assertion()
+        self.assertEqual(pt, ['testfield', 'testattr'])
 
     def test_field_error(self):
-        ap = AssertionParser()
         # missing something : and second half
-        with self.assertRaises(pyparsing.ParseException):
-            pt = ap.Field.parseString("testfield")
-        with self.assertRaises(pyparsing.ParseException):
-            pt = ap.Field.parseString("testfield:")
-        with self.assertRaises(pyparsing.ParseException):
-            pt = ap.Field.parseString(":foo")
+        with self.assertRaises(QuerySyntaxError):
+            parse_query("testfield")
+        with self.assertRaises(QuerySyntaxError):
+            parse_query("testfield:")
+        with self.assertRaises(QuerySyntaxError):
+            parse_query(":foo")
 
     def test_conditional(self):
-        ap = AssertionParser()
-        pt = ap.Conditional.parseString("==")
-        self.assertEqual(pt.pop(), '==')
-        pt = ap.Conditional.parseString("!=")
-        self.assertEqual(pt.pop(), '!=')
-        pt = ap.Conditional.parseString("in")
-        self.assertEqual(pt.pop(), 'in')
-        pt = ap.Conditional.parseString("not in")
-        self.assertEqual(pt.pop(), 'not in')
+        for conditional in ['==', '!=', '=~', '~', 'in', 'not in', 'contains']:
+            self.assertEqual(QueryParser(conditional).parse_conditional(), conditional)
 
     def test_assertion(self):
-        ap = AssertionParser()
-        pt = ap.Assertion.parseString('fn:name == "hello"').asList()
-
-        self.assertEqual(pt.pop(0), 'fn')
-        self.assertEqual(pt.pop(0), 'name')
-        self.assertEqual(pt.pop(0), '==')
-        self.assertEqual(pt.pop(0), 'hello')
+        pt = parse_query('fn:name == "hello"')
+        self.assertEqual(pt, [[['fn', 'name', '==', 'hello']]])
 
     def test_assertion_number(self):
-        ap = AssertionParser()
-        pt = ap.Assertion.parseString('fn:argcount == 3').asList()
-
-        self.assertEqual(pt.pop(0), 'fn')
-        self.assertEqual(pt.pop(0), 'argcount')
-        self.assertEqual(pt.pop(0), '==')
-        self.assertEqual(pt.pop(0), 3)
+        pt = parse_query('fn:argcount == 3')
+        self.assertEqual(pt, [[['fn', 'argcount', '==', 3]]])
 
     def test_assertion_set(self):
-        ap = AssertionParser()
-        pt = ap.Assertion.parseString('fn:name in {"fn1", "fn2"}').asList()
-        self.assertEqual(pt, ['fn', 'name', 'in', ['fn1', 'fn2']])
-        pt = ap.Assertion.parseString('fn:name not in {"fn1", "fn2"}').asList()
-        self.assertEqual(pt, ['fn', 'name', 'not in', ['fn1', 'fn2']])
+        pt = parse_query('fn:name in {"fn1", "fn2"}')
+        self.assertEqual(pt, [[['fn', 'name', 'in', ['fn1', 'fn2']]]])
+        pt = parse_query('fn:name not in {"fn1", "fn2"}')
+        self.assertEqual(pt, [[['fn', 'name', 'not in', ['fn1', 'fn2']]]])
+
+    def test_assertion_pattern(self):
+        pt = parse_query('cls:name =~ ".*Handler$"; fn:name contains "cache"')
+        self.assertEqual(pt, [[['cls', 'name', '=~', '.*Handler$']],
+                              [['fn', 'name', 'contains', 'cache']]])
+        with self.assertRaises(QuerySyntaxError):
+            parse_query('fn:name contains {"a", "b"}')
+        with self.assertRaises(QuerySyntaxError) as cm:
+            parse_query('fn:name =~ "(("')
+        self.assertEqual(cm.exception.column, 12)
 
     def test_assertion_error(self):
-        ap = AssertionParser()
-        with self.assertRaises(pyparsing.ParseException):
-            pt = ap.Assertion.parseString('fn:name <> "hello"')
-        with self.assertRaises(pyparsing.ParseException):
-            pt = ap.Assertion.parseString('fn:name ==')
-        with self.assertRaises(pyparsing.ParseException):
-            pt = ap.Assertion.parseString('fn: ==')
+        with self.assertRaises(QuerySyntaxError):
+            parse_query('fn:name <> "hello"')
+        with self.assertRaises(QuerySyntaxError):
+            parse_query('fn:name ==')
+        with self.assertRaises(QuerySyntaxError):
+            parse_query('fn: ==')
 
     def test_expr(self):
-        ap = AssertionParser()
-        pt = ap.Expression.parseString('fn:name == "foo" , cls:name == "bar"')
-        assertion1 = pt.asList()[0]
-        assertion2 = pt.asList()[1]
-        self.assertEqual(assertion1, ['fn', 'name', '==', 'foo'])
-        self.assertEqual(assertion2, ['cls', 'name', '==', 'bar'])
-        with self.assertRaises(pyparsing.ParseException):
-            pt = ap.Assertion.parseString('fn:name == , cls:name')
-
-        pt = ap.Expression.parseString('fn:name, cls:name')
-        self.assertEqual(pt.asList(), [['fn', 'name'], ['cls', 'name']])
+        pt = parse_query('fn:name == "foo" , cls:name == "bar"')
+        self.assertEqual(pt, [[['fn', 'name', '==', 'foo'],
+                               ['cls', 'name', '==', 'bar']]])
+        with self.assertRaises(QuerySyntaxError):
+            parse_query('fn:name == , cls:name')
+
+        pt = parse_query('fn:name, cls:name')
+        self.assertEqual(pt, [[['fn', 'name'], ['cls', 'name']]])
 
     def test_expr_string(self):
-        ap = AssertionParser()
-        pt = ap.Expression.parseString('"Test"')
-        self.assertEqual(pt.asList(), ['Test'])
+        self.assertEqual(parse_query('"Test"'), [['Test']])
 
     def test_query(self):
-        ap = AssertionParser()
-        pt = ap.Query.parseString('fn:name; cls:name == "foo"')
-        self.assertEqual(pt.asList(), [[['fn', 'name']], [['cls', 'name', '==', 'foo']]])
-
-        pt = ap.Query.parseString('fn:name == "hello", fn:name != "goodbye"; cls:name == "test"')
-        self.assertEqual(pt.asList(), [[['fn', 'name', '==', 'hello'],
-                                        ['fn', 'name', '!=', 'goodbye']],
-                                       [['cls', 'name', '==', 'test']]])
-
-        pt = ap.Query.parseString('fn:name; cls:name')
-        self.assertEqual(pt.asList(), [[['fn', 'name']], [['cls', 'name']]])
-
-        with self.assertRaises(pyparsing.ParseException):
-            pt = ap.Query.parseString('fn:name cls:name, fn:name', parseAll=True)
+        pt = parse_query('fn:name; cls:name == "foo"')
+        self.assertEqual(pt, [[['fn', 'name']], [['cls', 'name', '==', 'foo']]])
+
+        pt = parse_query('fn:name == "hello", fn:name != "goodbye"; cls:name == "test"')
+        self.assertEqual(pt, [[['fn', 'name', '==', 'hello'],
+                               ['fn', 'name', '!=', 'goodbye']],
+                              [['cls', 'name', '==', 'test']]])
+
+        pt = parse_query('fn:name; cls:name')
+        self.assertEqual(pt, [[['fn', 'name']], [['cls', 'name']]])
+
+        with self.assertRaises(QuerySyntaxError):
+            parse_query('fn:name cls:name, fn:name')
+
+    def test_set_operators(self):
+        pt = parse_query('fn:name == "x" except fn:parent == "C"; cls:name intersect cls:name')
+        self.assertEqual(pt, [[['fn', 'name', '==', 'x']],
+                              ['except', [['fn', 'parent', '==', 'C']]],
+                              [['cls', 'name']],
+                              ['intersect', [['cls', 'name']]]])
+        self.assertEqual([operator for operator, _ in iter_expressions(pt)],
+                         ['union', 'except', 'union', 'intersect'])
+        self.assertEqual(list(iter_expressions([['except']])), [('union', ['except'])])
+        with self.assertRaises(QuerySyntaxError):
+            parse_query('fn:name except')
+        with self.assertRaises(QuerySyntaxError):
+            parse_query('except fn:name')
+
+    def test_query_many_expressions(self):
+        pt = parse_query('fn:name; cls:name; var:name == "x"')
+        self.assertEqual(pt, [[['fn', 'name']], [['cls', 'name']],
+                              [['var', 'name', '==', 'x']]])
 
     def test_query_no_whitespaces(self):
-        ap = AssertionParser()
-        pt = ap.Query.parseString('fn:name; cls:name == "foo"')
-        pt_nospace = ap.Query.parseString('fn:name;cls:name=="foo"')
-        self.assertEqual(pt.asList(), pt_nospace.asList())
+        pt = parse_query('fn:name; cls:name == "foo"')
+        pt_nospace = parse_query('fn:name;cls:name=="foo"')
+        self.assertEqual(pt, pt_nospace)
+
+    def test_error_position(self):
+        with self.assertRaises(QuerySyntaxError) as cm:
+            parse_query('fn:name ==\ncls:name')
+        self.assertEqual(cm.exception.line, 'cls:name')
+        self.assertEqual(cm.exception.lineno, 2)
+        self.assertEqual(cm.exception.column, 1)
+
+        with self.assertRaises(QuerySyntaxError) as cm:
+            parse_query('fn:name <> "x"')
+        self.assertEqual(cm.exception.column, 9)
+
+    def test_cache(self):
+        query = 'fn:name == "cached"'
+        self.assertIs(parse_query(query), parse_query(query))
+        self.assertIs(AssertionParser(query).tree, parse_query(query))
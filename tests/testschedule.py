@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import shutil
+import logging
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.schedule import CostModel, schedule, DEFAULT_SECONDS_PER_BYTE
+
+
+log = logging.getLogger(__name__)
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def test_largest_first(self):
+        self.assertEqual(schedule([1, 5, 3], batch_cost=1), [[1], [2], [0]])
+
+    def test_batches(self):
+        self.assertEqual(schedule([0.5, 4, 0.25, 0.5, 0.25], batch_cost=1),
+                         [[1], [0, 3], [2, 4]])
+        self.assertEqual(schedule([0.1, 0.1], batch_cost=1), [[0, 1]])
+        self.assertEqual(schedule([]), [])
+
+    def test_ties_keep_order(self):
+        self.assertEqual(schedule([2, 2, 2], batch_cost=1), [[0], [1], [2]])
+
+
+class CostModelTest(unittest.TestCase):
+
+    def test_estimate(self):
+        model = CostModel()
+        self.assertEqual(model.estimate('/a.py', 1000), 1000 * DEFAULT_SECONDS_PER_BYTE)
+        model.record('/a.py', 1000, 2.0)
+        model.record('/b.py', 3000, 2.0)
+        self.assertEqual(model.estimate('/a.py', 1000), 2.0)
+        self.assertEqual(model.estimate('/a.py', 2000), 4.0)
+        self.assertEqual(model.estimate('/c.py', 100), 0.1)
+
+    def test_persistence(self):
+        directory = tempfile.mkdtemp()
+        try:
+            model = CostModel.open(directory)
+            model.record('/a.py', 1000, 2.0)
+            model.save()
+            self.assertFalse(model.dirty)
+            self.assertEqual(CostModel.open(directory).times, {'/a.py': (1000, 2.0)})
+        finally:
+            shutil.rmtree(directory)
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 #  -*- coding: utf-8 -*-
 
+import os
+import shutil
 import logging
 import tempfile
 from StringIO import StringIO
@@ -10,6 +12,11 @@ except ImportError:
     import unittest
 
 from sona.search import SemanticSearcher, OutputFormatterBase, GrepOutputFormatter, return_sane_filepath
+from sona.budget import Budget
+from sona.schedule import CostModel
+from sona.index import SymbolIndex
+from sona.cache import ResultCache, RESULT_CACHE_FILENAME
+from sona.symbols import Symbol
 from astroid.nodes import Function
 import astroid.nodes
 
@@ -133,6 +140,26 @@ class SearchTest(unittest.TestCase):
         self.assert_(len(nodes) == 3)
         self.assertEqual(set([node.name for node in nodes]), set(['fn2', 'fn3', 'fn1']))
 
+    def test_search_many(self):
+        self.searcher.add_file(self.tmpfile_simple.name)
+        self.searcher.add_file(self.tmpfile_args.name)
+        queries = ['fn:name == "fn1"', 'fn:argcount == 2']
+        results = list(self.searcher.search_many(queries))
+        tagged = set([(query, node.name, node.root().file) for query, node in results])
+        self.assertSetEqual(tagged, set([
+                    ('fn:name == "fn1"', 'fn1', self.tmpfile_simple.name),
+                    ('fn:name == "fn1"', 'fn1', self.tmpfile_args.name),
+                    ('fn:argcount == 2', 'fn2', self.tmpfile_args.name),
+                    ('fn:argcount == 2', 'fn3', self.tmpfile_args.name),
+                    ]))
+        # Each query must give the same answer as if it had been
+        # searched for on its own.
+        def key(node):
+            return (node.root().file, node.lineno, node.name)
+        for query in queries:
+            self.assertSetEqual(set([key(node) for q, node in results if q == query]),
+                                set([key(node) for node in self.searcher.search(query)]))
+
 
 class AdvSearchTest(unittest.TestCase):
 
@@ -164,6 +191,184 @@ class Child(ParentOfChild):
         self.assertEqual(set([node.name for node in nodes]), set(['method']))
         self.assertEqual(set([node.parent.name for node in nodes]), set(['Child']))
 
+class AggregateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.searcher = SemanticSearcher()
+        self.tmpfile = tempfile.NamedTemporaryFile()
+        self.tmpfile.write("""
+class Foo(object):
+    def method(self):
+        download(1)
+        download(2)
+        upload(3)
+
+def fn():
+    download(4)
+""")
+        self.tmpfile.flush()
+        self.searcher.add_file(self.tmpfile.name)
+
+    def tearDown(self):
+        self.tmpfile = None
+
+    def test_count(self):
+        self.assertEqual(self.searcher.aggregate(['fn:call']),
+                         [('fn:call', None, 4)])
+        self.assertEqual(self.searcher.aggregate(['fn:call == "nothing"']),
+                         [('fn:call == "nothing"', None, 0)])
+
+    def test_group_by(self):
+        self.assertEqual(self.searcher.aggregate(['fn:call'], group_by='name'),
+                         [('fn:call', 'download', 3), ('fn:call', 'upload', 1)])
+        self.assertEqual(self.searcher.aggregate(['fn:call'], group_by='class'),
+                         [('fn:call', 'Foo', 3), ('fn:call', '', 1)])
+
+    def test_top(self):
+        self.assertEqual(self.searcher.aggregate(['fn:call'], group_by='name', top=1),
+                         [('fn:call', 'download', 3)])
+
+
+class BudgetSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpfile_simple = tempfile.NamedTemporaryFile()
+        self.tmpfile_simple.write(FUNCTIONS_STR)
+        self.tmpfile_simple.flush()
+        self.tmpfile_args = tempfile.NamedTemporaryFile()
+        self.tmpfile_args.write(FUNCTIONS_WITH_ARGS_STR)
+        self.tmpfile_args.flush()
+        self.size_limit = len(FUNCTIONS_STR)
+
+    def tearDown(self):
+        self.tmpfile_simple = None
+        self.tmpfile_args = None
+
+    def make_searcher(self, **kwargs):
+        searcher = SemanticSearcher(**kwargs)
+        searcher.add_file(self.tmpfile_simple.name)
+        searcher.add_file(self.tmpfile_args.name)
+        return searcher
+
+    def test_skip(self):
+        searcher = self.make_searcher(budget=Budget(max_size=self.size_limit))
+        nodes = list(searcher.search('fn:name'))
+        self.assertEqual([node.root().file for node in nodes],
+                         [self.tmpfile_simple.name] * 3)
+        self.assertEqual([filename for filename, reason in searcher.over_budget],
+                         [self.tmpfile_args.name])
+
+    def test_fallback(self):
+        budget = Budget(max_size=self.size_limit, fallback=True)
+        searcher = self.make_searcher(budget=budget)
+        results = list(searcher.search('fn:argcount == 2'))
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(isinstance(result, Symbol) for result in results))
+        self.assertEqual([result.text for result in results],
+                         ['def fn2(arg1, arg2)', 'def fn3(*myargs, **mykwargs)'])
+        self.assertEqual(len(searcher.over_budget), 1)
+
+    def test_jobs(self):
+        expected = [(node.root().file, node.lineno)
+                    for node in self.make_searcher().search('fn:name')]
+        results = list(self.make_searcher(jobs=2).search('fn:name'))
+        self.assertTrue(all(isinstance(result, Symbol) for result in results))
+        self.assertEqual([(result.filename, result.lineno) for result in results],
+                         expected)
+
+    def test_jobs_cost_model(self):
+        expected = [(node.root().file, node.lineno)
+                    for node in self.make_searcher().search('fn:name')]
+        model = CostModel()
+        # The second file is thought to be the slowest, so it is
+        # searched first; the results still come in order.
+        model.record(os.path.abspath(self.tmpfile_args.name), 1, 10.0)
+        searcher = self.make_searcher(jobs=2, cost_model=model)
+        self.assertEqual([(result.filename, result.lineno)
+                          for result in searcher.search('fn:name')], expected)
+        self.assertEqual(sorted(model.times), sorted(
+            os.path.abspath(name) for name in [self.tmpfile_simple.name,
+                                               self.tmpfile_args.name]))
+
+
+class OverlaySearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'module.py')
+        with open(self.filename, 'w') as f:
+            f.write(FUNCTIONS_STR)
+        self.virtual = os.path.join(self.tmpdir, 'virtual.py')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def search(self, query, **kwargs):
+        searcher = SemanticSearcher(**kwargs)
+        searcher.add_file(self.filename)
+        searcher.add_source(self.virtual, u'def fn4(a):\n    pass\n')
+        searcher.overlay(self.filename, FUNCTIONS_WITH_ARGS_STR)
+        return [(os.path.basename(result.filename if isinstance(result, Symbol)
+                                  else result.root().file), result.lineno)
+                for result in searcher.search(query)]
+
+    def test_add_source(self):
+        expected = [('module.py', 2), ('module.py', 3), ('module.py', 6), ('virtual.py', 1)]
+        self.assertEqual(self.search('fn:argcount in {1, 2}'), expected)
+        self.assertEqual(self.search('fn:argcount in {1, 2}', jobs=2), expected)
+        self.assertFalse(os.path.exists(self.virtual))
+
+    def test_index(self):
+        index = SymbolIndex.open(os.path.join(self.tmpdir, '.sona'))
+        index.update(self.filename)
+        index.save()
+        self.assertEqual(self.search('fn:name == "fn4"', index=index), [('virtual.py', 1)])
+        self.assertEqual(self.search('fn:argcount == 1', index=index),
+                         [('module.py', 6), ('virtual.py', 1)])
+        self.assertEqual(index.overlaid, set([self.filename, self.virtual]))
+        # Only what is on disk is saved.
+        reopened = SymbolIndex.open(os.path.join(self.tmpdir, '.sona'))
+        self.assertEqual(reopened.filenames(), [self.filename])
+        self.assertEqual([symbol.lineno for symbol in reopened.file_symbols(self.filename, 'fn')],
+                         [2, 3, 6])
+        searcher = SemanticSearcher(index=reopened)
+        searcher.add_file(self.filename)
+        self.assertEqual([symbol.argcount for symbol in searcher.search('fn:name')],
+                         [0, 0, 0])
+        self.assertFalse(reopened.dirty)
+
+    def test_cache(self):
+        cache = ResultCache.open(os.path.join(self.tmpdir, '.sona'))
+        self.assertEqual(self.search('fn:argcount == 2', result_cache=cache),
+                         [('module.py', 2), ('module.py', 3)])
+        searcher = SemanticSearcher(result_cache=cache)
+        searcher.add_file(self.filename)
+        self.assertEqual([result.lineno for result in searcher.search('fn:argcount == 2')],
+                         [])
+
+    def test_cache_file(self):
+        cache_dir = os.path.join(self.tmpdir, '.sona')
+        other = os.path.join(self.tmpdir, 'other.py')
+        with open(other, 'w') as f:
+            f.write('def on_disk():\n    pass\n')
+        for _ in range(2):
+            searcher = SemanticSearcher(result_cache=ResultCache.open(cache_dir))
+            searcher.add_files([self.filename, other])
+            searcher.add_source(self.virtual, 'def fn4(a):\n    pass\n')
+            searcher.overlay(self.filename, FUNCTIONS_WITH_ARGS_STR)
+            self.assertEqual([(os.path.basename(result.filename if isinstance(result, Symbol)
+                                                else result.root().file), result.lineno)
+                              for result in searcher.search('fn:name')],
+                             [('module.py', 2), ('module.py', 3), ('module.py', 6),
+                              ('other.py', 1), ('virtual.py', 1)])
+        with open(os.path.join(cache_dir, RESULT_CACHE_FILENAME), 'rb') as f:
+            saved = f.read()
+        self.assertIn('on_disk', saved)
+        # Neither the overlay nor the added source is on disk.
+        self.assertNotIn('fn4', saved)
+        self.assertNotIn("a='hello'", saved)
+
+
 class TestOutputFormatter(unittest.TestCase):
 
     def setUp(self):
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import shutil
+import logging
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona import segments
+from sona.index import SymbolIndex
+from sona.search import SemanticSearcher
+from sona.segments import can_split, split_symbols
+
+
+log = logging.getLogger(__name__)
+
+
+SOURCES = {
+    'pkg/__init__.py': 'from .util import helper, other\n',
+    'pkg/core.py': 'import os\nVALUE = 1\n\ndef get():\n    """Gets the value."""\n'
+                   '    return VALUE\n',
+    'pkg/util.py': 'from .core import VALUE, get\n\ndef helper():\n    return get()\n',
+    'app.py': 'from pkg import util\n\nclass App(object):\n    def run(self):\n'
+              '        util.helper()\n',
+    }
+
+QUERIES = [
+    'fn:name',
+    'var:ref == "VALUE"',
+    'fn:call; cls:name',
+    'fn:name =~ "^h"',
+    'fn:name ~ "gett"',
+    'mod:import == "pkg.core"',
+    'mod:dependents == "pkg.core"',
+    'doc:text contains "value"',
+    'fn:name except fn:parent == "App"',
+    ]
+
+
+class SegmentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filenames = []
+        for name, source in sorted(SOURCES.items()):
+            filename = os.path.join(self.tmpdir, name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'w') as f:
+                f.write(source)
+            self.filenames.append(filename)
+        self.index_dir = os.path.join(self.tmpdir, '.sona')
+        index = SymbolIndex.open(self.index_dir)
+        for filename in self.filenames:
+            index.update(filename)
+        index.save()
+        self.min_symbols = segments.MIN_SEGMENT_SYMBOLS
+        segments.MIN_SEGMENT_SYMBOLS = 1
+
+    def tearDown(self):
+        segments.MIN_SEGMENT_SYMBOLS = self.min_symbols
+        shutil.rmtree(self.tmpdir)
+
+    def search(self, query, jobs):
+        ss = SemanticSearcher(index=SymbolIndex.open(self.index_dir), jobs=jobs)
+        ss.add_files(self.filenames)
+        return [(os.path.relpath(result.filename, self.tmpdir), result.lineno, result.name)
+                for result in ss.search(query)]
+
+    def test_split_symbols(self):
+        table = SymbolIndex.open(self.index_dir).table
+        ranges = split_symbols(table, 3)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], table.n_symbols)
+        self.assertEqual([start for start, _ in ranges[1:]], [stop for _, stop in ranges[:-1]])
+        starts = set(table.file_start(number) for number in xrange(table.n_symbols))
+        self.assertTrue(set(start for start, _ in ranges) <= starts)
+        self.assertEqual(split_symbols(table, 1), [(0, table.n_symbols)])
+
+    def test_segment(self):
+        table = SymbolIndex.open(self.index_dir).table
+        ranges = split_symbols(table, 3)
+        self.assertEqual(sorted(symbol for start, stop in ranges
+                                for symbol in table.segment(start, stop).kind_symbols('fn')),
+                         sorted(table.kind_symbols('fn')))
+        self.assertEqual(table.segment(0, 0).lookup('fn', 'get'), [])
+        self.assertEqual(len(table.segment(0, table.n_symbols).lookup('fn', 'get')), 1)
+
+    def test_can_split(self):
+        index = SymbolIndex.open(self.index_dir)
+        self.assertTrue(can_split(index, 2))
+        self.assertFalse(can_split(index, 1))
+        with open(self.filenames[0], 'a') as f:
+            f.write('LIMIT = 2\n')
+        index.update(self.filenames[0])
+        self.assertFalse(can_split(index, 2))
+
+    def test_same_as_serial(self):
+        for query in QUERIES:
+            self.assertEqual(self.search(query, 3), self.search(query, 1), query)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import shutil
+import logging
+import tempfile
+import threading
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.snapshot import QueryService, IndexSnapshot
+from sona.search import JSONOutputFormatter
+from sona.exceptions import InvalidAssertionError
+
+
+log = logging.getLogger(__name__)
+
+
+MODULE1 = """
+TIMEOUT = 10
+
+def connect(host):
+    return open_socket(host, TIMEOUT)
+"""
+
+MODULE2 = """
+from module1 import TIMEOUT
+
+def wait():
+    sleep(TIMEOUT)
+"""
+
+
+class QueryServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filenames = []
+        for name, source in [('module1.py', MODULE1), ('module2.py', MODULE2)]:
+            filename = os.path.join(self.tmpdir, name)
+            with open(filename, 'w') as f:
+                f.write(source)
+            self.filenames.append(filename)
+        self.index_dir = os.path.join(self.tmpdir, '.sona')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def found(self, service, query):
+        return [(os.path.basename(symbol.filename), symbol.lineno)
+                for symbol in service.search(query)]
+
+    def test_search(self):
+        service = QueryService(self.index_dir)
+        self.assertEqual(service.generation, None)
+        self.assertEqual(service.search('fn:name'), [])
+        service.refresh(self.filenames)
+        self.assertEqual(service.generation, 0)
+        self.assertEqual(self.found(service, 'var:ref == "TIMEOUT"'),
+                         [('module1.py', 5), ('module2.py', 5)])
+        self.assertEqual(self.found(service, 'mod:import == "module1"'), [('module2.py', 2)])
+        self.assertEqual(self.found(service, 'fn:name ~ "wayt"'), [('module2.py', 4)])
+        with self.assertRaises(InvalidAssertionError):
+            service.search('"TIMEOUT"')
+
+    def test_refresh(self):
+        service = QueryService(self.index_dir)
+        old = service.refresh(self.filenames)
+        self.assertTrue(service.refresh(self.filenames) is old)
+        with open(self.filenames[1], 'w') as f:
+            f.write(MODULE2.replace('TIMEOUT', 'DELAY'))
+        new = service.refresh(self.filenames[1:])
+        self.assertEqual((old.generation, new.generation), (0, 1))
+        self.assertEqual(self.found(service, 'var:ref == "DELAY"'), [('module2.py', 5)])
+        # Queries that started on the old snapshot still see it.
+        self.assertEqual(sorted(os.path.basename(symbol.filename) for symbol in
+                                old.index().select('ref', None) if symbol.name == 'TIMEOUT'),
+                         ['module1.py', 'module2.py'])
+        self.assertEqual(QueryService(self.index_dir).generation, 1)
+
+    def test_concurrent_queries(self):
+        service = QueryService(self.index_dir)
+        service.refresh(self.filenames)
+        errors = []
+
+        def query():
+            for _ in range(50):
+                try:
+                    found = self.found(service, 'fn:name; mod:dependents == "module1"')
+                    # Either snapshot, never something in between.
+                    if found not in ([('module1.py', 4), ('module2.py', 2), ('module2.py', 4)],
+                                     [('module1.py', 4)]):
+                        errors.append(found)
+                except Exception, err:
+                    errors.append(err)
+
+        threads = [threading.Thread(target=query) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        refresh = service.refresh_in_background(self.filenames[:1])
+        for thread in threads + [refresh]:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(service.generation, 1)
+        self.assertEqual(self.found(service, 'fn:name'), [('module1.py', 4)])
+
+
+class JSONOutputFormatterTest(unittest.TestCase):
+
+    def test_store(self):
+        first, second = JSONOutputFormatter(), JSONOutputFormatter()
+        first.output({'lineno': 1})
+        self.assertEqual(second._store, [])
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import logging
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.source import SourceText, get_source_text, set_overlay
+from sona.search import SemanticSearcher, GrepOutputFormatter, return_sane_filepath
+
+
+log = logging.getLogger(__name__)
+
+
+SOURCE = """import os
+
+def fn1(a):
+    value = os.path.join(a,
+                         'b)c')
+    return value
+
+def fn2():
+    pass
+"""
+
+
+class SourceTextTest(unittest.TestCase):
+
+    def setUp(self):
+        self.source_text = SourceText(SOURCE)
+
+    def test_line(self):
+        self.assertEqual(len(self.source_text), 9)
+        self.assertEqual(self.source_text.line(1), 'import os')
+        self.assertEqual(self.source_text.line(9), '    pass')
+        self.assertEqual(self.source_text.line(10), '')
+        self.assertEqual(self.source_text.line(0), '')
+
+    def test_lines(self):
+        self.assertEqual(self.source_text.lines(8, 12),
+                         [(8, 'def fn2():'), (9, '    pass')])
+
+    def test_expression(self):
+        self.assertEqual(self.source_text.expression(4, 12),
+                         "os.path.join(a,\n                         'b)c')")
+        self.assertEqual(self.source_text.expression(6, 11), 'value')
+
+    def test_expression_trailers(self):
+        source_text = SourceText('r = a.b(1).c(2)[0]\nd[0](3) # )\n'
+                                 'x = e("(", \'\'\')\'\'\')\\\n    .f()\n')
+        self.assertEqual(source_text.expression(1, 4, 2), 'a.b(1)')
+        self.assertEqual(source_text.expression(1, 4, 4), 'a.b(1).c(2)')
+        self.assertEqual(source_text.expression(1, 4), 'a.b(1).c(2)[0]')
+        self.assertEqual(source_text.expression(2, 0, 2), 'd[0](3)')
+        self.assertEqual(source_text.expression(3, 4), 'e("(", \'\'\')\'\'\')\\\n    .f()')
+        self.assertEqual(source_text.expression(2, 0, 3), 'd[0](3)')
+
+    def test_cache(self):
+        tmpfile = tempfile.NamedTemporaryFile()
+        tmpfile.write(SOURCE)
+        tmpfile.flush()
+        source_text = get_source_text(tmpfile.name)
+        self.assertIs(get_source_text(tmpfile.name), source_text)
+        self.assertEqual(source_text.line(3), 'def fn1(a):')
+
+    def test_overlay(self):
+        tmpfile = tempfile.NamedTemporaryFile()
+        tmpfile.write(SOURCE)
+        tmpfile.flush()
+        set_overlay(tmpfile.name, 'import sys\n')
+        try:
+            self.assertEqual(get_source_text(tmpfile.name).line(1), 'import sys')
+        finally:
+            set_overlay(tmpfile.name, None)
+        self.assertEqual(get_source_text(tmpfile.name).line(1), 'import os')
+
+
+class ContextOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.searcher = SemanticSearcher()
+        self.tmpfile = tempfile.NamedTemporaryFile()
+        self.tmpfile.write(SOURCE)
+        self.tmpfile.flush()
+        self.searcher.add_file(self.tmpfile.name)
+
+    def make_formatter(self, **settings):
+        lines = []
+
+        class OutputFormatterTest(GrepOutputFormatter):
+
+            def output(self, s):
+                lines.append(s)
+
+        return OutputFormatterTest(**settings), lines
+
+    def test_call_snippet(self):
+        formatter, lines = self.make_formatter()
+        formatter.print_all_results(self.searcher.search('fn:call == "join"'))
+        filename = return_sane_filepath(self.tmpfile.name)
+        self.assertEqual(lines, ["./%s:4:call -> os.path.join(a, 'b)c')" % filename])
+
+    def test_chained_call_snippets(self):
+        tmpfile = tempfile.NamedTemporaryFile()
+        tmpfile.write('r = a.b(1).c(2)\nd[0](3)\nx.setdefault(k, {})\\\n    .append(v)\n')
+        tmpfile.flush()
+        searcher = SemanticSearcher()
+        searcher.add_file(tmpfile.name)
+        formatter, lines = self.make_formatter()
+        formatter.print_all_results(sorted(searcher.search('fn:call'),
+                                           key=lambda node: (node.lineno, len(node.as_string()))))
+        filename = return_sane_filepath(tmpfile.name)
+        self.assertEqual(lines, ['./%s:1:call -> a.b(1)' % filename,
+                                 './%s:1:call -> a.b(1).c(2)' % filename,
+                                 './%s:2:call -> d[0](3)' % filename,
+                                 './%s:3:call -> x.setdefault(k, {})' % filename,
+                                 './%s:3:call -> x.setdefault(k, {}) .append(v)' % filename])
+
+    def test_context(self):
+        formatter, lines = self.make_formatter(before_context=1, after_context=1)
+        formatter.print_all_results(self.searcher.search('fn:name'))
+        filename = return_sane_filepath(self.tmpfile.name)
+        self.assertEqual(lines, [
+                './%s-2-' % filename,
+                './%s:3:def fn1(a)' % filename,
+                './%s-4-    value = os.path.join(a,' % filename,
+                '--',
+                './%s-7-' % filename,
+                './%s:8:def fn2()' % filename,
+                './%s-9-    pass' % filename,
+                ])
+
+    def test_overlapping_context(self):
+        formatter, lines = self.make_formatter(after_context=4)
+        formatter.print_all_results(self.searcher.search('fn:name'))
+        filename = return_sane_filepath(self.tmpfile.name)
+        self.assertEqual([line.split('\n')[0][len(filename) + 2:] for line in lines],
+                         [':3:def fn1(a)', '-4-    value = os.path.join(a,',
+                          "-5-                         'b)c')", '-6-    return value',
+                          '-7-', ':8:def fn2()', '-9-    pass'])
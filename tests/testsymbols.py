@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import logging
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.symbols import extract_symbols
+from sona.search import SemanticSearcher
+from sona.parser import AssertionParser
+from sona.indexer import Indexer
+
+
+log = logging.getLogger(__name__)
+
+
+SOURCE = """
+class Base(object):
+    pass
+
+class Child(Base, mixins.Mixin):
+    @decorator
+    def method(self, a, *args):
+        value = helper(a)
+        self.value = value
+
+def fn1(a, b='hello', **kwargs):
+    for x in range(a):
+        print obj.call(x)
+
+def fn2():
+    pass
+"""
+
+QUERIES = [
+    'fn:name',
+    'fn:name == "method"',
+    'fn:argcount in {0, 3}',
+    'fn:parent == "Child"',
+    'fn:call',
+    'fn:call == "call"',
+    'cls:name',
+    'cls:parent == "Base"',
+    'cls:parent != "object"',
+    'cls:method == "Child"',
+    'var:name',
+    'var:name == "x", fn:parent == "fn1"',
+    'var:ref',
+    'var:ref in {"a", "value"}',
+    ]
+
+
+class SymbolExtractorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpfile = tempfile.NamedTemporaryFile(suffix='.py')
+        self.tmpfile.write(SOURCE)
+        self.tmpfile.flush()
+
+    def tearDown(self):
+        self.tmpfile = None
+
+    def test_symbols(self):
+        symbols = extract_symbols(self.tmpfile.name)
+        kinds = set((symbol.kind, symbol.name) for symbol in symbols)
+        self.assertTrue(('fn', 'method') in kinds)
+        self.assertTrue(('cls', 'Child') in kinds)
+        self.assertTrue(('var', 'value') in kinds)
+        self.assertTrue(('call', 'helper') in kinds)
+        # Arguments are not assignments.
+        self.assertFalse(('var', 'a') in kinds)
+        method = [symbol for symbol in symbols if symbol.name == 'method'].pop()
+        self.assertEqual(method.text, 'def method(self, a, *args)')
+        self.assertEqual(method.parent, 'Child')
+        self.assertEqual(method.argcount, 3)
+        child = [symbol for symbol in symbols if symbol.name == 'Child'].pop()
+        self.assertEqual(child.bases, ('Base', 'Mixin'))
+
+    def test_docstrings(self):
+        symbols = extract_symbols('/src/mod.py', '"""Module."""\n\n'
+                                  'def fn():\n    """Does it."""\n\nclass Cls:\n    pass\n')
+        self.assertEqual([(symbol.kind, symbol.name, symbol.doc) for symbol in symbols],
+                         [('mod', 'mod', 'Module.'), ('fn', 'fn', 'Does it.'),
+                          ('cls', 'Cls', None)])
+        self.assertEqual(symbols[0].text, 'module -> """Module."""')
+
+    def test_same_as_indexer(self):
+        # The fallback extractor must find the same things the
+        # Indexer does; only the text displayed may differ.
+        symbols = extract_symbols(self.tmpfile.name)
+        indexer = Indexer(self.tmpfile.name)
+        for query in QUERIES:
+            tree = AssertionParser(query).tree
+            nodes = SemanticSearcher._find_query_in_module(tree, query, indexer)
+            found = SemanticSearcher._find_query_in_symbols(tree, query, symbols)
+            self.assertEqual(sorted(node.lineno for node in nodes),
+                             sorted(symbol.lineno for symbol in found),
+                             query)
+
+    def test_constants(self):
+        source = 'x = None\nif x is True:\n    y = False\n'
+        symbols = extract_symbols('/src/mod.py', source)
+        indexer = Indexer('/src/mod.py', source)
+        for query in ['var:ref', 'var:ref == "None"']:
+            tree = AssertionParser(query).tree
+            nodes = SemanticSearcher._find_query_in_module(tree, query, indexer)
+            found = SemanticSearcher._find_query_in_symbols(tree, query, symbols)
+            self.assertEqual(sorted((node.name, node.lineno) for node in nodes),
+                             sorted((symbol.name, symbol.lineno) for symbol in found),
+                             query)
+        self.assertEqual([symbol.name for symbol in symbols if symbol.kind == 'ref'], ['x'])
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import shutil
+import logging
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.symbols import extract_symbols
+from sona.symtable import SymbolTable, write_symbol_table
+from sona.exceptions import InvalidIndexError
+
+
+log = logging.getLogger(__name__)
+
+
+SOURCE = """
+import os.path
+
+class Base(object):
+    pass
+
+class Empty():
+    pass
+
+class Child(Base, object):
+    LIMIT = -1
+
+    def run(self, path, *args):
+        return os.path.join(path, self.LIMIT)
+"""
+
+DIGEST = '0123456789abcdef0123456789abcdef01234567'
+
+
+class SymbolTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'symbols.idx')
+        self.symbols = [symbol._replace(text=None)
+                        for symbol in extract_symbols('/src/mod.py', SOURCE)]
+        other = extract_symbols('/src/other.py', 'def run():\n    pass\n')
+        self.other = [symbol._replace(text=None) for symbol in other]
+        write_symbol_table(self.path, [('/src/other.py', DIGEST, other),
+                                       ('/src/mod.py', DIGEST, self.symbols),
+                                       ('/src/empty.py', DIGEST, [])], 3)
+        self.table = SymbolTable(self.path)
+
+    def tearDown(self):
+        self.table.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        self.assertEqual(self.table.generation, 3)
+        self.assertEqual(self.table.filenames(),
+                         ['/src/empty.py', '/src/mod.py', '/src/other.py'])
+        self.assertEqual(self.table.file_symbols('/src/mod.py'), self.symbols)
+        self.assertEqual(self.table.file_symbols('/src/empty.py'), [])
+        self.assertEqual(self.table.file_symbols('/src/missing.py'), [])
+        self.assertEqual(self.table.digest('/src/mod.py'), DIGEST)
+        self.assertEqual(self.table.digest('/src/missing.py'), None)
+
+    def test_bases(self):
+        bases = dict((symbol.name, symbol.bases)
+                     for symbol in self.table.file_symbols('/src/mod.py', 'cls'))
+        self.assertEqual(bases, {'Base': ('object',), 'Empty': (),
+                                 'Child': ('Base', 'object')})
+
+    def test_lookup(self):
+        self.assertEqual([(symbol.filename, symbol.parent)
+                          for symbol in self.table.lookup('fn', 'run')],
+                         [('/src/mod.py', 'Child'), ('/src/other.py', 'other')])
+        self.assertEqual(self.table.lookup('cls', 'run'), [])
+        self.assertEqual(self.table.lookup('fn', 'missing'), [])
+        self.assertEqual(self.table.lookup('fn', 1), [])
+        self.assertEqual(self.table.lookup('mod', 'run'), [])
+
+    def test_kind_symbols(self):
+        for kind in ['fn', 'cls', 'var', 'ref', 'call', 'import']:
+            expected = [symbol for symbol in self.symbols + self.other
+                        if symbol.kind == kind]
+            self.assertEqual(sorted(self.table.kind_symbols(kind)), sorted(expected), kind)
+
+    def test_search(self):
+        found = self.table.search('fn', lambda name: 'ru' in name, set(['run']))
+        self.assertEqual([(symbol.filename, symbol.name) for symbol in found],
+                         [('/src/mod.py', 'run'), ('/src/other.py', 'run')])
+        self.assertEqual(self.table.search('fn', lambda name: True, set(['xyz'])), [])
+        self.assertEqual(self.table.search('cls', lambda name: name.endswith('e'), set()),
+                         self.table.lookup('cls', 'Base'))
+        self.assertEqual(self.table.search('cls', lambda name: True, set(['Bas'])),
+                         self.table.lookup('cls', 'Base'))
+
+    def test_closest(self):
+        self.assertEqual([(symbol.filename, symbol.name)
+                          for symbol in self.table.closest('fn', 'rum', 1)],
+                         [('/src/mod.py', 'run'), ('/src/other.py', 'run')])
+        self.assertEqual(self.table.closest('cls', 'Chi', 1), [])
+        self.assertEqual(self.table.closest('cls', 'Chi', 2),
+                         self.table.lookup('cls', 'Child'))
+
+    def test_documented(self):
+        write_symbol_table(self.path, [('/src/doc.py', DIGEST, extract_symbols(
+            '/src/doc.py', 'def get():\n    """Gets the value, or None."""\n'))], 4)
+        table = SymbolTable(self.path)
+        self.assertEqual([(symbol.name, symbol.doc) for symbol in
+                          table.documented(set(['gets', 'none']))],
+                         [('get', 'Gets the value, or None.')])
+        self.assertEqual(table.documented(set(['gets', 'set'])), [])
+        table.close()
+
+    def test_enclosing(self):
+        self.assertEqual([symbol.name for symbol in self.table.enclosing('/src/mod.py', 14)],
+                         ['mod', 'Child', 'run'])
+        self.assertEqual([symbol.name for symbol in
+                          self.table.enclosing('/src/mod.py', 13, 0)], ['mod', 'Child'])
+        self.assertEqual(self.table.enclosing('/src/mod.py', 14)[-1],
+                         self.table.lookup('fn', 'run')[0])
+        self.assertEqual([symbol.name for symbol in self.table.enclosing('/src/other.py', 2)],
+                         ['other', 'run'])
+        self.assertEqual(self.table.enclosing('/src/empty.py', 1), [])
+        self.assertEqual(self.table.enclosing('/src/missing.py', 1), [])
+
+    def test_find_string(self):
+        self.assertEqual(self.table.string(self.table.find_string('Child')), 'Child')
+        self.assertEqual(self.table.find_string('Missing'), None)
+        self.assertEqual(self.table.find_string(''), 0)
+
+    def test_invalid(self):
+        for contents in ['', 'not a symbol table at all',
+                         open(self.path, 'rb').read()[:-1]]:
+            with open(self.path, 'wb') as f:
+                f.write(contents)
+            with self.assertRaises(InvalidIndexError):
+                SymbolTable(self.path)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import logging
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.trigram import trigrams, required_literals, query_trigrams
+
+
+log = logging.getLogger(__name__)
+
+
+class TrigramTest(unittest.TestCase):
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams('cache'), set(['cac', 'ach', 'che']))
+        self.assertEqual(trigrams('ab'), set())
+
+    def test_required_literals(self):
+        self.assertEqual(required_literals('.*Handler$'), ['Handler'])
+        self.assertEqual(required_literals('^get_(user)s?_id'), ['get_user', '_id'])
+        self.assertEqual(required_literals('foo|bar'), [])
+        self.assertEqual(required_literals('(?i)handler'), [])
+        self.assertEqual(required_literals('[a-z]+'), [])
+
+    def test_query_trigrams(self):
+        self.assertEqual(query_trigrams('contains', 'cache'), trigrams('cache'))
+        self.assertEqual(query_trigrams('=~', 'Re.Handler'), trigrams('Handler'))
+        self.assertEqual(query_trigrams('=~', 'a.b'), set())
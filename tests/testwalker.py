@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import os
+import shutil
+import logging
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.walker import DirectoryWalker
+from sona.search import SemanticSearcher
+
+
+log = logging.getLogger(__name__)
+
+
+TREE = {
+    'a.py': 'def fn_a(): pass\n',
+    'notes.txt': 'def not_python(): pass\n',
+    'pkg/b.py': 'def fn_b(): pass\n',
+    'pkg/sub/c.py': 'def fn_c(): pass\n',
+    '.tox/py27/d.py': 'def fn_d(): pass\n',
+    'node_modules/e.py': 'def fn_e(): pass\n',
+    'env/pyvenv.cfg': '',
+    'env/lib/f.py': 'def fn_f(): pass\n',
+    }
+
+
+class DirectoryWalkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for path, contents in TREE.items():
+            fullpath = os.path.join(self.root, path)
+            if not os.path.isdir(os.path.dirname(fullpath)):
+                os.makedirs(os.path.dirname(fullpath))
+            with open(fullpath, 'w') as f:
+                f.write(contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def relative(self, filenames):
+        return set(os.path.relpath(filename, self.root) for filename in filenames)
+
+    def relative_list(self, filenames):
+        return [os.path.relpath(filename, self.root) for filename in filenames]
+
+    def test_walk(self):
+        walker = DirectoryWalker()
+        self.assertSetEqual(self.relative(walker.walk(self.root)),
+                            set(['a.py', 'pkg/b.py', 'pkg/sub/c.py']))
+
+    def test_excludes(self):
+        walker = DirectoryWalker(excludes=['su*'])
+        self.assertSetEqual(self.relative(walker.walk(self.root)),
+                            set(['a.py', 'pkg/b.py',
+                                 '.tox/py27/d.py', 'node_modules/e.py']))
+        walker = DirectoryWalker(excludes=[], skip_virtualenvs=False)
+        self.assertEqual(len(list(walker.walk(self.root))), 6)
+
+    def test_order(self):
+        os.mkdir(os.path.join(self.root, 'pkg2'))
+        for path in ['pkg/a.py', 'pkg/z.py', 'pkg/sub/b.py', 'pkg2/a.py', 'z.py']:
+            with open(os.path.join(self.root, path), 'w') as f:
+                f.write('')
+        expected = ['a.py', 'z.py', 'pkg/a.py', 'pkg/b.py', 'pkg/z.py',
+                    'pkg/sub/b.py', 'pkg/sub/c.py', 'pkg2/a.py']
+        for workers in [1, 8, 8, 8]:
+            walker = DirectoryWalker(workers=workers)
+            self.assertEqual([os.path.relpath(filename, self.root)
+                              for filename in walker.walk(self.root)], expected)
+
+    def test_explicit_paths(self):
+        walker = DirectoryWalker()
+        paths = [os.path.join(self.root, 'notes.txt'),
+                 os.path.join(self.root, 'env'),
+                 os.path.join(self.root, 'pkg', '*')]
+        self.assertSetEqual(self.relative(walker.iter_files(paths)),
+                            set(['notes.txt', 'env/lib/f.py',
+                                 'pkg/b.py', 'pkg/sub/c.py']))
+
+    def test_overlapping_roots(self):
+        walker = DirectoryWalker()
+        pkg = os.path.join(self.root, 'pkg')
+        sub = os.path.join(pkg, 'sub')
+        for roots in [[pkg, sub], [sub, pkg], [pkg, pkg + os.sep]]:
+            self.assertEqual(sorted(self.relative_list(walker.walk(*roots))),
+                             ['pkg/b.py', 'pkg/sub/c.py'])
+        # A root is walked in its turn, even under an excluded directory.
+        tox = os.path.join(self.root, '.tox')
+        self.assertEqual(self.relative_list(walker.walk(self.root, tox)),
+                         ['a.py', 'pkg/b.py', 'pkg/sub/c.py', '.tox/py27/d.py'])
+
+    def test_file_and_directory(self):
+        walker = DirectoryWalker()
+        a = os.path.join(self.root, 'a.py')
+        self.assertEqual(self.relative_list(walker.iter_files([a, self.root, a])),
+                         ['a.py', 'pkg/b.py', 'pkg/sub/c.py'])
+
+    def test_search_file_source(self):
+        searcher = SemanticSearcher()
+        searcher.add_file_source(DirectoryWalker().walk(self.root))
+        self.assertEqual(searcher.files, [])
+        names = set(node.name for node in searcher.search('fn:name'))
+        self.assertSetEqual(names, set(['fn_a', 'fn_b', 'fn_c']))
+        self.assertEqual(len(searcher.files), 3)
+        # The source is drained, but the files it found are kept.
+        names = set(node.name for node in searcher.search('fn:name'))
+        self.assertSetEqual(names, set(['fn_a', 'fn_b', 'fn_c']))
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+import logging
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sona.words import DocText, words
+
+
+log = logging.getLogger(__name__)
+
+
+class WordsTest(unittest.TestCase):
+
+    def test_words(self):
+        self.assertEqual(words('Fetches a URL; see fetch_url().'),
+                         set(['fetches', 'a', 'url', 'see', 'fetch_url']))
+        self.assertEqual(words(''), set())
+
+    def test_doc_text(self):
+        doc = DocText('Deprecated: use the new API instead.')
+        self.assertTrue('deprecated' in doc)
+        self.assertTrue('api DEPRECATED' in doc)
+        self.assertFalse('deprecate' in doc)
+        self.assertFalse(None in doc)
+        self.assertEqual(doc, 'Deprecated: use the new API instead.')